@@ -1,94 +1,815 @@
 import os
 import json
-from flask import Flask, request, jsonify, render_template
+import time
+import hmac
+import base64
+import shutil
+import hashlib
+import tempfile
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from flask import Flask, request, jsonify, render_template, g, Response, stream_with_context
+from werkzeug.datastructures import FileStorage
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
+# Log through a background writer thread (LOG_LEVEL, LOG_FORMAT, LOG_DEBUG_SAMPLE_RATE)
+from utils.logger import setup_logging, get_logger, set_request_id, clear_request_id
+setup_logging()
+
 # Import modules
 from models.settings import load_settings, save_settings, update_settings
-from models.model_info import load_models, get_model_info, is_same_multimodal_model
-from utils.prompt_utils import get_system_prompt
+from models.model_info import load_models, get_model_info, get_fallback_model, is_same_multimodal_model
+from utils.prompt_utils import get_system_prompt, STRUCTURED_RESPONSE_FORMAT
 from utils.audio_utils import audio_to_base64, is_audio_too_large
 from utils.tool_executor import ToolExecutor
+from utils.response_parser import parse_response
+from utils.intent_matcher import IntentMatcher
+from utils.tool_retriever import ToolRetriever
+from utils.timing import RequestTimer, span, add_span
+from utils import metrics
+from utils.profiler import SamplingProfiler, to_collapsed, to_speedscope
 from services.service_factory import ServiceFactory
+from services.admission import controller as admission, Overloaded, LANES, set_lane
+from services.brownout import controller as brownout
+from services.rate_limit import limiter as rate_limiter, RateLimited
+from services import http_client
+from services.idempotency import store as idempotency
+from services.jobs import queue as jobs, QueueFull
+from services import cancellation
+from services.cancellation import manager as cancellations
+from services.uploads import store as uploads, UploadError
+from services.speech_factory import SpeechFactory
+from services.speech import synthesize_sentences, spoken_text
+
+logger = get_logger(__name__)
+
+# Initialize Flask app
+app = Flask(__name__)
+
+# Load settings and models
+SETTINGS = load_settings()
+MODELS = load_models()
+
+# Apply the provider concurrency limits, the brownout thresholds, the client rate limits and coalescing
+admission.configure(SETTINGS.get("admission"))
+brownout.configure(SETTINGS.get("brownout"))
+rate_limiter.configure(SETTINGS.get("rate_limit"))
+http_client.coalescer.enabled = SETTINGS.get("coalescing", {}).get("enabled", True)
+idempotency.configure(SETTINGS.get("idempotency"))
+jobs.configure(SETTINGS.get("jobs"))
+cancellations.configure(SETTINGS.get("cancellation"))
+uploads.configure(SETTINGS.get("uploads"))
+
+# The admission priority lane of each endpoint's provider calls
+ENDPOINT_LANES = {"transcribe": "interactive", "transcribe_stream": "interactive", "finalize_upload": "interactive",
+                  "chat": "interactive", "chat_batch": "bulk"}
+
+# Endpoints whose requests can be cancelled, by a client disconnect or /cancel/<request_id>
+CANCELLABLE_ENDPOINTS = ("transcribe", "transcribe_stream", "finalize_upload", "chat")
+
+# Initialize tool executor; tools run once per Idempotency-Key, and not at all for cancelled requests
+tool_executor = ToolExecutor(claims=idempotency, cancellation=cancellation)
+
+# Initialize the local intent matcher from the tool manifests
+intent_matcher = IntentMatcher(tool_executor.manifests)
+
+def create_tool_retriever(settings):
+    """
+    Build the tool retrieval index from the tool descriptions in the settings.
+    
+    Args:
+        settings (dict): The application settings.
+        
+    Returns:
+        ToolRetriever: The retriever.
+    """
+    descriptions = settings.get("system_prompt", {}).get("tools", {}).get("descriptions", [])
+    return ToolRetriever(descriptions, tool_executor.manifests)
+
+# Initialize the tool retriever used to keep the system prompt small
+tool_retriever = create_tool_retriever(SETTINGS)
+
+# On-demand profiler for the admin endpoints; idle unless started
+profiler = SamplingProfiler()
+
+def select_tools(query=None):
+    """
+    Select the tools that are relevant to the query.
+    
+    Args:
+        query (str, optional): The user message or transcript. Defaults to None (include all tools).
+        
+    Returns:
+        list: The selected tool names, None if tool selection is disabled (all tools), or an empty
+              list if brownout drops the tools from the prompt.
+    """
+    # Under load the tool section is one of the prompt parts that can be dropped
+    if brownout.drops("tools"):
+        return []
+    
+    tool_selection = SETTINGS.get("tool_selection", {})
+    if not tool_selection.get("enabled", True):
+        return None
+    
+    tool_names, info = tool_retriever.select(query, tool_selection.get("top_k", 5))
+    logger.debug("Tool selection: %d/%d tools in prompt, fallback=%s, ~%d prompt tokens saved",
+                 info["selected"], info["total"], info["fallback"], info["prompt_tokens_saved"])
+    
+    return tool_names
+
+def build_system_prompt(language, model_id, query=None, prompts=None):
+    """
+    Get the system prompt with only the tools that are relevant to the query.
+    
+    Args:
+        language (str): The language to respond in.
+        model_id (str): The model ID the prompt is for.
+        query (str, optional): The user message or transcript. Defaults to None (include all tools).
+        prompts (dict, optional): Compiled prompts to reuse, see compile_system_prompt(). Defaults to None.
+        
+    Returns:
+        str: The system prompt.
+    """
+    return compile_system_prompt(language, model_id, select_tools(query), prompts=prompts)
+
+def compile_system_prompt(language, model_id, tool_names, native_tools=False, prompts=None):
+    """
+    Get a system prompt, reusing one compiled earlier for the same language, model and tools.
+    
+    Compiling a prompt reads the settings file, so callers that build many prompts at once, like
+    the items of a batch, share a cache.
+    
+    Args:
+        language (str): The language to respond in.
+        model_id (str): The model ID the prompt is for.
+        tool_names (list): The tools to describe, as returned by select_tools().
+        native_tools (bool, optional): Whether the tools go through native function calling. Defaults to False.
+        prompts (dict, optional): The cache. Defaults to None (always compile).
+        
+    Returns:
+        str: The system prompt.
+    """
+    if prompts is None:
+        return get_system_prompt(language, model_id, tool_names, native_tools=native_tools)
+    
+    key = (language, model_id, tuple(tool_names) if tool_names is not None else None, native_tools)
+    prompt = prompts.get(key)
+    if prompt is None:
+        prompt = prompts[key] = get_system_prompt(language, model_id, tool_names, native_tools=native_tools)
+    return prompt
 
-def extract_response_and_tool_use(ai_response):
+def uses_native_tools(model_info):
     """
-    Extract the response and tool_use from an AI response.
+    Check whether tool calls for a model should go through provider-native function calling.
     
     Args:
-        ai_response (str): The AI response to extract from.
+        model_info (dict): The model information dictionary.
         
     Returns:
-        tuple: (response_text, tool_use) - The extracted response text and tool_use directive.
-    """
-    # Remove any prefix like "Here is my response in JSON format:"
-    if "Here is my response in JSON format:" in ai_response:
-        ai_response = ai_response.replace("Here is my response in JSON format:", "").strip()
-        print("Removed 'Here is my response in JSON format:' prefix")
-    
-    response_text = None
-    tool_use = None
-    
-    # First, check if the response contains a JSON code block
-    if "```json" in ai_response and "```" in ai_response:
-        print("Detected JSON code block in response")
-        # Extract the JSON part
-        start_idx = ai_response.find("```json") + 7
-        end_idx = ai_response.find("```", start_idx)
-        
-        if start_idx > 6 and end_idx > start_idx:
-            json_str = ai_response[start_idx:end_idx].strip()
-            print(f"Extracted JSON string: {json_str[:100]}...")
+        bool: True if the model supports native tools and the text mode isn't forced in the settings.
+    """
+    return SETTINGS.get("tool_calling", "auto") != "text" and model_info.get("native_tools", False)
+
+def get_native_response(model_info, model_id, language, query, user_content, prompts=None):
+    """
+    Get an AI response using provider-native function calling and structured output.
+    
+    Tool calls arrive as typed arguments and are executed directly, so the response text doesn't
+    have to be parsed for 'tool_use' directives.
+    
+    Args:
+        model_info (dict): The model information dictionary.
+        model_id (str): The model ID to use.
+        language (str): The language to respond in.
+        query (str): The user message or transcript, used to select tools.
+        user_content (str): The user message to send to the model.
+        prompts (dict, optional): Compiled prompts to reuse, see compile_system_prompt(). Defaults to None.
+        
+    Returns:
+        dict: The result, with "ai_response" (including any tool output) and "status".
+    """
+    with span("prompt"):
+        tool_names = select_tools(query)
+        system_prompt = compile_system_prompt(language, model_id, tool_names, native_tools=True, prompts=prompts)
+        tools = tool_executor.get_tool_declarations(tool_names)
+    
+    service = ServiceFactory.create_service_for_model(model_info)
+    provider = model_info["provider"]
+    
+    with span("response"):
+        result = request_native_completion(service, provider, model_id, system_prompt, user_content, tools)
+    
+    if result["status"] != "success":
+        return result
+    
+    # Structured (OpenAI) and plain text replies both parse in a single pass
+    with span("parse"):
+        ai_response = parse_response(result["content"]).response if result["content"] else ""
+    
+    tool_calls = result.get("tool_calls", [])
+    if tool_calls:
+        logger.info("Native tool calls: %s", tool_calls)
+        
+        # Models often send only the tool call, so fall back to the tool's canned reply
+        if not ai_response:
+            replies = tool_executor.manifests.get(tool_calls[0]["name"], {}).get("replies", {})
+            ai_response = replies.get(language) or replies.get("en", "")
+        
+        with span("tools"):
+            tool_result = tool_executor.execute_tool_calls(tool_calls)
+        if tool_result["message"]:
+            ai_response += tool_result["message"]
+    
+    return {"ai_response": ai_response, "status": "success"}
+
+def request_native_completion(service, provider, model_id, system_prompt, user_content, tools):
+    """
+    Send a request with native tool declarations to the response model.
+    
+    Args:
+        service: The service instance for the model.
+        provider (str): The provider of the model.
+        model_id (str): The model ID to use.
+        system_prompt (str): The system prompt.
+        user_content (str): The user message.
+        tools (list): The tool declarations.
+        
+    Returns:
+        dict: The service result, with "content" and "tool_calls" on success.
+    """
+    if provider == "Google":
+        return service.generate_content(f"{system_prompt}\n\n{user_content}", model_id, tools=tools)
+    else:
+        messages = [
+            {
+                "role": "system",
+                "content": system_prompt
+            },
+            {
+                "role": "user",
+                "content": user_content
+            }
+        ]
+        
+        # OpenAI enforces the response schema; other providers reply in plain text
+        response_format = STRUCTURED_RESPONSE_FORMAT if provider == "OpenAI" else None
+        return service.get_chat_completion(messages, model_id, response_format, tools)
+
+def append_tool_output(ai_response, tool_calls):
+    """
+    Execute the requested tools and append their output to the AI response.
+    
+    Args:
+        ai_response (str): The AI response text.
+        tool_calls (list): The requested tools as (tool_name, args) tuples.
+        
+    Returns:
+        str: The AI response with the tool output appended.
+    """
+    if not tool_calls:
+        return ai_response
+    
+    with span("tools"):
+        tool_result = tool_executor.run_tools(tool_calls)
+    if tool_result["message"]:
+        ai_response += tool_result["message"]
+    
+    return ai_response
+
+def try_intent_fast_path(text, language=None):
+    """
+    Answer a message locally when it clearly asks for a tool, skipping the LLM round trip.
+    
+    Args:
+        text (str): The user message or transcript.
+        language (str, optional): The requested response language. Defaults to None.
+        
+    Returns:
+        str: The canned reply with the tool output appended, or None if the fast path does not apply.
+    """
+    fast_path_settings = SETTINGS.get("intent_fast_path", {})
+    if not fast_path_settings.get("enabled", True):
+        return None
+    
+    start = time.perf_counter()
+    with span("fast_path"):
+        intent = intent_matcher.match(text)
+        threshold = fast_path_settings.get("threshold", 0.75)
+        
+        reply = None
+        if intent and intent.confidence >= threshold:
+            reply = intent_matcher.get_reply(intent, language, text)
+        
+        if reply is not None:
+            tool_result = tool_executor.execute_tools(f"tool_use: [{intent.tool_name}]")
+            if tool_result["message"]:
+                reply += tool_result["message"]
+    
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    rate = intent_matcher.record(reply is not None, elapsed_ms)
+    
+    if reply is not None:
+        logger.info("Intent fast path hit: %s in %.2f ms (fast-path rate %.1f%%)", intent, elapsed_ms, rate * 100)
+    else:
+        logger.debug("Intent fast path miss: %s in %.2f ms (fast-path rate %.1f%%)", intent, elapsed_ms, rate * 100)
+    
+    return reply
+
+def answer_message(user_message, language, response_model_id, prompts=None):
+    """
+    Get the AI response to a text message, with the output of any tools it asks for.
+    
+    Args:
+        user_message (str): The message.
+        language (str): The language to respond in, or None.
+        response_model_id (str): The response model to use.
+        prompts (dict, optional): Compiled system prompts to reuse, see compile_system_prompt().
+                                  Defaults to None.
+        
+    Returns:
+        dict: The result, with "ai_response" and "status", or "error" and "code" (the HTTP status) on failure.
+    """
+    # Answer clear tool requests locally without calling the response model
+    fast_reply = try_intent_fast_path(user_message, language)
+    if fast_reply is not None:
+        return {"ai_response": fast_reply, "status": "success"}
+    
+    response_model_info = get_model_info(response_model_id, MODELS)
+    if not response_model_info:
+        return {"error": f"Model not found: {response_model_id}", "code": 400, "status": "error"}
+    
+    # Use provider-native tool calling when the model supports it
+    if uses_native_tools(response_model_info):
+        native_result = get_native_response(response_model_info, response_model_id, language, user_message,
+                                            user_message, prompts)
+        if native_result["status"] != "success":
+            return {"error": native_result.get("error", "Failed to get AI response"), "code": 500, "status": "error"}
+        
+        return native_result
+    
+    # Create a service instance for the response model
+    response_service = ServiceFactory.create_service_for_model(response_model_info)
+    
+    # Get the system prompt
+    with span("prompt"):
+        system_prompt = build_system_prompt(language, response_model_id, user_message, prompts)
+        
+        # Get the response based on the provider
+    with span("response"):
+        if response_model_info["provider"] == "Google":
+            user_message_with_prompt = f"{system_prompt}\n\nPlease respond to this message. Format your response as JSON with 'response' and 'tool_use' fields. If I'm asking about dancing, include 'tool_use: [dance]' in your response.\n\n{user_message}"
+            response_result = response_service.generate_content(user_message_with_prompt, response_model_id)
+        else:
+            # For OpenAI and OpenRouter, use the chat completion API
+            messages = [
+                {
+                    "role": "system",
+                    "content": system_prompt
+                },
+                {
+                    "role": "user",
+                    "content": user_message
+                }
+            ]
             
-            try:
-                # Parse the JSON string
-                json_response = json.loads(json_str)
-                
-                # Extract just the response part
-                if "response" in json_response:
-                    response_text = json_response["response"]
-                    print(f"Extracted response from JSON code block: {response_text[:100]}...")
-                
-                # Extract tool_use if present
-                if "tool_use" in json_response:
-                    tool_use = json_response["tool_use"]
-                    print(f"Extracted tool_use from JSON code block: {tool_use}")
-            except json.JSONDecodeError as e:
-                print(f"Error parsing JSON from code block: {e}")
-    
-    # If we couldn't extract from a JSON code block, try parsing as JSON object
-    if response_text is None:
+            response_format = {"type": "json_object"} if response_model_info["provider"] == "OpenAI" else None
+            response_result = response_service.get_chat_completion(messages, response_model_id, response_format)
+    
+    # Check if the response was successful
+    if response_result["status"] != "success":
+        return {"error": response_result.get("error", "Failed to get AI response"), "code": 500, "status": "error"}
+    
+    # Parse the AI response once into its response text and tool calls
+    with span("parse"):
+        envelope = parse_response(response_result["content"])
+    logger.debug("Parsed AI response: %r", envelope)
+    
+    return {"ai_response": append_tool_output(envelope.response, envelope.tool_calls), "status": "success"}
+
+def get_batch_messages():
+    """Return the "messages" list of a /chat/batch request, or an empty list if it has none."""
+    data = request.get_json(silent=True)
+    messages = data.get("messages") if isinstance(data, dict) else None
+    return messages if isinstance(messages, list) else []
+
+def parse_batch_items(data, settings):
+    """
+    Validate the messages of a /chat/batch request and resolve their model and language.
+    
+    Args:
+        data (dict): The request body.
+        settings (dict): The settings to serve the request with.
+        
+    Returns:
+        tuple: (items, None) with one dict per message ("id", "message", "model", "language"), or
+               (None, error message).
+    """
+    messages = get_batch_messages()
+    max_items = settings.get("batch", {}).get("max_items", 1000)
+    if not messages:
+        return None, "No messages provided"
+    if len(messages) > max_items:
+        return None, f"Too many messages: {len(messages)} (at most {max_items})"
+    
+    default_model = data.get("model") or settings["response_model"]
+    default_language = data.get("language")
+    
+    items = []
+    for index, message in enumerate(messages):
+        if isinstance(message, str):
+            message = {"message": message}
+        if not isinstance(message, dict) or not isinstance(message.get("message"), str) or not message["message"]:
+            return None, f"Message {index}: no message provided"
+        
+        model_id = message.get("model") or default_model
+        if not get_model_info(model_id, MODELS):
+            return None, f"Message {index}: model not found: {model_id}"
+        # The batch-wide default is already the fallback during brownout; overrides switch as well
+        if g.get("brownout") and model_id != settings["response_model"]:
+            fallback = get_fallback_model(model_id, MODELS)
+            if fallback:
+                model_id = fallback["model"]
+        
+        items.append({
+            "id": message.get("id", index),
+            "message": message["message"],
+            "model": model_id,
+            "language": message.get("language", default_language),
+        })
+    
+    return items, None
+
+def answer_batch_item(item, prompts):
+    """
+    Answer one message of a batch. Runs on a batch worker thread, in an app context of its own, so the
+    shed and coalesced calls it records on g are its own and not those of the other items.
+    
+    Args:
+        item (dict): The message, from parse_batch_items().
+        prompts (dict): Compiled system prompts shared by the batch.
+        
+    Returns:
+        dict: The NDJSON line: "id" and "status", plus "ai_response" or "error" (and "retry_after"
+              when the provider call was shed).
+    """
+    with app.app_context():
         try:
-            # Check if the response is valid JSON
-            json_response = json.loads(ai_response)
-            
-            # Extract just the response part if it exists
-            if "response" in json_response:
-                response_text = json_response["response"]
-                print(f"Extracted response from JSON object: {response_text[:100]}...")
-            
-            # Extract tool_use if present
-            if "tool_use" in json_response:
-                tool_use = json_response["tool_use"]
-                print(f"Extracted tool_use from JSON object: {tool_use}")
-        except (json.JSONDecodeError, TypeError):
-            # If not valid JSON, use as is
-            pass
+            result = answer_message(item["message"], item["language"], item["model"], prompts)
+        except Exception as e:
+            logger.error("Batch message %s failed: %s", item["id"], e)
+            result = {"error": str(e), "code": 500, "status": "error"}
+        
+        if result["status"] == "success":
+            return {"id": item["id"], "status": "success", "model": item["model"], "ai_response": result["ai_response"]}
+        
+        line = {"id": item["id"], "status": "error", "model": item["model"], "error": result["error"],
+                "code": result["code"]}
+        shed = g.get("shed")
+        if shed is not None:
+            line["code"] = 503
+            line["retry_after"] = shed.retry_after
+        return line
+
+def get_declared_length():
+    """Return the "length" a POST /uploads request declares, or None if it has none."""
+    data = request.get_json(silent=True)
+    return data.get("length") if isinstance(data, dict) else None
+
+def current_settings():
+    """
+    Get the settings to serve the current request with.
     
-    return response_text, tool_use
+    Returns:
+        dict: The settings, with the faster fallback models while brownout is active.
+    """
+    return g.get("settings", SETTINGS)
 
-# Initialize Flask app
-app = Flask(__name__)
+def is_admin_request():
+    """
+    Check the admin token of the current request.
+    
+    Admin endpoints are disabled unless the ADMIN_TOKEN environment variable is set. The token is
+    sent as "Authorization: Bearer <token>" or in an X-Admin-Token header.
+    
+    Returns:
+        bool: True if the request carries the admin token
+    """
+    admin_token = os.getenv("ADMIN_TOKEN")
+    if not admin_token:
+        return False
+    
+    token = request.headers.get("X-Admin-Token", "")
+    authorization = request.headers.get("Authorization", "")
+    if authorization.startswith("Bearer "):
+        token = authorization[len("Bearer "):]
+    
+    return hmac.compare_digest(token.encode(), admin_token.encode())
 
-# Load settings and models
-SETTINGS = load_settings()
-MODELS = load_models()
+@app.before_request
+def start_request_timer():
+    """Start timing the stages of the request and tag its log records with a correlation id"""
+    g.timer = RequestTimer()
+    g.request_id = set_request_id(request.headers.get("X-Request-ID"))
+    
+    # Only an attribute read when the profiler is idle
+    if profiler.active and not request.path.startswith("/admin/"):
+        profiler.begin_request()
+
+@app.before_request
+def assign_priority_lane():
+    """
+    Queue the request's provider calls in its priority lane.
+    
+    Voice and chat turns are interactive, everything else is standard. A client can move its own
+    request to a lower lane with an X-Priority header, but never to a higher one.
+    """
+    lane = ENDPOINT_LANES.get(request.endpoint, "standard")
+    requested = request.headers.get("X-Priority", "").lower()
+    if requested in LANES and LANES.index(requested) > LANES.index(lane):
+        lane = requested
+    set_lane(lane)
+    g.lane = lane
+
+@app.before_request
+def reject_oversized_upload():
+    """Answer 413 from the declared length of an upload, before any of it is read or charged"""
+    if request.endpoint in ("transcribe", "transcribe_stream", "create_job"):
+        if (request.content_length or 0) > uploads.config["max_bytes"]:
+            return jsonify({"error": f"The upload is too large (at most {uploads.config['max_bytes']} bytes)"}), 413
+    elif request.endpoint == "create_upload":
+        try:
+            uploads.check_length(get_declared_length())
+        except UploadError as e:
+            return jsonify({"error": str(e)}), e.code
+    elif request.endpoint == "upload_chunk":
+        if (request.content_length or 0) > uploads.config["max_chunk_bytes"]:
+            return jsonify({"error": f"The chunk is too large (at most {uploads.config['max_chunk_bytes']} bytes)"}), 413
+    
+    return None
+
+@app.before_request
+def attach_idempotent_retry():
+    """Run a request with an Idempotency-Key once; retries wait for it or get its stored result"""
+    key = request.headers.get("Idempotency-Key")
+    if not key or not idempotency.enabled or request.endpoint not in ("transcribe", "chat", "create_job"):
+        return None
+    
+    if request.endpoint == "chat":
+        fingerprint = hashlib.sha256(request.get_data()).hexdigest()
+    else:
+        # Hashing the audio would mean reading the upload now; its length tells requests apart well enough
+        fingerprint = f"length:{request.content_length}"
+    
+    scoped_key = idempotency.scoped_key(rate_limiter.client_key(request), request.endpoint, key)
+    outcome, stored = idempotency.begin(scoped_key, fingerprint)
+    
+    if outcome == "run":
+        g.idempotency_key = scoped_key
+        return None
+    if outcome == "replay":
+        response = Response(stored.body, status=stored.status, content_type=stored.content_type)
+        response.headers["Idempotent-Replayed"] = "true"
+        return response
+    if outcome == "mismatch":
+        return jsonify({"error": "This Idempotency-Key was already used for a different request"}), 422
+    
+    response = jsonify({"error": "A request with this Idempotency-Key is still in progress"})
+    response.status_code = 409
+    response.headers["Retry-After"] = str(idempotency.retry_after())
+    return response
+
+@app.before_request
+def enforce_rate_limit():
+    """Charge the client's token buckets, and answer 429 when one is empty"""
+    if request.endpoint in ("transcribe", "transcribe_stream", "create_job"):
+        costs = {"text": 1, "audio_seconds": rate_limiter.estimate_audio_seconds(request.content_length)}
+    elif request.endpoint == "create_upload":
+        # Charged once for the whole recording; the chunks and the finalize are free
+        costs = {"text": 1, "audio_seconds": rate_limiter.estimate_audio_seconds(get_declared_length())}
+    elif request.endpoint == "chat":
+        costs = {"text": 1}
+    elif request.endpoint == "chat_batch":
+        costs = {"text": 1, "batch_items": len(get_batch_messages())}
+    else:
+        return None
+    
+    try:
+        g.quota = rate_limiter.take(rate_limiter.client_key(request), costs)
+    except RateLimited as e:
+        g.quota = e.quota
+        response = jsonify({"error": str(e)})
+        response.status_code = 429
+        response.headers["Retry-After"] = str(e.retry_after)
+        return response
+    
+    return None
+
+@app.before_request
+def apply_brownout():
+    """Switch to the fallback models while the providers are slow or the queues are long"""
+    if request.endpoint not in ("transcribe", "transcribe_stream", "finalize_upload", "chat", "chat_batch"):
+        return
+    
+    if brownout.update(admission.queued()):
+        g.settings = brownout.apply(SETTINGS, MODELS)
+        g.brownout = True
+
+@app.before_request
+def shed_when_saturated():
+    """Answer 503 right away, before reading the upload, when the models' queues are already full"""
+    settings = current_settings()
+    if request.endpoint in ("transcribe", "transcribe_stream", "finalize_upload"):
+        model_ids = [settings["transcription_model"], settings["response_model"]]
+    elif request.endpoint in ("chat", "chat_batch"):
+        model_ids = [settings["response_model"]]
+    else:
+        return None
+    
+    try:
+        for model_id in model_ids:
+            model_info = get_model_info(model_id, MODELS)
+            if model_info:
+                admission.check(model_info["provider"], model_id)
+    except Overloaded as e:
+        response = jsonify({"error": "The server is busy, please try again shortly"})
+        response.status_code = 503
+        response.headers["Retry-After"] = str(e.retry_after)
+        return response
+    
+    return None
+
+@app.before_request
+def make_cancellable():
+    """Let the request be cancelled when its client disconnects or calls /cancel/<request_id>"""
+    if request.endpoint not in CANCELLABLE_ENDPOINTS:
+        return
+    
+    # The client connection, where the server exposes it
+    sock = request.environ.get("gunicorn.socket") or request.environ.get("werkzeug.socket")
+    g.cancel_token = cancellations.begin(g.request_id, rate_limiter.client_key(request), sock)
+
+@app.teardown_request
+def end_cancellation(exception=None):
+    """Stop watching the request for cancellation"""
+    if g.get("streaming"):
+        # The response is still to be streamed; this runs again once the stream is done
+        return
+    token = g.pop("cancel_token", None)
+    if token is not None:
+        cancellations.end(token)
+
+@app.teardown_request
+def release_idempotency_key(exception=None):
+    """Give up the Idempotency-Key of a request that failed before its result was stored"""
+    key = g.pop("idempotency_key", None)
+    if key is not None:
+        idempotency.abandon(key)
+
+@app.teardown_request
+def end_profiled_request(exception=None):
+    """Stop sampling the request thread and clear the correlation id once the request is done"""
+    if profiler.active:
+        profiler.end_request()
+    clear_request_id()
+
+@app.after_request
+def store_idempotent_response(response):
+    """Store the result of a request with an Idempotency-Key for its retries; failures can be retried"""
+    key = g.pop("idempotency_key", None)
+    if key is None:
+        return response
+    
+    if response.status_code >= 500 or response.status_code in (429, 499) or response.is_streamed:
+        idempotency.abandon(key)
+    else:
+        idempotency.complete(key, response.status_code, response.content_type, response.get_data())
+    return response
+
+@app.after_request
+def add_server_timing(response):
+    """Report the stage durations in a Server-Timing header and, if requested, a timings field"""
+    timer = g.get("timer")
+    if timer is None:
+        return response
+    
+    timings = timer.as_dict()
+    response.headers["Server-Timing"] = timer.header(timings)
+    response.headers["X-Request-ID"] = g.request_id
+    
+    metrics.REQUEST_LATENCY.observe(timings["total"] / 1000, endpoint=request.endpoint or "unknown",
+                                    status=str(response.status_code))
+    metrics.registry.maybe_flush()
+    
+    # Add the breakdown to JSON responses when asked for with ?timings=1
+    if request.args.get("timings") and response.is_json:
+        payload = response.get_json(silent=True)
+        if isinstance(payload, dict):
+            payload["timings"] = timings
+            response.set_data(json.dumps(payload))
+    
+    return response
+
+@app.after_request
+def add_quota_headers(response):
+    """Describe the client's remaining quota in each bucket"""
+    for bucket, (limit, remaining, reset) in g.get("quota", {}).items():
+        name = bucket.replace("_", "-").title()
+        response.headers[f"X-RateLimit-Limit-{name}"] = str(limit)
+        response.headers[f"X-RateLimit-Remaining-{name}"] = str(int(remaining))
+        response.headers[f"X-RateLimit-Reset-{name}"] = str(reset)
+    return response
+
+@app.after_request
+def report_brownout(response):
+    """Tell the client the request was answered in brownout mode"""
+    if g.get("brownout"):
+        response.headers["X-Brownout"] = "active"
+    return response
+
+@app.after_request
+def report_shed(response):
+    """Turn a failure caused by a shed provider call into 503 with Retry-After"""
+    shed = g.get("shed")
+    if shed is not None and response.status_code >= 500:
+        response.status_code = 503
+        response.headers["Retry-After"] = str(shed.retry_after)
+    return response
+
+@app.after_request
+def report_cancelled(response):
+    """Answer 499 for a cancelled request, whatever its handler made of the aborted calls"""
+    token = g.get("cancel_token")
+    if token is not None and token.cancelled:
+        response = jsonify({"error": f"Request cancelled ({token.reason})"})
+        response.status_code = 499
+    return response
+
+@app.route("/cancel/<request_id>", methods=["POST"])
+def cancel_request(request_id):
+    """Cancel a running /chat or /transcribe request of the same client by its X-Request-ID"""
+    local = cancellations.cancel(request_id, rate_limiter.client_key(request))
+    return jsonify({"request_id": request_id, "status": "cancelled" if local else "cancelling"}), 202
+
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    """Return the metrics of all workers in the Prometheus text format"""
+    return Response(metrics.registry.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/admin/profile", methods=["POST"])
+def start_profile():
+    """Start profiling the next N requests and/or T seconds"""
+    if not is_admin_request():
+        return jsonify({"error": "Forbidden"}), 403
+    
+    data = request.get_json(silent=True) or {}
+    try:
+        requests_limit = int(data["requests"]) if data.get("requests") else None
+        seconds = float(data["seconds"]) if data.get("seconds") else None
+        interval_ms = float(data.get("interval_ms", 5))
+    except (TypeError, ValueError):
+        return jsonify({"error": "requests, seconds and interval_ms must be numbers"}), 400
+    
+    # Never leave the profiler running indefinitely
+    if requests_limit is None and seconds is None:
+        seconds = 30.0
+    
+    result = profiler.start(requests=requests_limit, seconds=seconds, interval=interval_ms / 1000,
+                            memory=data.get("memory", True))
+    if result["status"] == "error":
+        return jsonify(result), 409
+    
+    return jsonify(result)
+
+@app.route("/admin/profile", methods=["GET"])
+def get_profile():
+    """Return the profiler status, or the last profile as collapsed stacks, speedscope or JSON"""
+    if not is_admin_request():
+        return jsonify({"error": "Forbidden"}), 403
+    
+    if profiler.active or not profiler.result:
+        return jsonify(profiler.status())
+    
+    result = profiler.result
+    output_format = request.args.get("format", "json")
+    if output_format == "collapsed":
+        return Response(to_collapsed(result["stacks"]), mimetype="text/plain")
+    if output_format == "speedscope":
+        return Response(to_speedscope(result["stacks"], result["interval"]), mimetype="application/json",
+                        headers={"Content-Disposition": "attachment; filename=profile.speedscope.json"})
+    
+    return jsonify(result)
 
-# Initialize tool executor
-tool_executor = ToolExecutor()
+@app.route("/admin/profile", methods=["DELETE"])
+def stop_profile():
+    """Stop profiling early"""
+    if not is_admin_request():
+        return jsonify({"error": "Forbidden"}), 403
+    
+    profiler.stop()
+    return jsonify(profiler.status())
 
 @app.route("/")
 def index():
@@ -116,10 +837,19 @@ def update_app_settings():
             return jsonify({"error": "Missing required settings"}), 400
             
         # Update global settings
-        global SETTINGS
+        global SETTINGS, tool_retriever
         SETTINGS = update_settings(new_settings)
         
         if SETTINGS:
+            tool_retriever = create_tool_retriever(SETTINGS)
+            admission.configure(SETTINGS.get("admission"))
+            brownout.configure(SETTINGS.get("brownout"))
+            rate_limiter.configure(SETTINGS.get("rate_limit"))
+            http_client.coalescer.enabled = SETTINGS.get("coalescing", {}).get("enabled", True)
+            idempotency.configure(SETTINGS.get("idempotency"))
+            jobs.configure(SETTINGS.get("jobs"))
+            cancellations.configure(SETTINGS.get("cancellation"))
+            uploads.configure(SETTINGS.get("uploads"))
             return jsonify({"success": True, "settings": SETTINGS})
         else:
             return jsonify({"error": "Failed to update settings"}), 500
@@ -129,40 +859,248 @@ def update_app_settings():
 @app.route("/transcribe", methods=["POST"])
 def transcribe():
     """Transcribe audio and get AI response"""
-    if "audio" not in request.files:
+    # Reading the upload (multipart parsing happens on first access to request.files)
+    with span("upload"):
+        has_audio = "audio" in request.files
+    
+    if not has_audio:
         return jsonify({"error": "No audio file uploaded"}), 400
 
     audio_file = request.files["audio"]
+    metrics.UPLOAD_BYTES.observe(request.content_length or 0)
     
     # Get language preference if provided (defaults to null which means auto-detect)
     language = request.form.get("language", None)
     
+    result = process_audio(audio_file, language, current_settings())
+    if result["status"] != "success":
+        return jsonify({"error": result["error"]}), result["code"]
+    
+    return jsonify({"text": result["text"], "ai_response": result["ai_response"]})
+
+@app.route("/transcribe/stream", methods=["POST"])
+def transcribe_stream():
+    """Transcribe audio and get AI response, streaming the transcript as server-sent events while it is produced"""
+    with span("upload"):
+        has_audio = "audio" in request.files
+    
+    if not has_audio:
+        return jsonify({"error": "No audio file uploaded"}), 400
+    
+    metrics.UPLOAD_BYTES.observe(request.content_length or 0)
+    language = request.form.get("language", None)
+    speak = request.form.get("speak", "").lower() in ("1", "true", "yes")
+    settings = current_settings()
+    
+    transcription_model_id = settings["transcription_model"]
+    model_info = get_model_info(transcription_model_id, MODELS)
+    if not model_info:
+        return jsonify({"error": f"Model not found: {transcription_model_id}"}), 400
+    if not model_info.get("can_transcribe", False):
+        return jsonify({"error": f"Model {transcription_model_id} cannot transcribe audio"}), 400
+    
+    # Flask pops the request context when the view returns, before the events are streamed, which
+    # runs the teardown and closes the upload; stream_with_context pushes the context again around
+    # the stream, with the closed upload. So the upload is kept in a spooled copy (on disk if large)
+    # until the stream is done, and the cancel token is kept past that first teardown (g.streaming).
+    upload = request.files["audio"]
+    spooled = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+    shutil.copyfileobj(upload.stream, spooled)
+    audio_file = FileStorage(stream=spooled, filename=upload.filename, content_type=upload.content_type)
+    
+    g.streaming = True
+    
+    def stream_events():
+        # The first teardown cleared the request id, so it is set again for the stream's log lines
+        set_request_id(g.request_id)
+        cancellations.resume(g.get("cancel_token"))
+        try:
+            yield from transcribe_events(audio_file, language, settings, transcription_model_id, model_info, speak)
+        finally:
+            # The teardown that runs after the stream ends the cancel token
+            g.pop("streaming", None)
+            spooled.close()
+    
+    response = Response(stream_with_context(stream_events()), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+def transcribe_events(audio_file, language, settings, transcription_model_id, model_info, speak=False):
+    """
+    Run a recording through the streamed transcription, the response stage and, if asked, speech.
+    
+    Args:
+        audio_file (FileStorage): The recording.
+        language (str): The language to respond in, or None to auto-detect.
+        settings (dict): The settings to serve the recording with (see current_settings()).
+        transcription_model_id (str): The transcription model.
+        model_info (dict): The transcription model's information dictionary.
+        speak (bool, optional): Whether to speak the AI response as well. Defaults to False.
+        
+    Yields:
+        str: Server-sent events: "transcript.delta" for each part of the transcript, "transcript" with
+             the whole transcript, then "response" with the AI response, or "error"; with speak, the
+             speech events follow (see speech_events()).
+    """
+    transcription_text = ""
+    for event in stream_transcript(audio_file, language, transcription_model_id, model_info):
+        if event["type"] == "delta":
+            yield f"event: transcript.delta\ndata: {json.dumps({'text': event['text']})}\n\n"
+        elif event["type"] == "done":
+            transcription_text = event["text"]
+        else:
+            yield f"event: error\ndata: {json.dumps({'error': event['error'], 'code': 500})}\n\n"
+            return
+    
+    if not transcription_text:
+        yield f"event: error\ndata: {json.dumps({'error': 'Failed to transcribe audio', 'code': 500})}\n\n"
+        return
+    yield f"event: transcript\ndata: {json.dumps({'text': transcription_text})}\n\n"
+    
+    # The final transcript goes straight on to the response stage, in the same request
+    try:
+        result = respond_to_transcript(transcription_text, language, settings)
+    except Exception as e:
+        result = {"error": str(e), "code": 500, "status": "error"}
+    
+    if result["status"] != "success":
+        yield f"event: error\ndata: {json.dumps({'error': result['error'], 'code': result['code']})}\n\n"
+        return
+    yield f"event: response\ndata: {json.dumps({'text': result['text'], 'ai_response': result['ai_response']})}\n\n"
+    
+    if speak:
+        yield from speech_events(result["ai_response"], settings)
+
+def speech_events(ai_response, settings):
+    """
+    Speak an AI response sentence by sentence.
+    
+    The sentences are synthesized concurrently and each one is sent as soon as it and the ones
+    before it are ready, so playback starts after the first sentence rather than the whole reply.
+    
+    Args:
+        ai_response (str): The AI response; tool output is not spoken.
+        settings (dict): The settings, with the "tts" block.
+        
+    Yields:
+        str: Server-sent events: "speech" per sentence in order ("index", "text", "mimetype" and
+             base64 "audio"), then "speech.done" with the number of sentences spoken and failed.
+    """
+    config = settings.get("tts", {})
+    if not config.get("enabled", True):
+        return
+    
+    text = spoken_text(ai_response, config.get("max_chars", 1500))
+    if not text:
+        return
+    
+    try:
+        service = SpeechFactory.create_service(config.get("provider", "OpenAI"))
+    except ValueError as e:
+        logger.error("Speech is not available: %s", e)
+        yield f"event: speech.done\ndata: {json.dumps({'sentences': 0, 'failed': 0, 'error': str(e)})}\n\n"
+        return
+    
+    spoken = failed = 0
+    for sentence in synthesize_sentences([text], service, config):
+        if sentence["status"] != "success":
+            failed += 1
+            logger.warning("Speech synthesis of sentence %d failed: %s", sentence["index"], sentence["error"])
+            continue
+        
+        spoken += 1
+        chunk = {
+            "index": sentence["index"],
+            "text": sentence["text"],
+            "mimetype": sentence["mimetype"],
+            "audio": base64.b64encode(sentence["audio"]).decode("ascii")
+        }
+        yield f"event: speech\ndata: {json.dumps(chunk)}\n\n"
+    
+    yield f"event: speech.done\ndata: {json.dumps({'sentences': spoken, 'failed': failed})}\n\n"
+
+def stream_transcript(audio_file, language, model_id, model_info):
+    """
+    Transcribe a recording, streaming the transcript where the provider can.
+    
+    Args:
+        audio_file (FileStorage): The recording.
+        language (str): The language of the recording, or None to auto-detect.
+        model_id (str): The transcription model.
+        model_info (dict): The model information dictionary.
+        
+    Yields:
+        dict: {"type": "delta", "text": ...} for each part of the transcript, then {"type": "done", "text": ...}
+              or {"type": "error", "error": ...}. Providers without streaming send the whole transcript at once.
+    """
+    service = ServiceFactory.create_service_for_model(model_info)
+    start = time.perf_counter()
+    
+    if not hasattr(service, "stream_transcription"):
+        with span("transcription"):
+            result = service.transcribe_audio(audio_file, language=language, model_id=model_id)
+        if result["status"] == "success":
+            yield {"type": "delta", "text": result["text"]}
+            yield {"type": "done", "text": result["text"], "status": "success"}
+        else:
+            yield {"type": "error", "error": result.get("error", "Failed to transcribe audio"), "status": "error"}
+        return
+    
+    first_delta = True
+    for event in service.stream_transcription(audio_file, language=language, model_id=model_id):
+        if event["type"] == "delta" and first_delta:
+            first_delta = False
+            metrics.TRANSCRIPT_FIRST_DELTA.observe(time.perf_counter() - start, provider=model_info["provider"])
+        elif event["type"] != "delta":
+            add_span("transcription", (time.perf_counter() - start) * 1000)
+        yield event
+
+def process_audio(audio_file, language, settings):
+    """
+    Transcribe a recording and get the AI response to it.
+    
+    Uses a multimodal audio model directly when the transcription and response models are the same
+    one, and otherwise (or when that fails) transcribes first and then asks the response model.
+    
+    Args:
+        audio_file (FileStorage): The recording.
+        language (str): The language to respond in, or None to auto-detect.
+        settings (dict): The settings to serve the recording with (see current_settings()).
+        
+    Returns:
+        dict: The result, with "text", "ai_response" and "status", or "error" and "code" (the HTTP
+              status) on failure.
+    """
     # Get the selected transcription model
-    transcription_model_id = SETTINGS["transcription_model"]
+    transcription_model_id = settings["transcription_model"]
     model_info = get_model_info(transcription_model_id, MODELS)
     
     if not model_info:
-        return jsonify({"error": f"Model not found: {transcription_model_id}"}), 400
+        return {"error": f"Model not found: {transcription_model_id}", "code": 400, "status": "error"}
         
     if not model_info.get("can_transcribe", False):
-        return jsonify({"error": f"Model {transcription_model_id} cannot transcribe audio"}), 400
+        return {"error": f"Model {transcription_model_id} cannot transcribe audio", "code": 400, "status": "error"}
     
     # Check if we can optimize by using a multimodal audio model for direct audio-to-text
-    if is_same_multimodal_model(SETTINGS):
+    if is_same_multimodal_model(settings):
         # Implement direct audio-to-text response using a multimodal audio model
+        direct_start = time.perf_counter()
         try:
-            print(f"Attempting direct audio-to-text response with audio model: {SETTINGS['transcription_model']}")
+            logger.info("Attempting direct audio-to-text response with audio model: %s", transcription_model_id)
             
             # Convert audio to base64
-            audio_base64, _ = audio_to_base64(audio_file)
+            with span("direct_base64"):
+                audio_base64, _ = audio_to_base64(audio_file)
             
             # Check if the audio file is too large
             if is_audio_too_large(audio_base64):
-                print("Audio file too large for direct approach. Falling back to two-step process.")
                 raise Exception("Audio file too large for direct approach")
             
             # Get the system prompt
-            system_prompt = get_system_prompt(language, SETTINGS["transcription_model"])
+            # The transcript isn't known yet, so every tool is included
+            with span("direct_prompt"):
+                system_prompt = build_system_prompt(language, transcription_model_id)
             
             # Get the provider of the model
             provider = model_info["provider"]
@@ -171,62 +1109,37 @@ def transcribe():
             service = ServiceFactory.create_service_for_model(model_info)
             
             # Process the audio based on the provider
-            if provider == "Google":
-                result = service.process_audio(audio_file, system_prompt, language, SETTINGS["transcription_model"])
-            elif provider == "OpenRouter":
-                result = service.process_audio_direct(audio_file, SETTINGS["transcription_model"], system_prompt, language)
-            else:
-                raise Exception(f"Unsupported provider for direct audio-to-text: {provider}")
+            with span("direct"):
+                if provider == "Google":
+                    result = service.process_audio(audio_file, system_prompt, language, transcription_model_id)
+                elif provider == "OpenRouter":
+                    result = service.process_audio_direct(audio_file, transcription_model_id, system_prompt, language)
+                else:
+                    raise Exception(f"Unsupported provider for direct audio-to-text: {provider}")
             
             # Check if the processing was successful
             if result["status"] == "success":
-                # Get the AI response
-                ai_response = result["ai_response"]
+                tool_calls = list(result.get("tool_calls", []))
                 
-                # Check for tool_use in the response
-                print("\n\n==== CHECKING FOR TOOL USE IN DIRECT MODE ====")
-                print(f"AI response: {ai_response[:100]}...")
+                # Trigger phrases in the transcript also count, since the model has already replied
+                intent = intent_matcher.match(result["text"])
+                if intent and intent.confidence > 0:
+                    tool_calls.append((intent.tool_name, ""))
                 
-                # Create a JSON object to check for tool_use
-                try:
-                    # Try to create a JSON object with the transcription and response
-                    json_obj = {
-                        "transcription": result["text"],
-                        "response": ai_response,
-                        "tool_use": "tool_use: [dance]" if "dans" in result["text"].lower() or "dance" in result["text"].lower() else None
-                    }
-                    
-                    # Remove None values
-                    if json_obj["tool_use"] is None:
-                        del json_obj["tool_use"]
-                    
-                    # Convert to JSON string
-                    json_str = json.dumps(json_obj)
-                    
-                    # Check for tool_use
-                    if "tool_use" in json_obj:
-                        print(f"Tool use detected in direct mode: {json_obj['tool_use']}")
-                        # Execute the tool
-                        tool_result = tool_executor.execute_tools(json_str)
-                        # Append tool output to the AI response
-                        if tool_result["message"]:
-                            print(f"Adding tool output to response: {tool_result['message']}")
-                            ai_response += tool_result["message"]
-                        else:
-                            print("No tool output to add to response")
-                except Exception as e:
-                    print(f"Error checking for tool use: {str(e)}")
-                
-                print(f"==== TOOL USE CHECK COMPLETE ====\n\n")
-                
-                return jsonify({
+                metrics.TRANSCRIBE_PATHS.inc(path="direct")
+                return {
                     "text": result["text"],
-                    "ai_response": ai_response
-                })
+                    "ai_response": append_tool_output(result["ai_response"], tool_calls),
+                    "status": "success"
+                }
             else:
                 raise Exception(result["error"])
         except Exception as e:
-            print(f"Error in direct approach: {str(e)}. Falling back to two-step process.")
+            logger.warning("Error in direct approach: %s. Falling back to two-step process.", e)
+            
+            # Report the time lost in the failed direct attempt
+            add_span("fallback", (time.perf_counter() - direct_start) * 1000)
+            metrics.DIRECT_FALLBACKS.inc(provider=model_info["provider"], model=transcription_model_id)
     
     # If we can't optimize or the direct approach failed, use the two-step process
     try:
@@ -234,169 +1147,297 @@ def transcribe():
         transcription_service = ServiceFactory.create_service_for_model(model_info)
         
         # Transcribe the audio
-        transcription_result = transcription_service.transcribe_audio(audio_file, language=language, model_id=transcription_model_id)
+        with span("transcription"):
+            transcription_result = transcription_service.transcribe_audio(audio_file, language=language, model_id=transcription_model_id)
         
         # Check if the transcription was successful
         if transcription_result["status"] != "success":
-            return jsonify({"error": transcription_result.get("error", "Failed to transcribe audio")}), 500
+            return {"error": transcription_result.get("error", "Failed to transcribe audio"), "code": 500, "status": "error"}
         
         # Get the transcription text
         transcription_text = transcription_result["text"]
         
+        if not transcription_text:
+            return {"error": "Failed to transcribe audio", "code": 500, "status": "error"}
+        
         # Get AI response to the transcribed text
-        if transcription_text:
-            # Get the selected response model
-            response_model_id = SETTINGS["response_model"]
-            response_model_info = get_model_info(response_model_id, MODELS)
-            
-            if not response_model_info:
-                return jsonify({"error": f"Model not found: {response_model_id}"}), 400
-            
-            # Create a service instance for the response model
-            response_service = ServiceFactory.create_service_for_model(response_model_info)
-            
-            # Get the system prompt
-            system_prompt = get_system_prompt(language, response_model_id)
-            
-            # Create messages for the response
-            messages = [
-                {
-                    "role": "system",
-                    "content": system_prompt
-                },
-                {
-                    "role": "user",
-                    "content": f"Transcription of my audio: {transcription_text}\n\nPlease respond to this."
-                }
-            ]
-            
-            # Get the response based on the provider
-            if response_model_info["provider"] == "Google":
-                user_message = f"{system_prompt}\n\nTranscription of my audio: {transcription_text}\n\nPlease respond to this."
-                response_result = response_service.generate_content(user_message, response_model_id)
-            else:
-                # For OpenAI and OpenRouter, use the chat completion API
-                response_format = {"type": "json_object"} if response_model_info["provider"] == "OpenAI" else None
-                response_result = response_service.get_chat_completion(messages, response_model_id, response_format)
-            
-            # Check if the response was successful
-            if response_result["status"] != "success":
-                return jsonify({"error": response_result.get("error", "Failed to get AI response")}), 500
-            
-            # Get the AI response
-            ai_response = response_result["content"]
-            
-            # Try to parse the JSON response
-            try:
-                # First, check if the response is a string that contains JSON
-                if ai_response.strip().startswith('"json {') and ai_response.strip().endswith('}"'):
-                    # Extract the JSON part from the string
-                    print("Detected special JSON format with 'json {' prefix")
-                    json_str = ai_response.strip().strip('"').replace('json {', '{').replace('} "', '}')
-                    try:
-                        json_response = json.loads(json_str)
-                        # Check if the response contains both transcription and response fields
-                        if "transcription" in json_response and "response" in json_response:
-                            # Use both fields from the JSON
-                            transcription_text = json_response["transcription"]
-                            ai_response = json_response["response"]
-                            print(f"Successfully parsed special JSON format: {transcription_text[:50]}... / {ai_response[:50]}...")
-                            
-                            # Check for tool_use
-                            if "tool_use" in json_response:
-                                tool_use = json_response["tool_use"]
-                                print(f"Tool use detected: {tool_use}")
-                                # Execute the tool
-                                print(f"\n\n==== EXECUTING TOOL FROM SPECIAL JSON FORMAT ====")
-                                print(f"Tool use: {tool_use}")
-                                print(f"JSON string: {json_str}")
-                                tool_result = tool_executor.execute_tools(json_str)
-                                # Append tool output to the AI response
-                                if tool_result["message"]:
-                                    print(f"Adding tool output to response: {tool_result['message']}")
-                                    ai_response += tool_result["message"]
-                                else:
-                                    print("No tool output to add to response")
-                                print(f"==== TOOL EXECUTION COMPLETE ====\n\n")
-                        elif "response" in json_response:
-                            # Only use the response field
-                            ai_response = json_response["response"]
-                    except json.JSONDecodeError as e:
-                        print(f"Failed to parse special JSON format: {e}")
-                        # If we can't parse the special format, try to extract using regex
-                        import re
-                        transcription_match = re.search(r'"transcription":\s*"([^"]+)"', ai_response)
-                        response_match = re.search(r'"response":\s*"([^"]+)"', ai_response)
-                        
-                        if transcription_match and response_match:
-                            transcription_text = transcription_match.group(1)
-                            ai_response = response_match.group(1)
-                            print(f"Extracted using regex: {transcription_text[:50]}... / {ai_response[:50]}...")
-                else:
-                    # Try standard JSON parsing
-                    json_response = json.loads(ai_response)
-                    # Check if the response contains both transcription and response fields
-                    if "transcription" in json_response and "response" in json_response:
-                        # Use both fields from the JSON
-                        transcription_text = json_response["transcription"]
-                        ai_response = json_response["response"]
-                        print(f"Using both transcription and response from JSON: {transcription_text[:50]}... / {ai_response[:50]}...")
-                        
-                        # Check for tool_use
-                        if "tool_use" in json_response:
-                            tool_use = json_response["tool_use"]
-                            print(f"Tool use detected: {tool_use}")
-                            # Execute the tool
-                            print(f"\n\n==== EXECUTING TOOL FROM STANDARD JSON ====")
-                            print(f"Tool use: {tool_use}")
-                            print(f"JSON: {json.dumps(json_response)[:100]}...")
-                            tool_result = tool_executor.execute_tools(json.dumps(json_response))
-                            # Append tool output to the AI response
-                            if tool_result["message"]:
-                                print(f"Adding tool output to response: {tool_result['message']}")
-                                ai_response += tool_result["message"]
-                            else:
-                                print("No tool output to add to response")
-                            print(f"==== TOOL EXECUTION COMPLETE ====\n\n")
-                    elif "response" in json_response:
-                        # Only use the response field
-                        ai_response = json_response["response"]
-            except json.JSONDecodeError:
-                # If the response is not valid JSON, try to extract using regex
-                import re
-                transcription_match = re.search(r'"transcription":\s*"([^"]+)"', ai_response)
-                response_match = re.search(r'"response":\s*"([^"]+)"', ai_response)
-                
-                if transcription_match and response_match:
-                    transcription_text = transcription_match.group(1)
-                    ai_response = response_match.group(1)
-                    print(f"Extracted using regex: {transcription_text[:50]}... / {ai_response[:50]}...")
-                else:
-                    # If we can't extract using regex, use the response as is
-                    print("Could not parse JSON or extract using regex, using response as is")
-                
-                # Check for tool_use in the raw response
-                print(f"\n\n==== EXECUTING TOOL FROM RAW RESPONSE ====")
-                print(f"Raw response: {ai_response[:100]}...")
-                tool_result = tool_executor.execute_tools(ai_response)
-                # Append tool output to the AI response
-                if tool_result["message"]:
-                    print(f"Adding tool output to response: {tool_result['message']}")
-                    ai_response += tool_result["message"]
-                else:
-                    print("No tool output to add to response")
-                print(f"==== TOOL EXECUTION COMPLETE ====\n\n")
-            
-            # Return the result
-            result = {
-                "text": transcription_text,
-                "ai_response": ai_response
-            }
-            return jsonify(result)
-        else:
-            return jsonify({"error": "Failed to transcribe audio"}), 500
+        return respond_to_transcript(transcription_text, language, settings)
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return {"error": str(e), "code": 500, "status": "error"}
+
+def respond_to_transcript(transcription_text, language, settings):
+    """
+    Get the AI response to the transcript of a recording, with the output of any tools it asks for.
+    
+    Args:
+        transcription_text (str): The transcript.
+        language (str): The language to respond in, or None.
+        settings (dict): The settings to serve the recording with (see current_settings()).
+        
+    Returns:
+        dict: The result, with "text" (the model's own transcription if it gave one), "ai_response"
+              and "status", or "error" and "code" (the HTTP status) on failure.
+    """
+    # Answer clear tool requests locally without calling the response model
+    fast_reply = try_intent_fast_path(transcription_text, language)
+    if fast_reply is not None:
+        metrics.TRANSCRIBE_PATHS.inc(path="fast_path")
+        return {
+            "text": transcription_text,
+            "ai_response": fast_reply,
+            "status": "success"
+        }
+    
+    # Get the selected response model
+    response_model_id = settings["response_model"]
+    response_model_info = get_model_info(response_model_id, MODELS)
+    
+    if not response_model_info:
+        return {"error": f"Model not found: {response_model_id}", "code": 400, "status": "error"}
+    
+    # Use provider-native tool calling when the model supports it
+    if uses_native_tools(response_model_info):
+        user_content = f"Transcription of my audio: {transcription_text}\n\nPlease respond to this."
+        native_result = get_native_response(response_model_info, response_model_id, language, transcription_text, user_content)
+        if native_result["status"] != "success":
+            return {"error": native_result.get("error", "Failed to get AI response"), "code": 500, "status": "error"}
+        
+        metrics.TRANSCRIBE_PATHS.inc(path="two_step")
+        return {
+            "text": transcription_text,
+            "ai_response": native_result["ai_response"],
+            "status": "success"
+        }
+    
+    # Create a service instance for the response model
+    response_service = ServiceFactory.create_service_for_model(response_model_info)
+    
+    # Get the system prompt
+    with span("prompt"):
+        system_prompt = build_system_prompt(language, response_model_id, transcription_text)
+    
+    # Create messages for the response
+    messages = [
+        {
+            "role": "system",
+            "content": system_prompt
+        },
+        {
+            "role": "user",
+            "content": f"Transcription of my audio: {transcription_text}\n\nPlease respond to this."
+        }
+    ]
+    
+    # Get the response based on the provider
+    with span("response"):
+        if response_model_info["provider"] == "Google":
+            user_message = f"{system_prompt}\n\nTranscription of my audio: {transcription_text}\n\nPlease respond to this."
+            response_result = response_service.generate_content(user_message, response_model_id)
+        else:
+            # For OpenAI and OpenRouter, use the chat completion API
+            response_format = {"type": "json_object"} if response_model_info["provider"] == "OpenAI" else None
+            response_result = response_service.get_chat_completion(messages, response_model_id, response_format)
+    
+    # Check if the response was successful
+    if response_result["status"] != "success":
+        return {"error": response_result.get("error", "Failed to get AI response"), "code": 500, "status": "error"}
+    
+    # Parse the AI response once into its response text, transcription and tool calls
+    with span("parse"):
+        envelope = parse_response(response_result["content"])
+    logger.debug("Parsed AI response: %r", envelope)
+    
+    # Prefer the model's own transcription if it included one
+    if envelope.transcription:
+        transcription_text = envelope.transcription
+    
+    # Return the result
+    metrics.TRANSCRIBE_PATHS.inc(path="two_step")
+    return {
+        "text": transcription_text,
+        "ai_response": append_tool_output(envelope.response, envelope.tool_calls),
+        "status": "success"
+    }
+
+@app.route("/jobs", methods=["POST"])
+def create_job():
+    """Queue a recording for transcription and response in the background; answers right away with a job id"""
+    if not jobs.enabled:
+        return jsonify({"error": "Background jobs are disabled"}), 404
+    
+    with span("upload"):
+        has_audio = "audio" in request.files
+    
+    if not has_audio:
+        return jsonify({"error": "No audio file uploaded"}), 400
+    
+    metrics.UPLOAD_BYTES.observe(request.content_length or 0)
+    
+    try:
+        with span("spool"):
+            job_id = jobs.submit(request.files["audio"], request.form.get("language", None))
+    except QueueFull as e:
+        response = jsonify({"error": "Too many jobs are queued, please try again later"})
+        response.status_code = 503
+        response.headers["Retry-After"] = str(e.retry_after)
+        return response
+    
+    response = jsonify({
+        "id": job_id,
+        "status": "queued",
+        "status_url": f"/jobs/{job_id}",
+        "events_url": f"/jobs/{job_id}/events"
+    })
+    response.status_code = 202
+    response.headers["Location"] = f"/jobs/{job_id}"
+    return response
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    """Get the status of a job, and its result once it has one"""
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    
+    response = jsonify(job)
+    # Tell pollers when to ask again
+    if job["status"] not in ("succeeded", "failed"):
+        response.headers["Retry-After"] = "1"
+    return response
+
+@app.route("/jobs/<job_id>/events", methods=["GET"])
+def job_events(job_id):
+    """Stream the status changes of a job as server-sent events, ending with its result"""
+    if jobs.get(job_id) is None:
+        return jsonify({"error": "Job not found"}), 404
+    
+    def stream_events():
+        for job in jobs.watch(job_id, timeout=600):
+            if job is None:
+                # Keeps proxies from closing an idle stream
+                yield ": keep-alive\n\n"
+            else:
+                yield f"event: {job['status']}\ndata: {json.dumps(job)}\n\n"
+    
+    response = Response(stream_events(), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+def run_transcription_job(job):
+    """
+    Run a queued recording through the transcription and response pipeline. Runs on a job worker thread.
+    
+    Args:
+        job (Job): The job, with its spooled upload.
+        
+    Returns:
+        dict: The result of process_audio().
+    """
+    # Brownout applies to jobs as it does to requests
+    brownout.update(admission.queued())
+    settings = brownout.apply(SETTINGS, MODELS)
+    
+    with open(job.audio_path, "rb") as stream:
+        audio_file = FileStorage(stream=stream, filename=job.filename, content_type=job.mimetype)
+        return process_audio(audio_file, job.language, settings)
+
+# Start this process's job workers; queued jobs left by a restart are picked up right away
+jobs.start(run_transcription_job)
+
+def upload_error(e):
+    """Turn an UploadError into a response, with the offset the upload has reached when known"""
+    payload = {"error": str(e)}
+    if e.offset is not None:
+        payload["offset"] = e.offset
+    response = jsonify(payload)
+    response.status_code = e.code
+    if e.offset is not None:
+        response.headers["Upload-Offset"] = str(e.offset)
+    return response
+
+def upload_response(upload, status_code=200):
+    """Describe an upload, with its progress also in Upload-Offset and Upload-Length headers"""
+    response = jsonify({
+        **upload,
+        "upload_url": f"/uploads/{upload['id']}",
+        "finalize_url": f"/uploads/{upload['id']}/finalize"
+    })
+    response.status_code = status_code
+    response.headers["Upload-Offset"] = str(upload["offset"])
+    response.headers["Upload-Length"] = str(upload["length"])
+    response.headers["Cache-Control"] = "no-store"
+    return response
+
+@app.route("/uploads", methods=["POST"])
+def create_upload():
+    """Start a resumable upload of a recording of a declared length"""
+    if not uploads.enabled:
+        return jsonify({"error": "Resumable uploads are disabled"}), 404
+    
+    data = request.get_json(silent=True) or {}
+    try:
+        upload = uploads.create(rate_limiter.client_key(request), data.get("length"), data.get("filename"),
+                                data.get("mimetype"))
+    except UploadError as e:
+        return upload_error(e)
+    
+    response = upload_response(upload, 201)
+    response.headers["Location"] = f"/uploads/{upload['id']}"
+    return response
+
+@app.route("/uploads/<upload_id>", methods=["GET"])
+def get_upload(upload_id):
+    """Get the offset an upload has reached, to resume it after a broken connection"""
+    upload = uploads.get(upload_id, rate_limiter.client_key(request))
+    if upload is None:
+        return jsonify({"error": "Upload not found"}), 404
+    return upload_response(upload)
+
+@app.route("/uploads/<upload_id>", methods=["PATCH"])
+def upload_chunk(upload_id):
+    """Append a chunk, sent as the raw body, at the offset given in the Upload-Offset header"""
+    try:
+        offset = int(request.headers.get("Upload-Offset", ""))
+    except ValueError:
+        return jsonify({"error": "Missing or invalid Upload-Offset header"}), 400
+    
+    try:
+        with span("upload"):
+            upload = uploads.write_chunk(upload_id, rate_limiter.client_key(request), offset, request.stream,
+                                         request.content_length)
+    except UploadError as e:
+        return upload_error(e)
+    
+    return upload_response(upload)
+
+@app.route("/uploads/<upload_id>", methods=["DELETE"])
+def delete_upload(upload_id):
+    """Abandon an upload and free its disk space"""
+    if not uploads.delete(upload_id, rate_limiter.client_key(request)):
+        return jsonify({"error": "Upload not found"}), 404
+    return "", 204
+
+@app.route("/uploads/<upload_id>/finalize", methods=["POST"])
+def finalize_upload(upload_id):
+    """Transcribe a complete upload and get the AI response, like /transcribe"""
+    data = request.get_json(silent=True) or {}
+    language = data.get("language", request.form.get("language", None))
+    client = rate_limiter.client_key(request)
+    
+    try:
+        with uploads.open(upload_id, client) as audio_file:
+            metrics.UPLOAD_BYTES.observe(len(audio_file.stream))
+            result = process_audio(audio_file, language, current_settings())
+    except UploadError as e:
+        return upload_error(e)
+    
+    if result["status"] != "success":
+        # The upload is kept, so finalizing can be retried without sending it again
+        return jsonify({"error": result["error"]}), result["code"]
+    
+    uploads.finish(upload_id, client)
+    return jsonify({"text": result["text"], "ai_response": result["ai_response"]})
 
 @app.route("/chat", methods=["POST"])
 def chat():
@@ -408,152 +1449,59 @@ def chat():
         
         if not user_message:
             return jsonify({"error": "No message provided"}), 400
-            
-        # Get the selected response model
-        response_model_id = SETTINGS["response_model"]
-        response_model_info = get_model_info(response_model_id, MODELS)
-        
-        if not response_model_info:
-            return jsonify({"error": f"Model not found: {response_model_id}"}), 400
-        
-        # Create a service instance for the response model
-        response_service = ServiceFactory.create_service_for_model(response_model_info)
         
-        # Get the system prompt
-        system_prompt = get_system_prompt(language, response_model_id)
+        result = answer_message(user_message, language, current_settings()["response_model"])
+        if result["status"] != "success":
+            return jsonify({"error": result["error"]}), result["code"]
         
-        # Get the response based on the provider
-        if response_model_info["provider"] == "Google":
-            user_message_with_prompt = f"{system_prompt}\n\nPlease respond to this message. Format your response as JSON with 'response' and 'tool_use' fields. If I'm asking about dancing, include 'tool_use: [dance]' in your response.\n\n{user_message}"
-            response_result = response_service.generate_content(user_message_with_prompt, response_model_id)
-        else:
-            # For OpenAI and OpenRouter, use the chat completion API
-            messages = [
-                {
-                    "role": "system",
-                    "content": system_prompt
-                },
-                {
-                    "role": "user",
-                    "content": user_message
-                }
-            ]
-            
-            response_format = {"type": "json_object"} if response_model_info["provider"] == "OpenAI" else None
-            response_result = response_service.get_chat_completion(messages, response_model_id, response_format)
-        
-        # Check if the response was successful
-        if response_result["status"] != "success":
-            return jsonify({"error": response_result.get("error", "Failed to get AI response")}), 500
-        
-        # Get the AI response
-        ai_response = response_result["content"]
-        
-        # Try to parse the JSON response
-        try:
-            # First, check if the response is a string that contains JSON
-            if ai_response.strip().startswith('"json {') and ai_response.strip().endswith('}"'):
-                # Extract the JSON part from the string
-                print("Detected special JSON format with 'json {' prefix")
-                json_str = ai_response.strip().strip('"').replace('json {', '{').replace('} "', '}')
-                try:
-                    json_response = json.loads(json_str)
-                    if "response" in json_response:
-                        ai_response = json_response["response"]
-                    
-                    # Check for tool_use
-                    if "tool_use" in json_response:
-                        tool_use = json_response["tool_use"]
-                        print(f"Tool use detected: {tool_use}")
-                        # Execute the tool
-                        print(f"\n\n==== EXECUTING TOOL FROM CHAT SPECIAL JSON FORMAT ====")
-                        print(f"Tool use: {tool_use}")
-                        print(f"JSON string: {json_str}")
-                        tool_result = tool_executor.execute_tools(json_str)
-                        # Append tool output to the AI response
-                        if tool_result["message"]:
-                            print(f"Adding tool output to response: {tool_result['message']}")
-                            ai_response += tool_result["message"]
-                        else:
-                            print("No tool output to add to response")
-                        print(f"==== TOOL EXECUTION COMPLETE ====\n\n")
-                except json.JSONDecodeError:
-                    pass
-            else:
-                # Try standard JSON parsing
-                json_response = json.loads(ai_response)
-                if "response" in json_response:
-                    ai_response = json_response["response"]
-                
-                # Check for tool_use
-                if "tool_use" in json_response:
-                    tool_use = json_response["tool_use"]
-                    print(f"Tool use detected: {tool_use}")
-                    # Execute the tool
-                    print(f"\n\n==== EXECUTING TOOL FROM CHAT STANDARD JSON ====")
-                    print(f"Tool use: {tool_use}")
-                    print(f"JSON: {json.dumps(json_response)[:100]}...")
-                    tool_result = tool_executor.execute_tools(json.dumps(json_response))
-                    # Append tool output to the AI response
-                    if tool_result["message"]:
-                        print(f"Adding tool output to response: {tool_result['message']}")
-                        ai_response += tool_result["message"]
-                    else:
-                        print("No tool output to add to response")
-                    print(f"==== TOOL EXECUTION COMPLETE ====\n\n")
-        except json.JSONDecodeError:
-            # If the response is not valid JSON, use it as is
-            # Check for tool_use in the raw response
-            print(f"\n\n==== EXECUTING TOOL FROM CHAT RAW RESPONSE ====")
-            print(f"Raw response: {ai_response[:100]}...")
-            tool_result = tool_executor.execute_tools(ai_response)
-            # Append tool output to the AI response
-            if tool_result["message"]:
-                print(f"Adding tool output to response: {tool_result['message']}")
-                ai_response += tool_result["message"]
-            else:
-                print("No tool output to add to response")
-            print(f"==== TOOL EXECUTION COMPLETE ====\n\n")
-        
-        # Extract response and tool_use from AI response
-        response_text, tool_use = extract_response_and_tool_use(ai_response)
-        
-        # If we successfully extracted a response, use it
-        if response_text:
-            ai_response = response_text
-            
-        # Execute tool if needed
-        if tool_use:
-            print(f"\n\n==== EXECUTING TOOL ====")
-            print(f"Tool use: {tool_use}")
-            
-            # Create a minimal JSON with just response and tool_use
-            minimal_json = {
-                "response": ai_response,
-                "tool_use": tool_use
-            }
-            
-            tool_result = tool_executor.execute_tools(json.dumps(minimal_json))
-            
-            # Append tool output to the AI response
-            if tool_result["message"]:
-                print(f"Adding tool output to response: {tool_result['message']}")
-                ai_response += tool_result["message"]
-            else:
-                print("No tool output to add to response")
-            print(f"==== TOOL EXECUTION COMPLETE ====\n\n")
-            
         # Return the AI response directly, not wrapped in another JSON object
         # This matches how the transcribe endpoint returns ai_response
-        return jsonify({"ai_response": ai_response})
+        return jsonify({"ai_response": result["ai_response"]})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route("/chat/batch", methods=["POST"])
+def chat_batch():
+    """Answer many text messages concurrently, streaming each result as an NDJSON line when it is ready"""
+    settings = current_settings()
+    batch_settings = settings.get("batch", {})
+    if not batch_settings.get("enabled", True):
+        return jsonify({"error": "Batch requests are disabled"}), 404
+    
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "Expected a JSON object with a messages list"}), 400
+    
+    items, error = parse_batch_items(data, settings)
+    if error:
+        return jsonify({"error": error}), 400
+    
+    # Each item runs with a copy of the context variables (the bulk lane and the request id) and its own
+    # app context (see answer_batch_item()), not the request's, so no item runs the request teardown;
+    # the admission limits bound the calls
+    prompts = {}
+    workers = min(batch_settings.get("concurrency", 8), len(items))
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="chat-batch")
+    futures = [
+        executor.submit(contextvars.copy_context().run, answer_batch_item, item, prompts)
+        for item in items
+    ]
+    logger.info("Batch of %d messages, %d at a time", len(items), workers)
+    
+    def stream_results():
+        try:
+            for future in as_completed(futures):
+                yield json.dumps(future.result()) + "\n"
+        finally:
+            # Drop the messages not started yet if the client went away
+            executor.shutdown(wait=False, cancel_futures=True)
+    
+    return Response(stream_with_context(stream_results()), mimetype="application/x-ndjson")
+
 @app.route("/test-tool", methods=["GET"])
 def test_tool():
     """Test endpoint to directly execute the dance tool"""
     try:
-        print("\n\n==== TESTING TOOL EXECUTION ====")
         # Create a test JSON with tool_use
         test_json = {
             "response": "This is a test response",
@@ -568,8 +1516,7 @@ def test_tool():
         if tool_result["message"]:
             tool_output = tool_result["message"]
         
-        print(f"Tool output: {tool_output}")
-        print("==== TEST COMPLETE ====\n\n")
+        logger.info("Test tool output: %s", tool_output)
         
         # Return the result
         return jsonify({
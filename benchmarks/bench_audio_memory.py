@@ -0,0 +1,172 @@
+"""
+Memory benchmark for the audio upload paths.
+
+Pushes synthetic audio of each size through each provider path (OpenAI transcription, Gemini
+direct audio and transcription, OpenRouter direct audio) against the stand-in provider server,
+and reports per request the peak traced memory, how many copies of the audio that peak amounts
+to, the memory still held afterwards, and the wall time. Exits with status 1 when a budget is
+exceeded, so it can run in CI.
+
+The stand-in server runs in a subprocess so its own buffers are not traced.
+
+Usage:
+    python -m benchmarks.bench_audio_memory [--sizes 1 5 10 25] [--paths openai_transcription ...]
+                                            [--max-peak-mb 200] [--max-copies 8] [--repeat 2]
+"""
+import argparse
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+import wave
+
+import requests
+from werkzeug.datastructures import FileStorage
+
+from benchmarks.load_test import free_port
+from services.google_service import GoogleService
+from services.openai_service import OpenAIService
+from services.openrouter_service import OpenRouterService
+
+PATHS = {
+    "openai_transcription": lambda audio: OpenAIService("mock-key").transcribe_audio(audio, "gpt-4o-transcribe"),
+    "google_direct": lambda audio: GoogleService("mock-key").process_audio(audio, "You are Robert.", None, "gemini-2.0-flash"),
+    "google_transcription": lambda audio: GoogleService("mock-key").transcribe_audio(audio, None, None, "gemini-2.0-flash"),
+    "openrouter_direct": lambda audio: OpenRouterService("mock-key").process_audio_direct(
+        audio, "google/gemini-2.0-flash-001", "You are Robert."),
+}
+
+def synthetic_wav(size_bytes, seed=0):
+    """
+    Build a WAV file of roughly the given size with random samples.
+
+    Args:
+        size_bytes (int): The target file size.
+        seed (int, optional): The random seed. Defaults to 0.
+
+    Returns:
+        bytes: The WAV file contents.
+    """
+    frames = random.Random(seed).randbytes(max(size_bytes - 44, 0) // 2 * 2)
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(16000)
+        wav.writeframes(frames)
+    return buffer.getvalue()
+
+def start_stand_in(port):
+    """Start the stand-in provider server in a subprocess with no added latency."""
+    process = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.mock_providers", "--port", str(port), "--latency-ms", "0", "--latency-dist", "fixed"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+    deadline = time.monotonic() + 15
+    while time.monotonic() < deadline:
+        try:
+            requests.post(f"http://127.0.0.1:{port}/", timeout=1)
+            return process
+        except requests.RequestException:
+            time.sleep(0.1)
+
+    process.terminate()
+    raise RuntimeError("Stand-in provider server did not start")
+
+def measure(path, audio_data, repeat):
+    """
+    Measure one path with one audio size.
+
+    Args:
+        path (str): A key of PATHS.
+        audio_data (bytes): The WAV upload.
+        repeat (int): The number of requests; the worst peak and the mean time are reported.
+
+    Returns:
+        dict: Peak and retained memory in MB, peak as copies of the audio, seconds per request and the result status.
+    """
+    peaks, times, retained = [], [], []
+    status = None
+
+    for _ in range(repeat):
+        audio = FileStorage(stream=io.BytesIO(audio_data), filename="audio.wav", content_type="audio/wav")
+
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+
+        result = PATHS[path](audio)
+
+        times.append(time.perf_counter() - start)
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        # The result is dropped before measuring what the request left behind
+        status = result.get("status")
+        error = result.get("error")
+        del result
+        peaks.append(peak - baseline)
+        retained.append(max(current - baseline, 0))
+
+    audio_mb = len(audio_data) / 1e6
+    peak_mb = max(peaks) / 1e6
+    return {
+        "audio_mb": round(audio_mb, 2),
+        "peak_mb": round(peak_mb, 2),
+        "peak_copies": round(peak_mb / audio_mb, 2) if audio_mb else None,
+        "retained_mb": round(max(retained) / 1e6, 3),
+        "seconds": round(sum(times) / len(times), 4),
+        "status": status if status == "success" else f"error: {str(error)[:80]}",
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=float, nargs="+", default=[1, 5, 10, 25], help="Audio sizes in MB")
+    parser.add_argument("--paths", nargs="+", choices=list(PATHS), default=list(PATHS))
+    parser.add_argument("--repeat", type=int, default=2)
+    parser.add_argument("--max-peak-mb", type=float, help="Fail if any request peaks above this many MB")
+    parser.add_argument("--max-copies", type=float, help="Fail if any request peaks above this many copies of its audio")
+    parser.add_argument("--output", help="Also write the report to this file")
+    args = parser.parse_args()
+
+    port = free_port()
+    stand_in = start_stand_in(port)
+    os.environ.update({
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{port}/openai/v1",
+        "OPENROUTER_BASE_URL": f"http://127.0.0.1:{port}/openrouter/api/v1",
+        "GOOGLE_BASE_URL": f"http://127.0.0.1:{port}/google/v1beta",
+    })
+
+    results = {}
+    violations = []
+    try:
+        for size_mb in args.sizes:
+            audio_data = synthetic_wav(int(size_mb * 1e6))
+            for path in args.paths:
+                result = measure(path, audio_data, args.repeat)
+                results.setdefault(path, {})[f"{size_mb:g}MB"] = result
+
+                if args.max_peak_mb is not None and result["peak_mb"] > args.max_peak_mb:
+                    violations.append(f"{path} {size_mb:g}MB: peak {result['peak_mb']} MB > {args.max_peak_mb} MB")
+                if args.max_copies is not None and result["peak_copies"] > args.max_copies:
+                    violations.append(f"{path} {size_mb:g}MB: peak {result['peak_copies']} copies > {args.max_copies}")
+    finally:
+        stand_in.terminate()
+        stand_in.wait()
+
+    report = {"results": results, "violations": violations}
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+
+    sys.exit(1 if violations else 0)
+
+if __name__ == "__main__":
+    main()
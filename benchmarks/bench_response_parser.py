@@ -0,0 +1,102 @@
+"""
+Microbenchmark for utils.response_parser.parse_response.
+
+Parses each known model output shape many times and reports the mean time per parse
+as JSON, so runs can be compared across changes.
+
+Usage:
+    python -m benchmarks.bench_response_parser [--iterations N]
+"""
+import argparse
+import json
+import timeit
+
+from utils.response_parser import parse_response
+
+# The output shapes we have seen models produce, with the fields they should parse to
+SHAPES = {
+    "json": (
+        '{"transcription": "Can you dance for me?", "response": "Sure, here is a dance!", "tool_use": "tool_use: [dance]"}',
+        {"format": "json", "response": "Sure, here is a dance!", "tool_calls": [("dance", "")]},
+    ),
+    "json_no_tool": (
+        '{"response": "Stockholm is the capital of Sweden."}',
+        {"format": "json", "response": "Stockholm is the capital of Sweden.", "tool_calls": []},
+    ),
+    "preamble": (
+        'Here is my response in JSON format: {"response": "Hello!", "tool_use": "[dance] salsa"}',
+        {"format": "json", "response": "Hello!", "tool_calls": [("dance", "salsa")]},
+    ),
+    "fenced": (
+        'Sure!\n```json\n{"transcription": "Dansa!", "response": "Visst!", "tool_use": "tool_use: [dance]"}\n```',
+        {"format": "fenced", "response": "Visst!", "tool_calls": [("dance", "")]},
+    ),
+    "wrapped": (
+        '"json {"transcription": "Dance please", "response": "Okay!", "tool_use": "tool_use: [dance]"}"',
+        {"format": "wrapped", "response": "Okay!", "tool_calls": [("dance", "")]},
+    ),
+    "embedded": (
+        'Of course. {"response": "Here you go.", "tool_use": "tool_use: [dance]"} Enjoy!',
+        {"format": "embedded", "response": "Here you go.", "tool_calls": [("dance", "")]},
+    ),
+    "malformed": (
+        '{"transcription": "Dance", "response": "Sure \\"thing\\"", "tool_use": "tool_use: [dance]",}',
+        {"format": "regex", "response": 'Sure "thing"', "tool_calls": [("dance", "")]},
+    ),
+    "json_no_tool_value": (
+        '{"response": "Hi", "tool_use": "none"}',
+        {"format": "json", "response": "Hi", "tool_calls": []},
+    ),
+    "json_bare_label": (
+        '{"response": "Hi", "tool_use": "tool_use: dance"}',
+        {"format": "json", "response": "Hi", "tool_calls": []},
+    ),
+    "labels": (
+        "Transcription: What time is it?\nResponse: It is noon.",
+        {"format": "labels", "response": "It is noon.", "tool_calls": []},
+    ),
+    "text_label_in_prose": (
+        "Sure, here is the transcript: hello world",
+        {"format": "text", "response": "Sure, here is the transcript: hello world", "tool_calls": []},
+    ),
+    "text_directive": (
+        "Let me show you my moves! tool_use: [dance]",
+        {"format": "text", "response": "Let me show you my moves! tool_use: [dance]", "tool_calls": [("dance", "")]},
+    ),
+    "text": (
+        "Stockholm is the capital of Sweden.",
+        {"format": "text", "response": "Stockholm is the capital of Sweden.", "tool_calls": []},
+    ),
+}
+
+def check_shapes():
+    """Make sure every shape still parses to the expected fields before timing it."""
+    for name, (content, expected) in SHAPES.items():
+        envelope = parse_response(content)
+        actual = {"format": envelope.format, "response": envelope.response, "tool_calls": envelope.tool_calls}
+        if actual != expected:
+            raise AssertionError(f"Shape {name!r} parsed to {actual}, expected {expected}")
+
+def run(iterations):
+    """
+    Time parse_response on every shape.
+
+    Args:
+        iterations (int): The number of parses per shape.
+
+    Returns:
+        dict: The mean microseconds per parse for each shape.
+    """
+    results = {}
+    for name, (content, _) in SHAPES.items():
+        seconds = min(timeit.repeat(lambda: parse_response(content), number=iterations, repeat=3))
+        results[name] = round(seconds / iterations * 1e6, 3)
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=20000, help="parses per shape")
+    args = parser.parse_args()
+
+    check_shapes()
+    print(json.dumps({"benchmark": "response_parser", "unit": "us_per_parse", "results": run(args.iterations)}, indent=2))
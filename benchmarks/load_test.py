@@ -0,0 +1,326 @@
+"""
+Load generator for /chat and /transcribe.
+
+Drives the app at a target concurrency with text messages and synthetic audio, and reports
+latency percentiles, throughput and error rates per endpoint as JSON, so runs can be compared
+across changes.
+
+With --spawn, it starts the stand-in provider server (benchmarks.mock_providers) and the app
+itself, pointed at the stand-in, so no real API calls are made:
+
+    python -m benchmarks.load_test --spawn --concurrency 16 --duration 30 --latency-ms 400
+
+With --cassette-mode, the spawned app records real provider traffic or replays a recording
+(see services/cassette.py), for deterministic runs against real model outputs:
+
+    python -m benchmarks.load_test --spawn --cassette-mode record --requests 50 --concurrency 1
+    python -m benchmarks.load_test --spawn --cassette-mode replay --cassette-timing zero
+
+Against an already running app (e.g. gunicorn with its provider base URLs set to the stand-in):
+
+    python -m benchmarks.load_test --target http://127.0.0.1:5000 --requests 500 --output run.json
+"""
+import argparse
+import io
+import json
+import math
+import os
+import random
+import shlex
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+import wave
+
+import requests
+
+from benchmarks import mock_providers
+
+MESSAGES = [
+    "Tell me a joke",
+    "What is the capital of Sweden?",
+    "Can you summarize the plot of Hamlet in two sentences?",
+    "Vad är klockan?",
+    "Give me three tips for better sleep",
+]
+
+def synthetic_audio(seconds=5.0, sample_rate=16000, seed=0):
+    """
+    Generate a WAV file of a quiet tone with noise.
+
+    The noise is seeded, so the same arguments always give the same file (and the same recording
+    in a provider cassette).
+
+    Args:
+        seconds (float, optional): The duration. Defaults to 5.0.
+        sample_rate (int, optional): The sample rate. Defaults to 16000.
+        seed (int, optional): The noise seed. Defaults to 0.
+
+    Returns:
+        bytes: The WAV file contents.
+    """
+    noise = random.Random(seed)
+    frames = bytearray()
+    for i in range(int(seconds * sample_rate)):
+        value = 3000 * math.sin(2 * math.pi * 220 * i / sample_rate) + noise.uniform(-500, 500)
+        frames += struct.pack("<h", int(value))
+
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(bytes(frames))
+    return buffer.getvalue()
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+def summarize(samples, elapsed):
+    """
+    Summarize request samples.
+
+    Args:
+        samples (list): (latency seconds, status code or None, error) tuples.
+        elapsed (float): The wall time of the run in seconds.
+
+    Returns:
+        dict: Counts, error rate, throughput and latency percentiles in milliseconds.
+    """
+    latencies = sorted(latency * 1000 for latency, _, _ in samples)
+    errors = [s for s in samples if s[2] is not None]
+    status_codes = {}
+    for _, status, _ in samples:
+        key = str(status) if status is not None else "connection_error"
+        status_codes[key] = status_codes.get(key, 0) + 1
+
+    return {
+        "requests": len(samples),
+        "errors": len(errors),
+        "error_rate": round(len(errors) / len(samples), 4) if samples else 0,
+        "throughput_rps": round(len(samples) / elapsed, 2) if elapsed else 0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 0.50) or 0, 1),
+            "p95": round(percentile(latencies, 0.95) or 0, 1),
+            "p99": round(percentile(latencies, 0.99) or 0, 1),
+            "mean": round(sum(latencies) / len(latencies), 1) if latencies else 0,
+            "max": round(latencies[-1], 1) if latencies else 0,
+        },
+        "status_codes": status_codes,
+    }
+
+class LoadGenerator:
+    """Sends requests from a pool of worker threads until a request count or duration is reached."""
+
+    def __init__(self, target, concurrency=8, transcribe_ratio=0.2, audio=None, timeout=60):
+        """
+        Initialize the load generator.
+
+        Args:
+            target (str): The app base URL.
+            concurrency (int, optional): The number of concurrent clients. Defaults to 8.
+            transcribe_ratio (float, optional): Fraction of requests that go to /transcribe. Defaults to 0.2.
+            audio (bytes, optional): The WAV upload for /transcribe. Defaults to None (5 s of synthetic audio).
+            timeout (float, optional): The request timeout in seconds. Defaults to 60.
+        """
+        self.target = target.rstrip("/")
+        self.concurrency = concurrency
+        self.transcribe_ratio = transcribe_ratio
+        self.audio = audio or synthetic_audio()
+        self.timeout = timeout
+
+        self.samples = {"chat": [], "transcribe": []}
+        self._lock = threading.Lock()
+        self._remaining = 0
+        self._deadline = None
+
+    def _next(self):
+        with self._lock:
+            if self._deadline is not None:
+                return time.monotonic() < self._deadline
+            if self._remaining <= 0:
+                return False
+            self._remaining -= 1
+            return True
+
+    def _send(self, session, endpoint):
+        if endpoint == "transcribe":
+            return session.post(f"{self.target}/transcribe", timeout=self.timeout,
+                                files={"audio": ("audio.wav", self.audio, "audio/wav")})
+        return session.post(f"{self.target}/chat", timeout=self.timeout, json={"message": random.choice(MESSAGES)})
+
+    def _worker(self, record):
+        session = requests.Session()
+        while self._next():
+            endpoint = "transcribe" if random.random() < self.transcribe_ratio else "chat"
+            start = time.perf_counter()
+            status, error = None, None
+            try:
+                response = self._send(session, endpoint)
+                status = response.status_code
+                if status >= 400:
+                    error = f"HTTP {status}"
+            except requests.RequestException as e:
+                error = type(e).__name__
+
+            if record:
+                with self._lock:
+                    self.samples[endpoint].append((time.perf_counter() - start, status, error))
+
+    def run(self, requests_count=None, duration=None, record=True):
+        """
+        Run the load.
+
+        Args:
+            requests_count (int, optional): Total requests to send. Defaults to None.
+            duration (float, optional): Seconds to run for, instead of a request count. Defaults to None.
+            record (bool, optional): Whether to keep the samples (False for warm-up). Defaults to True.
+
+        Returns:
+            float: The elapsed wall time in seconds.
+        """
+        self._remaining = requests_count or 0
+        self._deadline = time.monotonic() + duration if duration else None
+
+        start = time.perf_counter()
+        workers = [threading.Thread(target=self._worker, args=(record,), daemon=True) for _ in range(self.concurrency)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return time.perf_counter() - start
+
+    def report(self, elapsed):
+        """
+        Build the JSON report.
+
+        Args:
+            elapsed (float): The elapsed wall time in seconds.
+
+        Returns:
+            dict: The overall and per-endpoint summaries.
+        """
+        all_samples = self.samples["chat"] + self.samples["transcribe"]
+        return {
+            "target": self.target,
+            "concurrency": self.concurrency,
+            "duration_s": round(elapsed, 2),
+            "total": summarize(all_samples, elapsed),
+            "endpoints": {name: summarize(samples, elapsed) for name, samples in self.samples.items() if samples},
+        }
+
+def free_port():
+    """Find a free local TCP port."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def spawn_app(app_cmd, port, env, timeout=30):
+    """
+    Start the app in a subprocess and wait until it answers.
+
+    Args:
+        app_cmd (str): The command line, with {port} substituted.
+        port (int): The port the app listens on.
+        env (dict): Extra environment variables.
+        timeout (float, optional): Seconds to wait for the app. Defaults to 30.
+
+    Returns:
+        subprocess.Popen: The app process.
+    """
+    process = subprocess.Popen(shlex.split(app_cmd.format(port=port)), env={**os.environ, **env},
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            requests.get(f"http://127.0.0.1:{port}/models", timeout=1)
+            return process
+        except requests.RequestException:
+            if process.poll() is not None:
+                raise RuntimeError(f"App exited with code {process.returncode}")
+            time.sleep(0.2)
+
+    process.terminate()
+    raise RuntimeError("App did not start in time")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", default="http://127.0.0.1:5000", help="The app base URL (ignored with --spawn)")
+    parser.add_argument("--spawn", action="store_true", help="Start the stand-in providers and the app")
+    parser.add_argument("--app-cmd", default=f"{sys.executable} -m flask --app app run --port {{port}} --with-threads",
+                        help="Command used by --spawn to start the app, e.g. 'gunicorn -w 4 -b 127.0.0.1:{port} app:app'")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=200, help="Total requests (ignored with --duration)")
+    parser.add_argument("--duration", type=float, help="Seconds to run for")
+    parser.add_argument("--warmup", type=int, default=10, help="Unrecorded requests sent first")
+    parser.add_argument("--transcribe-ratio", type=float, default=0.2)
+    parser.add_argument("--audio-seconds", type=float, default=5.0)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--output", help="Also write the report to this file")
+    parser.add_argument("--cassette-mode", choices=["record", "replay"],
+                        help="With --spawn, record real provider traffic or replay it instead of using the stand-in")
+    parser.add_argument("--cassette-dir", default="cassettes")
+    parser.add_argument("--cassette-timing", choices=["recorded", "zero"], default="recorded")
+    mock_providers.add_arguments(parser)
+    args = parser.parse_args()
+
+    mock = None
+    app_process = None
+    target = args.target
+
+    try:
+        if args.spawn:
+            port = free_port()
+            # Every simulated client comes from one IP, so the per-client rate limits are turned off
+            env = {"LOG_LEVEL": "WARNING", "RATE_LIMIT_ENABLED": "0"}
+            if args.cassette_mode:
+                # Recording needs the real API keys from .env; replaying needs none
+                env.update({
+                    "PROVIDER_CASSETTE_MODE": args.cassette_mode,
+                    "PROVIDER_CASSETTE_DIR": os.path.abspath(args.cassette_dir),
+                    "PROVIDER_CASSETTE_TIMING": args.cassette_timing,
+                })
+                if args.cassette_mode == "replay":
+                    env.update({"OPENAI_API_KEY": "replay", "OPENROUTER_API_KEY": "replay", "GOOGLE_API_KEY": "replay"})
+            else:
+                mock = mock_providers.server_from_args(args).start()
+                env.update({
+                    **mock.base_urls(),
+                    "OPENAI_API_KEY": "mock-key",
+                    "OPENROUTER_API_KEY": "mock-key",
+                    "GOOGLE_API_KEY": "mock-key",
+                })
+            app_process = spawn_app(args.app_cmd, port, env)
+            target = f"http://127.0.0.1:{port}"
+
+        generator = LoadGenerator(target, args.concurrency, args.transcribe_ratio,
+                                  synthetic_audio(args.audio_seconds), args.timeout)
+        if args.warmup:
+            generator.run(requests_count=args.warmup, record=False)
+
+        elapsed = generator.run(requests_count=args.requests, duration=args.duration)
+        report = generator.report(elapsed)
+        if mock:
+            report["upstream"] = mock.stats
+    finally:
+        if app_process:
+            app_process.terminate()
+            app_process.wait()
+        if mock:
+            mock.stop()
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+"""
+Local stand-in servers for the provider APIs, for load tests and benchmarks without API costs.
+
+Emulates the OpenAI chat completion and transcription endpoints (also streamed), OpenRouter chat
+completions, and Gemini generateContent and streamGenerateContent, each with a configurable latency
+distribution, error rate and response shape. Streamed transcriptions send the transcript a word at
+a time. Point the services at it with the base URL environment variables:
+
+    OPENAI_BASE_URL=http://127.0.0.1:8900/openai/v1
+    OPENROUTER_BASE_URL=http://127.0.0.1:8900/openrouter/api/v1
+    GOOGLE_BASE_URL=http://127.0.0.1:8900/google/v1beta
+
+Usage:
+    python -m benchmarks.mock_providers [--port 8900] [--latency-ms 300] [--latency-dist lognormal]
+                                        [--error-rate 0.01] [--shape mixed] [--config routes.json]
+
+The --config file overrides the defaults per route ("openai_chat", "openai_transcription",
+"openrouter_chat", "google_generate", "google_stream"), e.g. {"openai_transcription": {"latency_ms": 800}}.
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from benchmarks.bench_response_parser import SHAPES
+
+ROUTES = ("openai_chat", "openai_transcription", "openrouter_chat", "google_generate", "google_stream")
+
+DEFAULT_ROUTE_CONFIG = {
+    # "fixed", "uniform" (latency_ms +/- jitter_ms), "lognormal" (median latency_ms, sigma) or "exponential" (mean latency_ms)
+    "latency_dist": "lognormal",
+    "latency_ms": 300,
+    "jitter_ms": 100,
+    "sigma": 0.5,
+    "error_rate": 0.0,
+    "error_status": 500,
+    # A key of benchmarks.bench_response_parser.SHAPES, or "mixed" for a random shape per response
+    "shape": "json_no_tool",
+    # Fraction of requests offering native tools that get a tool call back
+    "tool_call_rate": 0.0,
+    "transcript": "Can you tell me a joke?",
+    # Delay between the chunks of a streamed response
+    "stream_interval_ms": 40,
+}
+
+def sample_latency(config):
+    """
+    Draw a response delay from a route's latency distribution.
+
+    Args:
+        config (dict): The route configuration.
+
+    Returns:
+        float: The delay in seconds.
+    """
+    latency_ms = config["latency_ms"]
+    dist = config["latency_dist"]
+
+    if dist == "uniform":
+        latency_ms = random.uniform(latency_ms - config["jitter_ms"], latency_ms + config["jitter_ms"])
+    elif dist == "lognormal":
+        latency_ms = random.lognormvariate(0, config["sigma"]) * latency_ms
+    elif dist == "exponential":
+        latency_ms = random.expovariate(1 / latency_ms) if latency_ms > 0 else 0
+
+    return max(latency_ms, 0) / 1000
+
+def sample_content(config):
+    """Pick the raw model output for a response, in the configured shape."""
+    shape = config["shape"]
+    if shape == "mixed":
+        shape = random.choice(list(SHAPES))
+    return SHAPES[shape][0]
+
+class MockProviderHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        # Always read the whole body, as a real server would, before answering
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        path = self.path.split("?", 1)[0]
+
+        if path == "/openai/v1/chat/completions":
+            route = "openai_chat"
+        elif path == "/openai/v1/audio/transcriptions":
+            route = "openai_transcription"
+        elif path == "/openrouter/api/v1/chat/completions":
+            route = "openrouter_chat"
+        elif path.startswith("/google/v1beta/models/") and path.endswith(":generateContent"):
+            route = "google_generate"
+        elif path.startswith("/google/v1beta/models/") and path.endswith(":streamGenerateContent"):
+            route = "google_stream"
+        else:
+            self._send(404, {"error": {"message": f"Unknown path: {path}"}})
+            return
+
+        config = self.server.routes[route]
+        self.server.record(route, len(body))
+        time.sleep(sample_latency(config))
+
+        if random.random() < config["error_rate"]:
+            self._send(config["error_status"], {"error": {"message": "Injected error", "code": config["error_status"]}})
+            return
+
+        if route == "openai_transcription" and re.search(rb'name="stream"\r\n\r\ntrue', body):
+            self._stream_transcript(config, openai=True)
+        elif route == "google_stream":
+            self._stream_transcript(config, openai=False)
+        elif route == "openai_transcription":
+            self._send(200, {"text": config["transcript"]})
+        elif route == "google_generate":
+            self._send(200, self._gemini_response(config, body))
+        else:
+            self._send(200, self._chat_response(config, body))
+
+    def _chat_response(self, config, body):
+        payload = json.loads(body or b"{}")
+        message = {"role": "assistant", "content": sample_content(config)}
+
+        if payload.get("tools") and random.random() < config["tool_call_rate"]:
+            name = payload["tools"][0]["function"]["name"]
+            message = {
+                "role": "assistant",
+                "content": None,
+                "tool_calls": [{"id": "call_mock", "type": "function", "function": {"name": name, "arguments": "{}"}}]
+            }
+
+        return {
+            "id": "chatcmpl-mock",
+            "object": "chat.completion",
+            "model": payload.get("model", "mock"),
+            "choices": [{"index": 0, "message": message, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": len(body) // 4, "completion_tokens": 20, "total_tokens": len(body) // 4 + 20}
+        }
+
+    def _gemini_response(self, config, body):
+        payload = json.loads(body or b"{}")
+        parts = [{"text": sample_content(config)}]
+
+        declarations = [d for tool in payload.get("tools", []) for d in tool.get("functionDeclarations", [])]
+        if declarations and random.random() < config["tool_call_rate"]:
+            parts = [{"functionCall": {"name": declarations[0]["name"], "args": {}}}]
+
+        return {
+            "candidates": [{"content": {"role": "model", "parts": parts}, "finishReason": "STOP"}],
+            "usageMetadata": {"promptTokenCount": len(body) // 4, "candidatesTokenCount": 20}
+        }
+
+    def _stream_transcript(self, config, openai):
+        """Send the transcript a word at a time as server-sent events, in OpenAI's or Gemini's format."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        words = config["transcript"].split(" ")
+        for index, word in enumerate(words):
+            if index:
+                time.sleep(config["stream_interval_ms"] / 1000)
+            text = word if index == 0 else f" {word}"
+            if openai:
+                event = {"type": "transcript.text.delta", "delta": text}
+            else:
+                event = {
+                    "candidates": [{"content": {"role": "model", "parts": [{"text": text}]}}],
+                    "usageMetadata": {"promptTokenCount": 100, "candidatesTokenCount": index + 1}
+                }
+            self._send_chunk(f"data: {json.dumps(event)}\n\n".encode())
+
+        if openai:
+            done = {"type": "transcript.text.done", "text": config["transcript"],
+                    "usage": {"input_tokens": 100, "output_tokens": len(words)}}
+            self._send_chunk(f"data: {json.dumps(done)}\n\n".encode())
+        self._send_chunk(b"")
+
+    def _send_chunk(self, data):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def _send(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+class MockProviderServer(ThreadingHTTPServer):
+    """
+    The stand-in provider server. Runs in a background thread, so benchmarks can start it in-process.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=8900, defaults=None, routes=None):
+        """
+        Initialize the server.
+
+        Args:
+            host (str, optional): The host to bind. Defaults to "127.0.0.1".
+            port (int, optional): The port to bind, 0 for any free port. Defaults to 8900.
+            defaults (dict, optional): Overrides of DEFAULT_ROUTE_CONFIG for every route. Defaults to None.
+            routes (dict, optional): Per-route overrides. Defaults to None.
+        """
+        super().__init__((host, port), MockProviderHandler)
+        self.routes = {}
+        for route in ROUTES:
+            self.routes[route] = {**DEFAULT_ROUTE_CONFIG, **(defaults or {}), **(routes or {}).get(route, {})}
+
+        self.stats = {route: {"requests": 0, "bytes": 0} for route in ROUTES}
+        self._stats_lock = threading.Lock()
+        self._thread = None
+
+    def record(self, route, size):
+        """Count a request and its body size."""
+        with self._stats_lock:
+            self.stats[route]["requests"] += 1
+            self.stats[route]["bytes"] += size
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def base_urls(self):
+        """
+        Get the base URL environment variables that point the services at this server.
+
+        Returns:
+            dict: Environment variable names mapped to URLs.
+        """
+        return {
+            "OPENAI_BASE_URL": f"{self.url}/openai/v1",
+            "OPENROUTER_BASE_URL": f"{self.url}/openrouter/api/v1",
+            "GOOGLE_BASE_URL": f"{self.url}/google/v1beta",
+        }
+
+    def start(self):
+        """Serve in a background thread."""
+        self._thread = threading.Thread(target=self.serve_forever, name="mock-providers", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving."""
+        self.shutdown()
+        self.server_close()
+
+def add_arguments(parser):
+    """Add the mock server options to an argument parser."""
+    parser.add_argument("--latency-ms", type=float, default=DEFAULT_ROUTE_CONFIG["latency_ms"],
+                        help="Typical upstream latency (median for lognormal, mean for exponential)")
+    parser.add_argument("--latency-dist", choices=["fixed", "uniform", "lognormal", "exponential"],
+                        default=DEFAULT_ROUTE_CONFIG["latency_dist"])
+    parser.add_argument("--error-rate", type=float, default=DEFAULT_ROUTE_CONFIG["error_rate"])
+    parser.add_argument("--shape", choices=list(SHAPES) + ["mixed"], default=DEFAULT_ROUTE_CONFIG["shape"])
+    parser.add_argument("--tool-call-rate", type=float, default=DEFAULT_ROUTE_CONFIG["tool_call_rate"])
+    parser.add_argument("--config", help="JSON file with per-route overrides")
+
+def server_from_args(args, host="127.0.0.1", port=0):
+    """
+    Create a MockProviderServer from parsed add_arguments() options.
+
+    Returns:
+        MockProviderServer: The server, not yet started.
+    """
+    defaults = {
+        "latency_ms": args.latency_ms,
+        "latency_dist": args.latency_dist,
+        "error_rate": args.error_rate,
+        "shape": args.shape,
+        "tool_call_rate": args.tool_call_rate,
+    }
+    routes = {}
+    if args.config:
+        with open(args.config, "r") as f:
+            routes = json.load(f)
+
+    return MockProviderServer(host, port, defaults, routes)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    server = server_from_args(args, args.host, args.port)
+    for name, url in server.base_urls().items():
+        print(f"{name}={url}")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
@@ -1,6 +1,10 @@
 import os
 import json
 
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
 # Load models from the models.json file
 def load_models():
     """
@@ -12,7 +16,7 @@ def load_models():
         with open(models_path, 'r') as f:
             return json.load(f)
     except Exception as e:
-        print(f"Error loading models: {str(e)}")
+        logger.error("Error loading models: %s", e)
         return {"models": []}
 
 # Get model information by ID
@@ -29,6 +33,20 @@ def get_model_info(model_id, models=None):
             return model
     return None
 
+# Get the faster fallback tier of a model
+def get_fallback_model(model_id, models=None):
+    """
+    Get the model to use instead of a model when the app is under load.
+    Returns the fallback's model information, or None if the model has no (known) fallback.
+    """
+    if models is None:
+        models = load_models()
+    
+    model_info = get_model_info(model_id, models)
+    if not model_info or not model_info.get("fallback"):
+        return None
+    return get_model_info(model_info["fallback"], models)
+
 # Check if the audio model is multimodal and can handle direct audio-to-text
 def is_same_multimodal_model(settings):
     """
@@ -41,10 +59,10 @@ def is_same_multimodal_model(settings):
         # Check if the audio model is multimodal
         model_info = get_model_info(audio_model)
         if not model_info:
-            print(f"Model info not found for audio model: {audio_model}")
+            logger.warning("Model info not found for audio model: %s", audio_model)
             return False
             
-        print(f"Audio model info: multimodal={model_info.get('multimodal')}, provider={model_info.get('provider')}")
+        logger.debug("Audio model info: multimodal=%s, provider=%s", model_info.get("multimodal"), model_info.get("provider"))
         
         # Enable direct audio-to-text for multimodal models from supported providers
         if model_info.get("multimodal", False):
@@ -52,7 +70,7 @@ def is_same_multimodal_model(settings):
             
             # For Google models, enable direct audio-to-text
             if provider == "Google":
-                print(f"Using direct audio-to-text with Google model: {audio_model}")
+                logger.debug("Using direct audio-to-text with Google model: %s", audio_model)
                 return True
                 
             # For OpenRouter models, enable direct audio-to-text
@@ -60,13 +78,13 @@ def is_same_multimodal_model(settings):
                 # Temporarily disable direct audio-to-text for specific models that are known to have issues
                 problematic_models = []  # Removed "google/gemini-2.5-pro-exp-03-25:free" from this list
                 if audio_model in problematic_models:
-                    print(f"Model {audio_model} is known to have issues with direct audio-to-text. Using two-step process.")
+                    logger.debug("Model %s is known to have issues with direct audio-to-text. Using two-step process.", audio_model)
                     return False
                     
-                print(f"Using direct audio-to-text with OpenRouter model: {audio_model}")
+                logger.debug("Using direct audio-to-text with OpenRouter model: %s", audio_model)
                 return True
         
         return False
     except Exception as e:
-        print(f"Error in is_same_multimodal_model: {str(e)}")
+        logger.error("Error in is_same_multimodal_model: %s", e)
         return False
\ No newline at end of file
@@ -1,10 +1,135 @@
-mport os
+import os
 import json
 
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
 # Default settings
 DEFAULT_SETTINGS = {
     "transcription_model": "gpt-4o-transcribe",
     "response_model": "gpt-4o",
+    "intent_fast_path": {
+        "enabled": True,
+        "threshold": 0.75
+    },
+    "tool_calling": "auto",
+    "tool_selection": {
+        "enabled": True,
+        "top_k": 5
+    },
+    "admission": {
+        "enabled": True,
+        "queue_timeout_seconds": 10,
+        "default": {
+            "max_concurrency": 16,
+            "max_queue": 64
+        },
+        "providers": {
+            "OpenRouter": {
+                "max_concurrency": 8,
+                "max_queue": 32
+            }
+        },
+        "models": {},
+        "lanes": {
+            "interactive": {
+                "weight": 6,
+                "reserved": 2
+            },
+            "standard": {
+                "weight": 3,
+                "reserved": 0
+            },
+            "bulk": {
+                "weight": 1,
+                "reserved": 0
+            }
+        },
+        "preempt_bulk_after_ms": 500
+    },
+    "brownout": {
+        "enabled": True,
+        "enter_latency_ms": 6000,
+        "exit_latency_ms": 3000,
+        "enter_queue_depth": 16,
+        "exit_queue_depth": 4,
+        "min_active_seconds": 30,
+        "drop_prompt_sections": []
+    },
+    "rate_limit": {
+        "enabled": True,
+        "database": "",
+        "trust_proxy": False,
+        "audio_bytes_per_second": 32000,
+        "buckets": {
+            "text": {
+                "capacity": 30,
+                "refill_per_second": 0.5
+            },
+            "audio_seconds": {
+                "capacity": 1800,
+                "refill_per_second": 1.0
+            },
+            "batch_items": {
+                "capacity": 1000,
+                "refill_per_second": 1.0
+            }
+        }
+    },
+    "coalescing": {
+        "enabled": True
+    },
+    "idempotency": {
+        "enabled": True,
+        "database": "",
+        "ttl_seconds": 86400,
+        "wait_seconds": 2,
+        "pending_timeout_seconds": 300
+    },
+    "batch": {
+        "enabled": True,
+        "max_items": 1000,
+        "concurrency": 8
+    },
+    "jobs": {
+        "enabled": True,
+        "database": "",
+        "spool_dir": "",
+        "workers": 2,
+        "max_queued": 100,
+        "lease_seconds": 600,
+        "max_attempts": 3,
+        "ttl_seconds": 86400,
+        "poll_seconds": 0.5,
+        "lane": "standard"
+    },
+    "cancellation": {
+        "enabled": True,
+        "database": "",
+        "detect_disconnects": True,
+        "poll_seconds": 0.2
+    },
+    "uploads": {
+        "enabled": True,
+        "database": "",
+        "spool_dir": "",
+        "max_bytes": 50000000,
+        "max_chunk_bytes": 8388608,
+        "max_pending": 5,
+        "stale_seconds": 3600,
+        "lock_seconds": 300
+    },
+    "tts": {
+        "enabled": True,
+        "provider": "OpenAI",
+        "model": "gpt-4o-mini-tts",
+        "voice": "alloy",
+        "format": "mp3",
+        "concurrency": 4,
+        "min_sentence_chars": 20,
+        "max_chars": 1500
+    },
     "system_prompt": {
         "base": "You are Robert. A helpful information guide. You give short but helpful answers to user queries. You are also an expert on tool use.",
         "tools": {
@@ -46,7 +171,7 @@ def load_settings():
                 json.dump(DEFAULT_SETTINGS, f, indent=2)
             return DEFAULT_SETTINGS
     except Exception as e:
-        print(f"Error loading settings: {str(e)}")
+        logger.error("Error loading settings: %s", e)
         return DEFAULT_SETTINGS
 
 def save_settings(settings):
@@ -61,7 +186,7 @@ def save_settings(settings):
             json.dump(settings, f, indent=2)
         return True
     except Exception as e:
-        print(f"Error saving settings: {str(e)}")
+        logger.error("Error saving settings: %s", e)
         return False
 
 def update_settings(new_settings):
@@ -82,5 +207,5 @@ def update_settings(new_settings):
         else:
             return None
     except Exception as e:
-        print(f"Error updating settings: {str(e)}")
+        logger.error("Error updating settings: %s", e)
         return None
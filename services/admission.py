@@ -0,0 +1,403 @@
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from utils.logger import get_logger
+from utils.metrics import registry
+from services import cancellation
+
+logger = get_logger(__name__)
+
+QUEUE_DEPTH = registry.gauge(
+    "robert_admission_queue_depth", "Provider calls waiting for a concurrency slot", ("limiter", "lane"))
+IN_FLIGHT = registry.gauge(
+    "robert_admission_in_flight", "Provider calls holding a concurrency slot", ("limiter", "lane"))
+SHED = registry.counter(
+    "robert_admission_shed_total", "Provider calls rejected by admission control", ("limiter", "lane", "reason"))
+QUEUE_WAIT = registry.histogram(
+    "robert_admission_wait_seconds", "Time provider calls waited for a concurrency slot", ("limiter", "lane"))
+
+# Priority lanes, highest first
+LANES = ("interactive", "standard", "bulk")
+
+DEFAULT_CONFIG = {
+    "enabled": True,
+    "queue_timeout_seconds": 10,
+    "default": {"max_concurrency": 16, "max_queue": 64},
+    "providers": {},
+    "models": {},
+    "lanes": {
+        "interactive": {"weight": 6, "reserved": 2},
+        "standard": {"weight": 3, "reserved": 0},
+        "bulk": {"weight": 1, "reserved": 0},
+    },
+    "preempt_bulk_after_ms": 500,
+}
+
+_lane = ContextVar("admission_lane", default="standard")
+
+def set_lane(name):
+    """
+    Set the priority lane of the provider calls made by the current request.
+
+    Args:
+        name (str): "interactive", "standard" or "bulk". Unknown names mean "standard".
+    """
+    _lane.set(name if name in LANES else "standard")
+
+def get_lane():
+    """Return the priority lane of the current request or job."""
+    return _lane.get()
+
+@contextmanager
+def lane(name):
+    """Run a block, e.g. a background job, with its provider calls in the given priority lane."""
+    token = _lane.set(name if name in LANES else "standard")
+    try:
+        yield
+    finally:
+        _lane.reset(token)
+
+class Overloaded(Exception):
+    """
+    Raised when a call is shed: its queue was full, its queue-time deadline passed, or it was
+    bulk work preempted by interactive traffic.
+
+    Attributes:
+        limiter (str): The name of the limiter that shed the call.
+        reason (str): "saturated", "queue_full", "timeout" or "preempted".
+        retry_after (int): Suggested seconds before retrying.
+    """
+
+    def __init__(self, limiter, reason, retry_after):
+        super().__init__(f"Too busy: {limiter} {reason.replace('_', ' ')}, retry after {retry_after} s")
+        self.limiter = limiter
+        self.reason = reason
+        self.retry_after = retry_after
+
+class _Waiter:
+    __slots__ = ("lane", "event", "granted", "preempted")
+
+    def __init__(self, lane):
+        self.lane = lane
+        self.event = threading.Event()
+        self.granted = False
+        self.preempted = False
+
+class Limiter:
+    """
+    A concurrency limit with a bounded wait queue per priority lane.
+
+    Released slots are handed directly to waiters: the lane is picked by smooth weighted round
+    robin over the lanes with waiters, and calls within a lane are served in FIFO order. Each lane
+    may reserve slots that the other lanes cannot take, so interactive calls always find room.
+
+    When the average interactive queue wait exceeds preempt_after, queued bulk calls are shed and
+    new ones rejected, until the average drops below half of that again.
+    """
+
+    def __init__(self, name, max_concurrency, max_queue, lanes=None, preempt_after=0.5):
+        """
+        Initialize the limiter.
+
+        Args:
+            name (str): The limiter name, e.g. "OpenAI" or "OpenAI/gpt-4o".
+            max_concurrency (int): The maximum number of calls in flight.
+            max_queue (int): The maximum number of calls waiting for a slot, over all lanes.
+            lanes (dict, optional): Lane names mapped to their "weight" and "reserved" slots.
+                                    Defaults to None (DEFAULT_CONFIG["lanes"]).
+            preempt_after (float, optional): The average interactive wait in seconds that makes bulk
+                                             work yield. Defaults to 0.5; None never preempts.
+        """
+        lanes = lanes or DEFAULT_CONFIG["lanes"]
+
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.weights = {name: lanes.get(name, {}).get("weight", 1) for name in LANES}
+        self.reserved = {name: lanes.get(name, {}).get("reserved", 0) for name in LANES}
+        self.preempt_after = preempt_after
+
+        self.active = {name: 0 for name in LANES}
+        self.waiters = {name: deque() for name in LANES}
+        self.hold_time = 1.0
+        self.interactive_wait = 0.0
+        self.preempting = False
+
+        self._credits = {name: 0 for name in LANES}
+        self._lock = threading.Lock()
+
+    @property
+    def queued(self):
+        return sum(len(waiters) for waiters in self.waiters.values())
+
+    def _has_capacity(self, lane):
+        # Free slots, minus those other lanes have reserved but are not using
+        free = self.max_concurrency - sum(self.active.values())
+        held_back = sum(max(self.reserved[other] - self.active[other], 0) for other in LANES if other != lane)
+        return free - held_back >= 1
+
+    def _grant(self, lane):
+        self.active[lane] += 1
+        IN_FLIGHT.inc(limiter=self.name, lane=lane)
+
+    def _dispatch(self):
+        while True:
+            eligible = [name for name in LANES if self.waiters[name] and self._has_capacity(name)]
+            if not eligible:
+                return
+
+            # Smooth weighted round robin: the lane with the most credit goes next
+            for name in eligible:
+                self._credits[name] += self.weights[name]
+            chosen = max(eligible, key=lambda name: self._credits[name])
+            self._credits[chosen] -= sum(self.weights[name] for name in eligible)
+
+            waiter = self.waiters[chosen].popleft()
+            QUEUE_DEPTH.dec(limiter=self.name, lane=chosen)
+            self._grant(chosen)
+            waiter.granted = True
+            waiter.event.set()
+
+    def _preempt(self, above):
+        """Shed the newest waiter of the lowest lane below `above`. Returns False if there is none."""
+        for name in reversed(LANES[LANES.index(above) + 1:]):
+            if self.waiters[name]:
+                waiter = self.waiters[name].pop()
+                QUEUE_DEPTH.dec(limiter=self.name, lane=name)
+                waiter.preempted = True
+                waiter.event.set()
+                return True
+        return False
+
+    def _observe_interactive_wait(self, seconds):
+        self.interactive_wait = 0.8 * self.interactive_wait + 0.2 * seconds
+        if self.preempt_after is None:
+            return
+
+        if not self.preempting and self.interactive_wait > self.preempt_after:
+            self.preempting = True
+            logger.warning("Interactive calls to %s wait %.0f ms, preempting bulk work",
+                           self.name, self.interactive_wait * 1000)
+            while self.waiters["bulk"]:
+                self._preempt("standard")
+        elif self.preempting and self.interactive_wait < self.preempt_after / 2:
+            self.preempting = False
+            logger.info("Interactive wait on %s recovered, admitting bulk work", self.name)
+
+    def _decay_interactive_wait(self):
+        # With no interactive call queued, a new one would not wait; counting that lets
+        # preemption end even when interactive traffic stops
+        if self.preempting and not self.waiters["interactive"]:
+            self._observe_interactive_wait(0.0)
+
+    def acquire(self, deadline, lane="standard", token=None):
+        """
+        Take a slot, waiting in the lane's queue until the deadline if none is free.
+
+        Args:
+            deadline (float): The time.monotonic() by which the call must have a slot.
+            lane (str, optional): The priority lane. Defaults to "standard".
+            token (CancelToken, optional): Stops the wait when the request is cancelled. Defaults to None.
+
+        Raises:
+            Overloaded: If the queue is full, the deadline passes or the call is preempted.
+            Cancelled: If the request was cancelled while the call waited.
+        """
+        with self._lock:
+            if lane == "bulk":
+                self._decay_interactive_wait()
+            if lane == "bulk" and self.preempting:
+                SHED.inc(limiter=self.name, lane=lane, reason="preempted")
+                raise Overloaded(self.name, "preempted", self.retry_after())
+            if not self.waiters[lane] and self._has_capacity(lane):
+                self._grant(lane)
+                if lane == "interactive":
+                    self._observe_interactive_wait(0.0)
+                return
+            # A full queue makes room for a higher-lane call by shedding a lower-lane waiter
+            if self.queued >= self.max_queue and not self._preempt(lane):
+                SHED.inc(limiter=self.name, lane=lane, reason="queue_full")
+                raise Overloaded(self.name, "queue_full", self.retry_after())
+            waiter = _Waiter(lane)
+            self.waiters[lane].append(waiter)
+            QUEUE_DEPTH.inc(limiter=self.name, lane=lane)
+
+        start = time.monotonic()
+        if token is not None:
+            token.add_callback(waiter.event.set)
+        waiter.event.wait(max(deadline - start, 0))
+        if token is not None:
+            token.remove_callback(waiter.event.set)
+
+        with self._lock:
+            waited = time.monotonic() - start
+            QUEUE_WAIT.observe(waited, limiter=self.name, lane=lane)
+            if lane == "interactive":
+                self._observe_interactive_wait(waited)
+            if waiter.granted:
+                return
+            if waiter.preempted:
+                SHED.inc(limiter=self.name, lane=lane, reason="preempted")
+                raise Overloaded(self.name, "preempted", self.retry_after())
+            self.waiters[lane].remove(waiter)
+            QUEUE_DEPTH.dec(limiter=self.name, lane=lane)
+            if token is not None and token.cancelled:
+                raise cancellation.Cancelled(token.reason)
+            SHED.inc(limiter=self.name, lane=lane, reason="timeout")
+            raise Overloaded(self.name, "timeout", self.retry_after())
+
+    def release(self, held_seconds, lane="standard"):
+        """
+        Free a slot and hand the free slots to the next waiters.
+
+        Args:
+            held_seconds (float): How long the slot was held, for the Retry-After estimate.
+            lane (str, optional): The lane the slot was taken in. Defaults to "standard".
+        """
+        with self._lock:
+            self.hold_time = 0.9 * self.hold_time + 0.1 * held_seconds
+            self.active[lane] -= 1
+            IN_FLIGHT.dec(limiter=self.name, lane=lane)
+            self._decay_interactive_wait()
+            self._dispatch()
+
+    def retry_after(self):
+        """Estimate the seconds until the queue has drained."""
+        return max(1, math.ceil((self.queued + 1) * self.hold_time / self.max_concurrency))
+
+    def is_saturated(self, lane="standard"):
+        """Return True if a new call in the lane would be rejected right away."""
+        if lane == "bulk" and self.preempting:
+            return True
+        if self._has_capacity(lane) or self.queued < self.max_queue:
+            return False
+        # A full queue still takes the call if a lower-lane waiter can be shed for it
+        return not any(self.waiters[name] for name in LANES[LANES.index(lane) + 1:])
+
+class AdmissionController:
+    """
+    Per-provider and per-model concurrency limits around provider calls.
+
+    Every provider has a limiter (from "providers", or "default"); models listed under "models"
+    get an additional limiter of their own. A call takes the model slot first, then the provider
+    slot, so the order is always the same and calls cannot deadlock each other. Calls queue in the
+    priority lane of the request or job that makes them (see set_lane() and lane()).
+    """
+
+    def __init__(self, config=None):
+        self.configure(config)
+
+    def configure(self, config=None):
+        """
+        Apply the "admission" settings. Existing limiters are replaced, so calls in flight finish
+        under the old limits.
+
+        Args:
+            config (dict, optional): The settings. Defaults to None (DEFAULT_CONFIG).
+        """
+        self.config = {**DEFAULT_CONFIG, **(config or {})}
+        self.enabled = self.config["enabled"]
+        self._limiters = {}
+        self._lock = threading.Lock()
+
+    def _limiter(self, name, limits):
+        limiter = self._limiters.get(name)
+        if limiter is None:
+            with self._lock:
+                limiter = self._limiters.get(name)
+                if limiter is None:
+                    preempt_ms = self.config["preempt_bulk_after_ms"]
+                    limiter = Limiter(name, limits["max_concurrency"], limits["max_queue"], self.config["lanes"],
+                                      preempt_ms / 1000 if preempt_ms is not None else None)
+                    self._limiters[name] = limiter
+        return limiter
+
+    def limiters_for(self, provider, model_id):
+        """
+        Get the limiters a call to a model must pass, in acquisition order.
+
+        Args:
+            provider (str): The provider name.
+            model_id (str): The model ID.
+
+        Returns:
+            list: The Limiter objects.
+        """
+        limiters = []
+        model_limits = self.config["models"].get(model_id)
+        if model_limits:
+            limiters.append(self._limiter(f"{provider}/{model_id}", model_limits))
+
+        provider_limits = self.config["providers"].get(provider, self.config["default"])
+        limiters.append(self._limiter(provider, provider_limits))
+        return limiters
+
+    def acquire(self, provider, model_id):
+        """
+        Take the slots for a call, in the current priority lane.
+
+        Args:
+            provider (str): The provider name.
+            model_id (str): The model ID.
+
+        Returns:
+            list: The acquired (limiter, lane) slots, to pass to release().
+
+        Raises:
+            Overloaded: If the call was shed.
+            Cancelled: If the request was cancelled while the call waited.
+        """
+        if not self.enabled:
+            return []
+
+        current_lane = get_lane()
+        token = cancellation.current()
+        deadline = time.monotonic() + self.config["queue_timeout_seconds"]
+        acquired = []
+        try:
+            for limiter in self.limiters_for(provider, model_id):
+                limiter.acquire(deadline, current_lane, token)
+                acquired.append((limiter, current_lane))
+        except Overloaded as e:
+            self.release(acquired, 0)
+            logger.warning("Shedding %s call in the %s lane: %s", model_id, current_lane, e)
+            raise
+        except cancellation.Cancelled:
+            self.release(acquired, 0)
+            raise
+        return acquired
+
+    def release(self, slots, held_seconds):
+        """Release the slots taken by acquire()."""
+        for limiter, slot_lane in reversed(slots):
+            limiter.release(held_seconds, slot_lane)
+
+    def check(self, provider, model_id):
+        """
+        Shed a request early, before any work is done, if a call to the model would be shed right away.
+
+        Args:
+            provider (str): The provider name.
+            model_id (str): The model ID.
+
+        Raises:
+            Overloaded: If one of the model's limiters is saturated for the current lane.
+        """
+        if not self.enabled:
+            return
+        current_lane = get_lane()
+        for limiter in self.limiters_for(provider, model_id):
+            if limiter.is_saturated(current_lane):
+                SHED.inc(limiter=limiter.name, lane=current_lane, reason="saturated")
+                raise Overloaded(limiter.name, "saturated", limiter.retry_after())
+
+    def queued(self):
+        """Return the number of calls waiting for a slot, over all limiters."""
+        return sum(limiter.queued for limiter in list(self._limiters.values()))
+
+# The process-wide controller; the app applies the "admission" settings to it
+controller = AdmissionController()
@@ -0,0 +1,133 @@
+import threading
+import time
+
+from utils.logger import get_logger
+from utils.metrics import registry
+from models.model_info import get_fallback_model
+
+logger = get_logger(__name__)
+
+BROWNOUT_ACTIVE = registry.gauge(
+    "robert_brownout_active", "1 while the app answers with the faster fallback models")
+BROWNOUT_TRANSITIONS = registry.counter(
+    "robert_brownout_transitions_total", "Brownout mode changes", ("state",))
+
+DEFAULT_CONFIG = {
+    "enabled": True,
+    "enter_latency_ms": 6000,
+    "exit_latency_ms": 3000,
+    "enter_queue_depth": 16,
+    "exit_queue_depth": 4,
+    "min_active_seconds": 30,
+    # Prompt sections left out while active; only "tools" is supported
+    "drop_prompt_sections": [],
+}
+
+class BrownoutController:
+    """
+    Degrades to faster models while the providers are slow or the admission queues are long.
+
+    The controller enters brownout when the smoothed upstream latency or the number of queued
+    provider calls crosses its "enter" threshold. While active, the transcription and response
+    models are replaced by their "fallback" model from models.json. It leaves brownout only after
+    min_active_seconds, once both signals are below their lower "exit" thresholds, so it does not
+    flap when the load hovers around one threshold.
+    """
+
+    def __init__(self, config=None):
+        self.configure(config)
+
+    def configure(self, config=None):
+        """
+        Apply the "brownout" settings.
+
+        Args:
+            config (dict, optional): The settings. Defaults to None (DEFAULT_CONFIG).
+        """
+        if getattr(self, "active", False):
+            BROWNOUT_ACTIVE.dec()
+
+        self.config = {**DEFAULT_CONFIG, **(config or {})}
+        self.active = False
+        self.since = None
+        self.latency = 0.0
+
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        """
+        Feed the latency of a provider call.
+
+        Args:
+            seconds (float): How long the call took.
+        """
+        self.latency = 0.9 * self.latency + 0.1 * seconds
+
+    def update(self, queued):
+        """
+        Re-evaluate the brownout state.
+
+        Args:
+            queued (int): The number of provider calls waiting for an admission slot.
+
+        Returns:
+            bool: True if brownout is active.
+        """
+        if not self.config["enabled"]:
+            return False
+
+        latency_ms = self.latency * 1000
+
+        with self._lock:
+            if not self.active:
+                if latency_ms > self.config["enter_latency_ms"]:
+                    self._enter(f"upstream latency {latency_ms:.0f} ms")
+                elif queued > self.config["enter_queue_depth"]:
+                    self._enter(f"{queued} queued provider calls")
+            elif (time.monotonic() - self.since >= self.config["min_active_seconds"]
+                  and latency_ms < self.config["exit_latency_ms"]
+                  and queued < self.config["exit_queue_depth"]):
+                self.active = False
+                self.since = None
+                BROWNOUT_ACTIVE.dec()
+                BROWNOUT_TRANSITIONS.inc(state="exit")
+                logger.info("Brownout over: upstream latency %.0f ms, %d queued provider calls", latency_ms, queued)
+
+        return self.active
+
+    def _enter(self, reason):
+        self.active = True
+        self.since = time.monotonic()
+        BROWNOUT_ACTIVE.inc()
+        BROWNOUT_TRANSITIONS.inc(state="enter")
+        logger.warning("Brownout: %s, switching to the fallback models", reason)
+
+    def apply(self, settings, models):
+        """
+        Get the settings to serve a request with.
+
+        Args:
+            settings (dict): The configured settings.
+            models (dict): The models from models.json.
+
+        Returns:
+            dict: The settings, or while active a copy with each model replaced by its fallback.
+        """
+        if not self.active:
+            return settings
+
+        effective = dict(settings)
+        transcription_fallback = get_fallback_model(settings["transcription_model"], models)
+        if transcription_fallback and transcription_fallback.get("can_transcribe", False):
+            effective["transcription_model"] = transcription_fallback["model"]
+        response_fallback = get_fallback_model(settings["response_model"], models)
+        if response_fallback:
+            effective["response_model"] = response_fallback["model"]
+        return effective
+
+    def drops(self, section):
+        """Return True if a prompt section is left out right now."""
+        return self.active and section in self.config["drop_prompt_sections"]
+
+# The process-wide controller; the app applies the "brownout" settings to it
+controller = BrownoutController()
@@ -0,0 +1,307 @@
+import os
+import select
+import socket
+import sqlite3
+import tempfile
+import threading
+import time
+from contextvars import ContextVar
+
+from utils.logger import get_logger
+from utils.metrics import registry
+
+logger = get_logger(__name__)
+
+CANCELLED = registry.counter(
+    "robert_cancelled_total", "Work abandoned because its request was cancelled, by reason and kind of work",
+    ("reason", "work"))
+
+DEFAULT_CONFIG = {
+    "enabled": True,
+    # SQLite file through which /cancel reaches requests in other worker processes; empty for one in the temp directory
+    "database": "",
+    # Cancel a request when its client closes the connection
+    "detect_disconnects": True,
+    # How often the watcher checks the client connections and the cancellations from other processes
+    "poll_seconds": 0.2,
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cancellations (
+    request_id TEXT NOT NULL,
+    client TEXT NOT NULL,
+    created REAL NOT NULL
+)
+"""
+
+# The cancel token of the current request, if it can be cancelled
+_token = ContextVar("cancel_token", default=None)
+
+class Cancelled(Exception):
+    """Raised when work stops because its request was cancelled."""
+
+    def __init__(self, reason):
+        super().__init__(f"Request cancelled ({reason})")
+        self.reason = reason
+
+class CancelToken:
+    """
+    The cancellation state of one request.
+
+    Work in progress registers what cancelling it takes: a provider call its connections, a call
+    queued for an admission slot a callback that wakes it.
+    """
+
+    def __init__(self, request_id, client, sock=None):
+        self.request_id = request_id
+        self.client = client
+        self.sock = sock
+        self.cancelled = False
+        self.reason = None
+        self._callbacks = []
+        self._connections = set()
+        self._lock = threading.Lock()
+
+    def cancel(self, reason):
+        """
+        Cancel the request: abort its provider calls and wake its queued ones.
+
+        Args:
+            reason (str): "disconnect" or "explicit".
+
+        Returns:
+            bool: True if the request was not cancelled before.
+        """
+        with self._lock:
+            if self.cancelled:
+                return False
+            self.cancelled = True
+            self.reason = reason
+            callbacks = list(self._callbacks)
+            connections = list(self._connections)
+
+        CANCELLED.inc(reason=reason, work="request")
+        logger.info("Request %s cancelled (%s)", self.request_id, reason)
+        for callback in callbacks:
+            callback()
+        for connection in connections:
+            _abort_connection(connection)
+        return True
+
+    def add_callback(self, callback):
+        """Call callback on cancellation, or right away if the request is already cancelled."""
+        with self._lock:
+            if not self.cancelled:
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def remove_callback(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def track(self, connection):
+        """Abort an HTTP connection on cancellation while a provider call of the request uses it."""
+        with self._lock:
+            if not self.cancelled:
+                self._connections.add(connection)
+                return
+        _abort_connection(connection)
+
+    def untrack(self, connection):
+        with self._lock:
+            self._connections.discard(connection)
+
+def _abort_connection(connection):
+    # Shutting the socket down makes the blocked read in the request thread fail right away
+    sock = getattr(connection, "sock", None)
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+def current():
+    """Return the cancel token of the current request, or None."""
+    return _token.get()
+
+def skip(work):
+    """
+    Check whether work for the current request should be skipped because it was cancelled.
+
+    Args:
+        work (str): The kind of work, for the metrics (e.g. "provider_call", "tool").
+
+    Returns:
+        bool: True if the request was cancelled; the skipped work is counted.
+    """
+    token = _token.get()
+    if token is None or not token.cancelled:
+        return False
+    CANCELLED.inc(reason=token.reason, work=work)
+    return True
+
+class CancellationManager:
+    """
+    Tracks the cancellable requests of a process and cancels them when their client disconnects
+    or asks to.
+
+    A watcher thread checks the client sockets for a closed connection, and picks up cancellations
+    that /cancel recorded in a SQLite database, so a cancel request handled by another gunicorn
+    worker still reaches the request.
+    """
+
+    def __init__(self, config=None):
+        self._tokens = {}
+        self._lock = threading.Lock()
+        self._watcher = None
+        self._wake = threading.Event()
+        self.configure(config)
+
+    def configure(self, config=None):
+        """
+        Apply the "cancellation" settings.
+
+        Args:
+            config (dict, optional): The settings. Defaults to None (DEFAULT_CONFIG).
+        """
+        self.config = {**DEFAULT_CONFIG, **(config or {})}
+        self.enabled = self.config["enabled"]
+        self.path = self.config["database"] or os.path.join(tempfile.gettempdir(), "robert-cancellations.sqlite3")
+        self._local = threading.local()
+        self._last_seen = time.time()
+        self._last_cleanup = 0
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False, timeout=1.0)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=OFF")
+            connection.execute(SCHEMA)
+            self._local.connection = connection
+        return connection
+
+    def begin(self, request_id, client, sock=None):
+        """
+        Make the current request cancellable.
+
+        Args:
+            request_id (str): The request id (X-Request-ID).
+            client (str): The client key; only the same client can cancel the request.
+            sock (socket.socket, optional): The client connection, watched for a disconnect. Defaults to None.
+
+        Returns:
+            CancelToken: The token, or None if cancellation is disabled.
+        """
+        if not self.enabled:
+            return None
+
+        token = CancelToken(request_id, client, sock if self.config["detect_disconnects"] else None)
+        _token.set(token)
+        with self._lock:
+            self._tokens[request_id] = token
+            if self._watcher is None:
+                self._watcher = threading.Thread(target=self._watch, name="cancellation-watcher", daemon=True)
+                self._watcher.start()
+        self._wake.set()
+        return token
+
+    def resume(self, token):
+        """Make a token the current request's again, e.g. in a streamed response that outlives its view."""
+        if token is not None:
+            _token.set(token)
+
+    def end(self, token):
+        """Stop tracking a request once it is done."""
+        _token.set(None)
+        with self._lock:
+            if self._tokens.get(token.request_id) is token:
+                del self._tokens[token.request_id]
+
+    def cancel(self, request_id, client):
+        """
+        Cancel a request of a client, in this process or another one.
+
+        Args:
+            request_id (str): The request id.
+            client (str): The client key of the caller.
+
+        Returns:
+            bool: True if the request was running in this process; otherwise the cancellation is
+                  left for the other processes.
+        """
+        with self._lock:
+            token = self._tokens.get(request_id)
+        if token is not None and token.client == client:
+            token.cancel("explicit")
+            return True
+
+        try:
+            self._connection().execute("INSERT INTO cancellations (request_id, client, created) VALUES (?, ?, ?)",
+                                       (request_id, client, time.time()))
+        except sqlite3.Error as e:
+            logger.error("Cancellation store error: %s", e)
+        return False
+
+    def _watch(self):
+        while True:
+            with self._lock:
+                tokens = list(self._tokens.values())
+            if not tokens:
+                # Nothing to watch until the next request
+                self._wake.wait()
+                self._wake.clear()
+                continue
+
+            try:
+                self._check_sockets(tokens)
+                self._check_store(tokens)
+            except Exception:
+                logger.exception("Cancellation watcher error")
+            time.sleep(self.config["poll_seconds"])
+
+    def _check_sockets(self, tokens):
+        watched = {token.sock: token for token in tokens if token.sock is not None and not token.cancelled}
+        if not watched:
+            return
+        try:
+            readable, _, _ = select.select(list(watched), [], [], 0)
+        except (OSError, ValueError):
+            # A socket closed in the meantime; the next round skips it
+            return
+
+        for sock in readable:
+            try:
+                # A readable socket with nothing to read has been closed by the client
+                closed = sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b""
+            except BlockingIOError:
+                closed = False
+            except ConnectionError:
+                closed = True
+            except (OSError, ValueError):
+                # e.g. TLS sockets, which cannot peek; stop watching it
+                watched[sock].sock = None
+                continue
+            if closed:
+                watched[sock].cancel("disconnect")
+
+    def _check_store(self, tokens):
+        now = time.time()
+        connection = self._connection()
+        rows = connection.execute("SELECT request_id, client FROM cancellations WHERE created >= ?",
+                                  (self._last_seen - 1,)).fetchall()
+        self._last_seen = now
+        by_id = {token.request_id: token for token in tokens}
+        for request_id, client in rows:
+            token = by_id.get(request_id)
+            if token is not None and token.client == client:
+                token.cancel("explicit")
+
+        if now - self._last_cleanup > 60:
+            self._last_cleanup = now
+            connection.execute("DELETE FROM cancellations WHERE created < ?", (now - 60,))
+
+# The process-wide cancellation manager; the app applies the "cancellation" settings to it
+manager = CancellationManager()
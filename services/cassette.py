@@ -0,0 +1,228 @@
+import base64
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+import requests
+
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Base64 runs this long are audio payloads (inline_data, OpenRouter data URLs), never prompt text
+BASE64_PATTERN = re.compile(r"[A-Za-z0-9+/]{512,}={0,2}")
+
+# Query parameters that carry credentials
+SECRET_PARAMS = {"key", "api_key", "apikey", "token"}
+
+class CassetteMiss(requests.ConnectionError):
+    """Raised in replay mode when no recording matches a request."""
+
+class Cassette:
+    """
+    Records provider request/response pairs to disk, or replays them instead of calling the provider.
+
+    Requests are matched on provider, model, operation and body. Secrets never reach the disk:
+    credentials in the URL are redacted and headers are not stored. Audio (file uploads and base64
+    payloads) is replaced in the stored request by its SHA-256 hash and saved once under audio/.
+    """
+
+    def __init__(self, mode="off", directory="cassettes", timing="recorded"):
+        """
+        Initialize the cassette.
+
+        Args:
+            mode (str, optional): "off", "record" or "replay". Defaults to "off".
+            directory (str, optional): Where recordings are stored. Defaults to "cassettes".
+            timing (str, optional): In replay mode, "recorded" to wait as long as the provider took,
+                                    or "zero" to answer immediately. Defaults to "recorded".
+        """
+        self.mode = mode
+        self.directory = directory
+        self.timing = timing
+
+        self._lock = threading.Lock()
+        self._cursors = {}
+
+    @classmethod
+    def from_env(cls):
+        """Create a cassette from PROVIDER_CASSETTE_MODE, PROVIDER_CASSETTE_DIR and PROVIDER_CASSETTE_TIMING."""
+        return cls(
+            mode=os.getenv("PROVIDER_CASSETTE_MODE", "off").lower(),
+            directory=os.getenv("PROVIDER_CASSETTE_DIR", "cassettes"),
+            timing=os.getenv("PROVIDER_CASSETTE_TIMING", "recorded").lower()
+        )
+
+    @property
+    def enabled(self):
+        return self.mode in ("record", "replay")
+
+    def prepare(self, provider, model_id, operation, url, kwargs):
+        """
+        Build the redacted request record and its matching key.
+
+        File uploads are read into memory so they can be hashed, and kwargs is updated to send the
+        bytes instead of the consumed stream.
+
+        Args:
+            provider (str): The provider name.
+            model_id (str): The model the request is for.
+            operation (str): What the request does.
+            url (str): The request URL.
+            kwargs (dict): The keyword arguments for requests.post (modified in place).
+
+        Returns:
+            tuple: (key, request record)
+        """
+        record = {"provider": provider, "model": model_id, "operation": operation}
+
+        if kwargs.get("json") is not None:
+            record["json"] = self._strip_audio(kwargs["json"])
+        if kwargs.get("data"):
+            record["data"] = self._strip_audio(_parse_body(kwargs["data"]))
+        if kwargs.get("files"):
+            files = {}
+            for field, (filename, stream, mimetype) in kwargs["files"].items():
+                content = stream if isinstance(stream, bytes) else stream.read()
+                kwargs["files"][field] = (filename, content, mimetype)
+                files[field] = {"audio": self._save_audio(content), "mimetype": mimetype}
+            record["files"] = files
+
+        # The URL is not part of the key, so recordings replay against any base URL
+        key = hashlib.sha256(json.dumps(record, sort_keys=True).encode()).hexdigest()[:32]
+        record["url"] = _redact_url(url)
+        return key, record
+
+    def record(self, key, request_record, response, elapsed):
+        """
+        Append a response to the recording of a request.
+
+        Args:
+            key (str): The request key from prepare().
+            request_record (dict): The request record from prepare().
+            response (requests.Response): The provider response.
+            elapsed (float): The seconds the provider took.
+        """
+        path = self._path(request_record["provider"], request_record["operation"], key)
+        interaction = {
+            "status_code": response.status_code,
+            "content_type": response.headers.get("Content-Type", "application/json"),
+            "body": response.text,
+            "elapsed": round(elapsed, 4),
+            "recorded_at": time.time()
+        }
+
+        with self._lock:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    cassette = json.load(f)
+            except (OSError, ValueError):
+                cassette = {"request": request_record, "interactions": []}
+
+            cassette["interactions"].append(interaction)
+
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(cassette, f, indent=2, ensure_ascii=False)
+            os.replace(tmp_path, path)
+
+        logger.debug("Recorded %s %s response to %s", request_record["provider"], request_record["operation"], path)
+
+    def replay(self, key, request_record):
+        """
+        Serve the recorded response for a request. Repeated requests cycle through the recordings.
+
+        Args:
+            key (str): The request key from prepare().
+            request_record (dict): The request record from prepare().
+
+        Returns:
+            requests.Response: The recorded response.
+
+        Raises:
+            CassetteMiss: If the request was never recorded.
+        """
+        path = self._path(request_record["provider"], request_record["operation"], key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                interactions = json.load(f)["interactions"]
+        except (OSError, ValueError, KeyError):
+            raise CassetteMiss(f"No recording for {request_record['provider']} {request_record['operation']} request {key}")
+
+        with self._lock:
+            index = self._cursors.get(key, 0)
+            self._cursors[key] = index + 1
+        interaction = interactions[index % len(interactions)]
+
+        if self.timing == "recorded":
+            time.sleep(interaction["elapsed"])
+
+        response = requests.Response()
+        response.status_code = interaction["status_code"]
+        response.headers["Content-Type"] = interaction["content_type"]
+        response._content = interaction["body"].encode("utf-8")
+        # The body is all there, so iter_lines()/iter_content() replay it instead of reading a socket
+        response._content_consumed = True
+        response.raw = None
+        response.encoding = "utf-8"
+        response.url = request_record["url"]
+        return response
+
+    def _path(self, provider, operation, key):
+        return os.path.join(self.directory, provider.lower(), f"{operation}-{key}.json")
+
+    def _save_audio(self, content):
+        digest = hashlib.sha256(content).hexdigest()
+        if self.mode == "record":
+            path = os.path.join(self.directory, "audio", digest)
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, "wb") as f:
+                    f.write(content)
+        return f"sha256:{digest}"
+
+    def _strip_audio(self, value):
+        """Replace base64 audio in a JSON body with the hash of the decoded audio."""
+        if isinstance(value, dict):
+            return {k: self._strip_audio(v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [self._strip_audio(v) for v in value]
+        if isinstance(value, str) and len(value) >= 512:
+            return BASE64_PATTERN.sub(lambda m: f"<audio {self._save_audio(_decode(m.group(0)))}>", value)
+        return value
+
+def _parse_body(data):
+    """Turn a data= body into something _strip_audio() can walk: JSON is parsed, other bytes decoded."""
+    if isinstance(data, bytes):
+        data = data.decode("utf-8", errors="replace")
+    if isinstance(data, str):
+        try:
+            return json.loads(data)
+        except ValueError:
+            return data
+    return data
+
+def _decode(text):
+    try:
+        return base64.b64decode(text)
+    except ValueError:
+        return text.encode()
+
+def _redact_url(url):
+    parts = urlsplit(url)
+    query = [(name, "REDACTED" if name.lower() in SECRET_PARAMS else value) for name, value in parse_qsl(parts.query)]
+    return urlunsplit((parts.scheme, parts.netloc, parts.path, urlencode(query), parts.fragment))
+
+_cassette = None
+
+def get_cassette():
+    """Return the process-wide cassette, configured from the environment on first use."""
+    global _cassette
+    if _cassette is None:
+        _cassette = Cassette.from_env()
+    return _cassette
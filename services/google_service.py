@@ -1,26 +1,37 @@
 import os
-import requests
 import json
 
+from services import http_client
+from services.tool_calls import to_gemini_tools, parse_gemini_tool_calls
+from utils.response_parser import parse_response
+from utils.audio_utils import read_audio
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
 class GoogleService:
-    def __init__(self, api_key=None):
+    def __init__(self, api_key=None, base_url=None):
         """
         Initialize the Google service.
         
         Args:
             api_key (str, optional): The Google API key. If not provided, it will be loaded from the environment.
+            base_url (str, optional): The API base URL. If not provided, GOOGLE_BASE_URL or the public API is used.
         """
         self.api_key = api_key or os.getenv("GOOGLE_API_KEY")
         if not self.api_key:
             raise ValueError("Google API key not configured")
+        self.base_url = (base_url or os.getenv("GOOGLE_BASE_URL") or "https://generativelanguage.googleapis.com/v1beta").rstrip("/")
     
-    def generate_content(self, prompt, model_id="gemini-2.5-pro-exp-03-25"):
+    def generate_content(self, prompt, model_id="gemini-2.5-pro-exp-03-25", tools=None):
         """
         Generate content using Google's Gemini API.
         
         Args:
             prompt (str): The prompt to send to the API.
             model_id (str, optional): The model ID to use. Defaults to "gemini-2.5-pro-exp-03-25".
+            tools (list, optional): Tool declarations ({"name", "description", "parameters"}) for
+                                    native function calling. Defaults to None.
             
         Returns:
             dict: The generation result.
@@ -39,11 +50,16 @@ class GoogleService:
                 ]
             }
             
+            # Add tools for native function calling
+            if tools:
+                payload["tools"] = to_gemini_tools(tools)
+            
             # Prepare the URL for the request
-            url = f"https://generativelanguage.googleapis.com/v1beta/models/{model_id}:generateContent?key={self.api_key}"
+            url = f"{self.base_url}/models/{model_id}:generateContent?key={self.api_key}"
             
             # Send the request to Google
-            response = requests.post(
+            response = http_client.post(
+                "Google", model_id, "generate",
                 url,
                 json=payload,
                 headers={"Content-Type": "application/json"},
@@ -53,15 +69,17 @@ class GoogleService:
             # Check if the request was successful
             if response.status_code == 200:
                 result = response.json()
+                http_client.record_usage("Google", model_id, result)
                 
                 # Extract the content from Google's response format
                 if "candidates" in result and len(result["candidates"]) > 0:
                     candidate = result["candidates"][0]
                     if "content" in candidate and "parts" in candidate["content"]:
                         parts = candidate["content"]["parts"]
-                        if len(parts) > 0 and "text" in parts[0]:
-                            content = parts[0]["text"]
-                            return {"content": content, "status": "success"}
+                        tool_calls = parse_gemini_tool_calls(parts)
+                        if len(parts) > 0 and ("text" in parts[0] or tool_calls):
+                            content = "".join(part.get("text", "") for part in parts)
+                            return {"content": content, "tool_calls": tool_calls, "status": "success"}
                 
                 return {"error": "Could not extract content from Google API response", "status": "error"}
             else:
@@ -85,11 +103,8 @@ class GoogleService:
         try:
             import base64
             
-            # Reset the file pointer to the beginning of the file
-            audio_file.stream.seek(0)
-            
-            # Read the audio data
-            audio_data = audio_file.stream.read()
+            # Read the audio data (memory-mapped uploads are not copied)
+            audio_data = read_audio(audio_file)
             
             # Check if the audio file is too large (20MB limit for Gemini API)
             if len(audio_data) > 20000000:  # 20MB in bytes
@@ -123,11 +138,12 @@ class GoogleService:
             }
             
             # Prepare the URL for the request
-            url = f"https://generativelanguage.googleapis.com/v1beta/models/{model_id}:generateContent?key={self.api_key}"
+            url = f"{self.base_url}/models/{model_id}:generateContent?key={self.api_key}"
             
             # Send the request to Google
-            print(f"Sending audio directly to Google Gemini API using inline_data format")
-            response = requests.post(
+            logger.debug("Sending audio directly to Google Gemini API using inline_data format")
+            response = http_client.post(
+                "Google", model_id, "direct_audio",
                 url,
                 json=payload,
                 headers={"Content-Type": "application/json"},
@@ -137,6 +153,7 @@ class GoogleService:
             # Check if the request was successful
             if response.status_code == 200:
                 result = response.json()
+                http_client.record_usage("Google", model_id, result)
                 
                 # Extract the content from Google's response format
                 if "candidates" in result and len(result["candidates"]) > 0:
@@ -146,97 +163,17 @@ class GoogleService:
                         if len(parts) > 0 and "text" in parts[0]:
                             # Process the result
                             content = parts[0]["text"]
-                            print(f"Received response from Google API: {content[:100]}...")
+                            logger.debug("Received response from Google API: %.100s...", content)
                             
-                            # Try to parse the JSON response
-                            try:
-                                # First, check if the response is a string that contains JSON
-                                if content.strip().startswith('"json {') and content.strip().endswith('}"'):
-                                    # Extract the JSON part from the string
-                                    print("Detected special JSON format with 'json {' prefix")
-                                    json_str = content.strip().strip('"').replace('json {', '{').replace('} "', '}')
-                                    try:
-                                        json_response = json.loads(json_str)
-                                        transcription = json_response.get("transcription", "")
-                                        ai_response = json_response.get("response", "")
-                                        print(f"Successfully parsed special JSON format: {transcription[:50]}... / {ai_response[:50]}...")
-                                    except json.JSONDecodeError as e:
-                                        print(f"Failed to parse special JSON format: {e}")
-                                        # If we can't parse the special format, try to extract using regex
-                                        import re
-                                        transcription_match = re.search(r'"transcription":\s*"([^"]+)"', content)
-                                        response_match = re.search(r'"response":\s*"([^"]+)"', content)
-                                        
-                                        if transcription_match and response_match:
-                                            transcription = transcription_match.group(1)
-                                            ai_response = response_match.group(1)
-                                            print(f"Extracted using regex: {transcription[:50]}... / {ai_response[:50]}...")
-                                        else:
-                                            transcription = content
-                                            ai_response = content
-                                else:
-                                    # Try standard JSON parsing
-                                    json_response = json.loads(content)
-                                    transcription = json_response.get("transcription", "")
-                                    ai_response = json_response.get("response", "")
-                                
-                                if not transcription and not ai_response:
-                                    # If neither field is present, try to extract from text
-                                    if "transcription:" in content.lower() or "transcript:" in content.lower():
-                                        if "transcription:" in content.lower():
-                                            parts = content.lower().split("transcription:", 1)
-                                        elif "transcript:" in content.lower():
-                                            parts = content.lower().split("transcript:", 1)
-                                        
-                                        if len(parts) > 1:
-                                            transcription_part = parts[1].strip()
-                                            
-                                            if "response:" in transcription_part:
-                                                resp_parts = transcription_part.split("response:", 1)
-                                                transcription = resp_parts[0].strip()
-                                                ai_response = resp_parts[1].strip()
-                                            else:
-                                                transcription = transcription_part
-                                                ai_response = transcription_part
-                                    else:
-                                        transcription = content
-                                        ai_response = content
-                                
-                                return {
-                                    "text": transcription,
-                                    "ai_response": ai_response,
-                                    "status": "success"
-                                }
-                            except json.JSONDecodeError:
-                                # If not valid JSON, try to extract using regex
-                                import re
-                                transcription_match = re.search(r'"transcription":\s*"([^"]+)"', content)
-                                response_match = re.search(r'"response":\s*"([^"]+)"', content)
-                                
-                                if transcription_match and response_match:
-                                    transcription = transcription_match.group(1)
-                                    ai_response = response_match.group(1)
-                                    print(f"Extracted using regex: {transcription[:50]}... / {ai_response[:50]}...")
-                                # If regex fails, try to extract from text using the original method
-                                elif "transcription:" in content.lower() or "transcript:" in content.lower():
-                                    if "transcription:" in content.lower():
-                                        parts = content.lower().split("transcription:", 1)
-                                    elif "transcript:" in content.lower():
-                                        parts = content.lower().split("transcript:", 1)
-                                    
-                                    if len(parts) > 1:
-                                        transcription_part = parts[1].strip()
-                                        
-                                        if "response:" in transcription_part:
-                                            resp_parts = transcription_part.split("response:", 1)
-                                            transcription = resp_parts[0].strip()
-                                            ai_response = resp_parts[1].strip()
-                                
-                                return {
-                                    "text": transcription,
-                                    "ai_response": ai_response,
-                                    "status": "success"
-                                }
+                            # Parse the response once into transcription, response and tool calls
+                            envelope = parse_response(content)
+                            
+                            return {
+                                "text": envelope.transcription or envelope.response,
+                                "ai_response": envelope.response,
+                                "tool_calls": envelope.tool_calls,
+                                "status": "success"
+                            }
                         else:
                             return {"error": "Could not extract text from Google API response", "status": "error"}
                     else:
@@ -262,53 +199,17 @@ class GoogleService:
             dict: The transcription result.
         """
         try:
-            # Use absolute imports instead of relative imports
-            import base64
-            
-            # Reset the file pointer to the beginning of the file
-            audio_file.stream.seek(0)
-            
-            # Read the audio data
-            audio_data = audio_file.stream.read()
-            
-            # Check if the audio file is too large (20MB limit for Gemini API)
-            if len(audio_data) > 20000000:  # 20MB in bytes
+            payload = self._transcription_payload(audio_file, system_prompt, language)
+            if payload is None:
                 return {"error": "Audio file too large (max 20MB)", "status": "error"}
             
-            # Create a prompt asking for transcription only
-            if system_prompt:
-                prompt = f"{system_prompt}\n\nPlease transcribe this audio. Only provide the transcription, no additional text."
-            else:
-                prompt = "Please transcribe this audio. Only provide the transcription, no additional text."
-                
-            if language:
-                prompt += f" The audio is in {language}."
-            
-            # Create the payload for Google's Gemini API using the correct format for audio
-            payload = {
-                "contents": [
-                    {
-                        "parts": [
-                            {
-                                "text": prompt
-                            },
-                            {
-                                "inline_data": {
-                                    "mime_type": audio_file.mimetype,
-                                    "data": base64.b64encode(audio_data).decode('utf-8')
-                                }
-                            }
-                        ]
-                    }
-                ]
-            }
-            
             # Prepare the URL for the request
-            url = f"https://generativelanguage.googleapis.com/v1beta/models/{model_id}:generateContent?key={self.api_key}"
+            url = f"{self.base_url}/models/{model_id}:generateContent?key={self.api_key}"
             
             # Send the request to Google
-            print(f"Sending audio to Google Gemini API for transcription using inline_data format")
-            response = requests.post(
+            logger.debug("Sending audio to Google Gemini API for transcription using inline_data format")
+            response = http_client.post(
+                "Google", model_id, "transcription",
                 url,
                 json=payload,
                 headers={"Content-Type": "application/json"},
@@ -318,6 +219,7 @@ class GoogleService:
             # Check if the request was successful
             if response.status_code == 200:
                 result = response.json()
+                http_client.record_usage("Google", model_id, result)
                 
                 # Extract the content from Google's response format
                 if "candidates" in result and len(result["candidates"]) > 0:
@@ -326,27 +228,11 @@ class GoogleService:
                         parts = candidate["content"]["parts"]
                         if len(parts) > 0 and "text" in parts[0]:
                             content = parts[0]["text"]
-                            print(f"Received transcription: {content[:100]}...")
-                            
-                            # Clean up the response to get just the transcription
-                            transcription_text = content
+                            logger.debug("Received transcription: %.100s...", content)
                             
-                            # Try to extract just the transcription if there's additional text
-                            if "transcription:" in content.lower() or "transcript:" in content.lower():
-                                try:
-                                    if "transcription:" in content.lower():
-                                        parts = content.lower().split("transcription:", 1)
-                                    elif "transcript:" in content.lower():
-                                        parts = content.lower().split("transcript:", 1)
-                                    
-                                    if len(parts) > 1:
-                                        transcription_text = parts[1].strip()
-                                        
-                                        # Remove any additional text after the transcription
-                                        if "response:" in transcription_text:
-                                            transcription_text = transcription_text.split("response:", 1)[0].strip()
-                                except:
-                                    pass
+                            # Get just the transcription if the model added labels or other fields
+                            envelope = parse_response(content)
+                            transcription_text = envelope.transcription or content.strip()
                             
                             return {"text": transcription_text, "status": "success"}
                         else:
@@ -358,4 +244,111 @@ class GoogleService:
             else:
                 return {"error": response.text, "status": "error", "status_code": response.status_code}
         except Exception as e:
-            return {"error": str(e), "status": "error"}
\ No newline at end of file
+            return {"error": str(e), "status": "error"}
+    
+    def stream_transcription(self, audio_file, system_prompt=None, language=None, model_id="gemini-2.5-pro-exp-03-25"):
+        """
+        Transcribe audio using Google's Gemini API, streaming the transcript as it is produced
+        (streamGenerateContent).
+        
+        Args:
+            audio_file: The audio file object from Flask's request.files.
+            system_prompt (str, optional): The system prompt to use. Defaults to None.
+            language (str, optional): The language of the audio. Defaults to None.
+            model_id (str, optional): The model ID to use. Defaults to "gemini-2.5-pro-exp-03-25".
+            
+        Yields:
+            dict: {"type": "delta", "text": ...} for each part of the transcript, then the result:
+                  {"type": "done", "text": ..., "status": "success"} or {"type": "error", "error": ..., "status": "error"}.
+        """
+        try:
+            payload = self._transcription_payload(audio_file, system_prompt, language)
+            if payload is None:
+                yield {"type": "error", "error": "Audio file too large (max 20MB)", "status": "error"}
+                return
+            
+            url = f"{self.base_url}/models/{model_id}:streamGenerateContent?alt=sse&key={self.api_key}"
+            with http_client.stream(
+                "Google", model_id, "transcription",
+                url,
+                json=payload,
+                headers={"Content-Type": "application/json"},
+                timeout=60
+            ) as response:
+                if response.status_code != 200:
+                    yield {"type": "error", "error": response.text, "status": "error", "status_code": response.status_code}
+                    return
+                
+                deltas = []
+                usage = None
+                for chunk in http_client.iter_events(response):
+                    usage = chunk.get("usageMetadata", usage)
+                    for candidate in chunk.get("candidates", [])[:1]:
+                        text = "".join(part.get("text", "") for part in candidate.get("content", {}).get("parts", []))
+                        if text:
+                            deltas.append(text)
+                            yield {"type": "delta", "text": text}
+            
+            # Each chunk carries the usage so far; the last one has the totals
+            if usage:
+                http_client.record_usage("Google", model_id, {"usageMetadata": usage})
+            
+            content = "".join(deltas)
+            if not content:
+                yield {"type": "error", "error": "Could not extract text from Google API response", "status": "error"}
+                return
+            
+            # Get just the transcription if the model added labels or other fields
+            envelope = parse_response(content)
+            yield {"type": "done", "text": envelope.transcription or content.strip(), "status": "success"}
+        except Exception as e:
+            yield {"type": "error", "error": str(e), "status": "error"}
+    
+    def _transcription_payload(self, audio_file, system_prompt=None, language=None):
+        """
+        Build the request asking Gemini for a transcription of the audio.
+        
+        Args:
+            audio_file: The audio file object from Flask's request.files.
+            system_prompt (str, optional): The system prompt to use. Defaults to None.
+            language (str, optional): The language of the audio. Defaults to None.
+            
+        Returns:
+            dict: The payload, or None if the audio is too large for the Gemini API.
+        """
+        import base64
+        
+        # Read the audio data (memory-mapped uploads are not copied)
+        audio_data = read_audio(audio_file)
+        
+        # Check if the audio file is too large (20MB limit for Gemini API)
+        if len(audio_data) > 20000000:  # 20MB in bytes
+            return None
+        
+        # Create a prompt asking for transcription only
+        if system_prompt:
+            prompt = f"{system_prompt}\n\nPlease transcribe this audio. Only provide the transcription, no additional text."
+        else:
+            prompt = "Please transcribe this audio. Only provide the transcription, no additional text."
+            
+        if language:
+            prompt += f" The audio is in {language}."
+        
+        # Create the payload for Google's Gemini API using the correct format for audio
+        return {
+            "contents": [
+                {
+                    "parts": [
+                        {
+                            "text": prompt
+                        },
+                        {
+                            "inline_data": {
+                                "mime_type": audio_file.mimetype,
+                                "data": base64.b64encode(audio_data).decode('utf-8')
+                            }
+                        }
+                    ]
+                }
+            ]
+        }
\ No newline at end of file
@@ -0,0 +1,316 @@
+import hashlib
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from flask import g, has_app_context
+
+from utils.metrics import UPSTREAM_LATENCY, TOKENS
+from utils.single_flight import SingleFlight
+from services.cassette import get_cassette
+from services.admission import controller as admission, Overloaded
+from services.brownout import controller as brownout
+from services import cancellation
+
+# Identical concurrent response-stage calls share one upstream call
+coalescer = SingleFlight("response")
+
+# Operations whose identical concurrent calls are coalesced
+COALESCED_OPERATIONS = ("chat", "generate")
+
+# Larger bodies carry audio; they are never identical and would be slow to hash
+MAX_COALESCED_BODY = 256 * 1024
+
+# Keep-alive connections kept per provider host; above the admission limits, so concurrent calls
+# (e.g. the fan-out of /chat/batch) reuse connections instead of discarding the surplus
+POOL_MAXSIZE = 32
+
+# One pooled session per provider, so keep-alive connections are reused across requests
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+class _CancellableMixin:
+    """Registers the connection a provider call uses with its request's cancel token, so cancelling aborts the call."""
+
+    def _get_conn(self, timeout=None):
+        connection = super()._get_conn(timeout)
+        token = cancellation.current()
+        if token is not None:
+            token.track(connection)
+        return connection
+
+    def _put_conn(self, connection):
+        # Back in the pool, the connection may serve another request next
+        token = cancellation.current()
+        if token is not None and connection is not None:
+            token.untrack(connection)
+        super()._put_conn(connection)
+
+class _CancellableHTTPConnectionPool(_CancellableMixin, HTTPConnectionPool):
+    pass
+
+class _CancellableHTTPSConnectionPool(_CancellableMixin, HTTPSConnectionPool):
+    pass
+
+class _CancellableAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _CancellableHTTPConnectionPool,
+            "https": _CancellableHTTPSConnectionPool,
+        }
+
+def get_session(provider):
+    """
+    Get the shared HTTP session for a provider.
+
+    Args:
+        provider (str): The provider name.
+
+    Returns:
+        requests.Session: The session.
+    """
+    session = _sessions.get(provider)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(provider)
+            if session is None:
+                session = requests.Session()
+                adapter = _CancellableAdapter(pool_maxsize=POOL_MAXSIZE)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _sessions[provider] = session
+    return session
+
+def post(provider, model_id, operation, url, **kwargs):
+    """
+    Send a POST request to a provider API and record its latency.
+
+    With PROVIDER_CASSETTE_MODE=record the request and response are also saved to disk, and with
+    PROVIDER_CASSETTE_MODE=replay the saved response is returned without calling the provider.
+
+    Identical concurrent chat and generate calls are coalesced: only the first goes upstream and the
+    others share its response.
+
+    The call first has to pass admission control. When it is shed, a 503 response with a
+    Retry-After header is returned instead, and the current request is marked (g.shed) so the app
+    can answer 503 as well.
+
+    When the current request is cancelled, the call is skipped, stops waiting for its admission
+    slot or has its connection aborted, and a 499 response is returned. Requests that shared the
+    aborted call of a cancelled request then make the call themselves.
+
+    Args:
+        provider (str): The provider name (OpenAI, OpenRouter, Google).
+        model_id (str): The model the request is for.
+        operation (str): What the request does (e.g. "chat", "transcription", "generate").
+        url (str): The URL to post to.
+        **kwargs: Passed through to requests.
+
+    Returns:
+        requests.Response: The response.
+    """
+    key = _coalesce_key(provider, model_id, operation, kwargs)
+    if key is None:
+        return _post(provider, model_id, operation, url, **kwargs)
+
+    response, shared = coalescer.do(key, lambda: _post(provider, model_id, operation, url, **kwargs))
+    if shared and response.status_code == 499:
+        # The request that made the call was cancelled; this one was not
+        return _post(provider, model_id, operation, url, **kwargs)
+    if shared and has_app_context():
+        g.coalesced = True
+    return response
+
+def _coalesce_key(provider, model_id, operation, kwargs):
+    """Key identical text-only calls on their body; None if the call must not be coalesced."""
+    if not coalescer.enabled or operation not in COALESCED_OPERATIONS:
+        return None
+
+    payload = kwargs.get("json")
+    if payload is not None:
+        # Audio parts make the body large; such calls are never identical
+        for message in payload.get("messages", []):
+            if not isinstance(message.get("content"), str):
+                return None
+        body = json.dumps(payload, sort_keys=True, separators=(",", ":"))
+    elif isinstance(kwargs.get("data"), str):
+        body = kwargs["data"]
+    else:
+        return None
+
+    if len(body) > MAX_COALESCED_BODY:
+        return None
+    return hashlib.sha256(f"{provider}\0{model_id}\0{operation}\0{body}".encode()).hexdigest()
+
+def _post(provider, model_id, operation, url, **kwargs):
+    if cancellation.skip("provider_call"):
+        return _cancelled_response(url)
+
+    cassette = get_cassette()
+    if cassette.enabled:
+        key, request_record = cassette.prepare(provider, model_id, operation, url, kwargs)
+
+    try:
+        slots = admission.acquire(provider, model_id)
+    except Overloaded as e:
+        if has_app_context():
+            g.shed = e
+        return _overloaded_response(e, url)
+    except cancellation.Cancelled:
+        cancellation.skip("provider_call")
+        return _cancelled_response(url)
+
+    start = time.perf_counter()
+    status = "error"
+    try:
+        if cassette.mode == "replay":
+            response = cassette.replay(key, request_record)
+        else:
+            response = get_session(provider).post(url, **kwargs)
+            if cassette.mode == "record":
+                cassette.record(key, request_record, response, time.perf_counter() - start)
+        status = str(response.status_code)
+        return response
+    except requests.RequestException:
+        # The aborted connection of a cancelled request surfaces as a connection error
+        if cancellation.skip("provider_call"):
+            status = "cancelled"
+            return _cancelled_response(url)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        admission.release(slots, elapsed)
+        brownout.observe(elapsed)
+        UPSTREAM_LATENCY.observe(elapsed, provider=provider, model=model_id, operation=operation, status=status)
+
+@contextmanager
+def stream(provider, model_id, operation, url, **kwargs):
+    """
+    Send a POST request whose response is read as it arrives, e.g. server-sent events.
+
+    Like post(), but the call keeps its admission slot, and its latency is measured, until the
+    caller is done reading the body. Streamed calls are never coalesced: they carry audio. With a cassette, the whole
+    recorded body is replayed at once.
+
+    Args:
+        provider (str): The provider name (OpenAI, OpenRouter, Google).
+        model_id (str): The model the request is for.
+        operation (str): What the request does (e.g. "transcription").
+        url (str): The URL to post to.
+        **kwargs: Passed through to requests.
+
+    Yields:
+        requests.Response: The response, with its body not read yet (or the 503 or 499 stand-in).
+    """
+    if get_cassette().enabled:
+        yield _post(provider, model_id, operation, url, **kwargs)
+        return
+
+    if cancellation.skip("provider_call"):
+        yield _cancelled_response(url)
+        return
+
+    try:
+        slots = admission.acquire(provider, model_id)
+    except Overloaded as e:
+        if has_app_context():
+            g.shed = e
+        yield _overloaded_response(e, url)
+        return
+    except cancellation.Cancelled:
+        cancellation.skip("provider_call")
+        yield _cancelled_response(url)
+        return
+
+    start = time.perf_counter()
+    status = "error"
+    try:
+        with get_session(provider).post(url, stream=True, **kwargs) as response:
+            status = str(response.status_code)
+            yield response
+    except requests.RequestException:
+        # The aborted connection of a cancelled request surfaces as a connection error
+        if cancellation.skip("provider_call"):
+            status = "cancelled"
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        admission.release(slots, elapsed)
+        brownout.observe(elapsed)
+        UPSTREAM_LATENCY.observe(elapsed, provider=provider, model=model_id, operation=operation, status=status)
+
+def iter_events(response):
+    """
+    Parse a server-sent event stream into the JSON payloads of its "data:" lines.
+
+    Args:
+        response (requests.Response): A streamed response.
+
+    Yields:
+        dict: The payload of each event; a "[DONE]" marker ends the stream.
+    """
+    # Event streams are always UTF-8, whatever the Content-Type says
+    response.encoding = "utf-8"
+    # chunk_size=None hands over each chunk as it arrives instead of waiting for a full buffer
+    for line in response.iter_lines(chunk_size=None, decode_unicode=True):
+        if not line or not line.startswith("data:"):
+            continue
+        data = line[len("data:"):].strip()
+        if data == "[DONE]":
+            return
+        yield json.loads(data)
+
+def _overloaded_response(error, url):
+    response = requests.Response()
+    response.status_code = 503
+    response.headers["Content-Type"] = "application/json"
+    response.headers["Retry-After"] = str(error.retry_after)
+    response._content = json.dumps({"error": {"message": str(error), "code": 503}}).encode()
+    response._content_consumed = True
+    response.url = url
+    return response
+
+def _cancelled_response(url):
+    response = requests.Response()
+    response.status_code = 499
+    response.headers["Content-Type"] = "application/json"
+    response._content = json.dumps({"error": {"message": "Request cancelled", "code": 499}}).encode()
+    response._content_consumed = True
+    response.url = url
+    return response
+
+def record_usage(provider, model_id, result):
+    """
+    Record the token usage reported in a provider response.
+
+    Handles both the OpenAI/OpenRouter "usage" field and Gemini's "usageMetadata".
+
+    Args:
+        provider (str): The provider name.
+        model_id (str): The model ID.
+        result (dict): The parsed response body.
+
+    Returns:
+        dict: The usage as {"prompt_tokens": int, "completion_tokens": int}, or None if not reported.
+    """
+    usage = result.get("usage")
+    if usage:
+        prompt_tokens = usage.get("prompt_tokens") or usage.get("input_tokens") or 0
+        completion_tokens = usage.get("completion_tokens") or usage.get("output_tokens") or 0
+    elif result.get("usageMetadata"):
+        usage = result["usageMetadata"]
+        prompt_tokens = usage.get("promptTokenCount", 0)
+        completion_tokens = usage.get("candidatesTokenCount", 0)
+    else:
+        return None
+
+    # A coalesced response was already counted by the call that fetched it
+    if not (has_app_context() and g.get("coalesced")):
+        TOKENS.inc(prompt_tokens, provider=provider, model=model_id, type="prompt")
+        TOKENS.inc(completion_tokens, provider=provider, model=model_id, type="completion")
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens}
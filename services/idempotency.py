@@ -0,0 +1,293 @@
+import hashlib
+import math
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from contextvars import ContextVar
+
+from utils.logger import get_logger
+from utils.metrics import registry
+
+logger = get_logger(__name__)
+
+IDEMPOTENT_REQUESTS = registry.counter(
+    "robert_idempotent_requests_total", "Requests with an Idempotency-Key, by outcome", ("outcome",))
+
+DEFAULT_CONFIG = {
+    "enabled": True,
+    # SQLite file shared by the worker processes; empty for one in the temp directory
+    "database": "",
+    # How long a completed result is replayed to retries
+    "ttl_seconds": 86400,
+    # How long a retry waits for the original request to finish before it is told to come back later;
+    # short, since the wait holds a worker
+    "wait_seconds": 2,
+    # A request or tool run still pending after this long is assumed lost (e.g. its worker died) and can be
+    # taken over
+    "pending_timeout_seconds": 300,
+}
+
+SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS requests (
+        key TEXT PRIMARY KEY,
+        fingerprint TEXT NOT NULL,
+        state TEXT NOT NULL,
+        status INTEGER,
+        content_type TEXT,
+        body BLOB,
+        expires REAL NOT NULL
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS tool_runs (
+        key TEXT PRIMARY KEY,
+        state TEXT NOT NULL,  -- running, done or failed
+        output TEXT,
+        expires REAL NOT NULL
+    ) WITHOUT ROWID
+    """,
+)
+
+# Claim a key, or take over one whose claim or stored result has expired. A row comes back only
+# when this caller now owns the key.
+CLAIM = """
+INSERT INTO requests (key, fingerprint, state, expires) VALUES (:key, :fingerprint, 'pending', :expires)
+ON CONFLICT (key) DO UPDATE
+SET fingerprint = excluded.fingerprint, state = 'pending', status = NULL, content_type = NULL, body = NULL,
+    expires = excluded.expires
+WHERE requests.expires < :now
+RETURNING key
+"""
+
+CLAIM_TOOL = """
+INSERT INTO tool_runs (key, state, expires) VALUES (:key, 'running', :expires)
+ON CONFLICT (key) DO UPDATE SET state = 'running', output = NULL, expires = excluded.expires
+WHERE tool_runs.expires < :now
+RETURNING key
+"""
+
+# The current request's scoped Idempotency-Key, for the tool claims
+_current_key = ContextVar("idempotency_key", default=None)
+
+class StoredResponse:
+    """A completed response, replayed to retries."""
+
+    def __init__(self, status, content_type, body):
+        self.status = status
+        self.content_type = content_type
+        self.body = body
+
+class IdempotencyStore:
+    """
+    Idempotency-Key support: the first request with a key runs, retries with the same key get its
+    result instead of running again.
+
+    Claims live in a SQLite database in WAL mode, so a retry that lands on another gunicorn worker
+    still finds the original request. A retry that arrives while the original is still running
+    waits for it briefly, then is told to retry later. Tools run at most once per key, even when the original request failed and a
+    retry runs the request again.
+
+    If the database fails, requests run as if they had no key rather than failing.
+    """
+
+    def __init__(self, config=None):
+        self.configure(config)
+
+    def configure(self, config=None):
+        """
+        Apply the "idempotency" settings.
+
+        Args:
+            config (dict, optional): The settings. Defaults to None (DEFAULT_CONFIG).
+        """
+        self.config = {**DEFAULT_CONFIG, **(config or {})}
+        self.enabled = self.config["enabled"]
+        self.path = self.config["database"] or os.path.join(tempfile.gettempdir(), "robert-idempotency.sqlite3")
+        self._local = threading.local()
+        self._last_cleanup = 0
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False, timeout=5.0)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            for statement in SCHEMA:
+                connection.execute(statement)
+            self._local.connection = connection
+        return connection
+
+    @staticmethod
+    def scoped_key(client, endpoint, key):
+        """Scope a client's Idempotency-Key to the client and endpoint, so keys of different clients never collide."""
+        return hashlib.sha256(f"{client}\0{endpoint}\0{key}".encode()).hexdigest()
+
+    def begin(self, key, fingerprint):
+        """
+        Claim a key for a request, or find the result of an earlier request with it.
+
+        Waits up to wait_seconds while another request with the key is running, polling less
+        often the longer it waits.
+
+        Args:
+            key (str): The scoped key.
+            fingerprint (str): Identifies the request body, to catch keys reused for other requests.
+
+        Returns:
+            tuple: ("run", None) if the caller owns the key and must run the request and then call
+                   complete() or abandon(); ("replay", StoredResponse); ("mismatch", None) if the key
+                   was used for a different request; or ("busy", None) if the original request is
+                   still running after wait_seconds.
+        """
+        try:
+            return self._begin(key, fingerprint)
+        except sqlite3.Error as e:
+            logger.error("Idempotency store error, running the request without its key: %s", e)
+            return "run", None
+
+    def _begin(self, key, fingerprint):
+        connection = self._connection()
+        deadline = time.monotonic() + self.config["wait_seconds"]
+        delay = 0.05
+        self._cleanup(connection)
+
+        while True:
+            now = time.time()
+            claimed = connection.execute(CLAIM, {
+                "key": key, "fingerprint": fingerprint, "now": now,
+                "expires": now + self.config["pending_timeout_seconds"]
+            }).fetchone()
+            if claimed:
+                IDEMPOTENT_REQUESTS.inc(outcome="first")
+                _current_key.set(key)
+                return "run", None
+
+            row = connection.execute(
+                "SELECT fingerprint, state, status, content_type, body FROM requests WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                # The original request failed and gave up the key; run it again
+                continue
+
+            stored_fingerprint, state, status, content_type, body = row
+            if stored_fingerprint != fingerprint:
+                IDEMPOTENT_REQUESTS.inc(outcome="mismatch")
+                return "mismatch", None
+            if state == "done":
+                IDEMPOTENT_REQUESTS.inc(outcome="replayed")
+                return "replay", StoredResponse(status, content_type, body)
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                IDEMPOTENT_REQUESTS.inc(outcome="busy")
+                return "busy", None
+
+            # The original may be running in another worker, so the database is polled, with backoff
+            time.sleep(min(delay, remaining))
+            delay = min(delay * 2, 0.5)
+
+    def retry_after(self):
+        """Return the seconds a retry turned away as busy should wait before coming back."""
+        return max(1, math.ceil(self.config["wait_seconds"]))
+
+    def complete(self, key, status, content_type, body):
+        """
+        Store the result of the request that owns a key, for retries to replay.
+
+        Args:
+            key (str): The scoped key.
+            status (int): The response status code.
+            content_type (str): The response Content-Type.
+            body (bytes): The response body.
+        """
+        _current_key.set(None)
+        try:
+            self._connection().execute(
+                "UPDATE requests SET state = 'done', status = ?, content_type = ?, body = ?, expires = ? WHERE key = ?",
+                (status, content_type, body, time.time() + self.config["ttl_seconds"], key)
+            )
+        except sqlite3.Error as e:
+            logger.error("Idempotency store error, result not stored: %s", e)
+
+    def abandon(self, key):
+        """Give up a key after a failure, so a retry runs the request again (tools still run only once)."""
+        _current_key.set(None)
+        try:
+            self._connection().execute("DELETE FROM requests WHERE key = ? AND state = 'pending'", (key,))
+        except sqlite3.Error as e:
+            logger.error("Idempotency store error, key not released: %s", e)
+
+    def _cleanup(self, connection):
+        now = time.time()
+        if now - self._last_cleanup < 60:
+            return
+        self._last_cleanup = now
+        connection.execute("DELETE FROM requests WHERE expires < ?", (now,))
+        connection.execute("DELETE FROM tool_runs WHERE expires < ?", (now,))
+
+    def claim_tool(self, tool_name):
+        """
+        Claim a tool run for the current request's key.
+
+        The claim is per tool, not per arguments: a retry gets a new model reply, whose arguments
+        may differ.
+
+        Args:
+            tool_name (str): The tool.
+
+        Returns:
+            tuple: ("run", None) if the tool should run (then call complete_tool()); ("done", output)
+                   or ("failed", output) with the outcome of the run that already happened under this
+                   key; or ("running", None) if another attempt is running it right now.
+        """
+        request_key = _current_key.get()
+        if request_key is None:
+            return "run", None
+
+        key = f"{request_key}:{tool_name}"
+        now = time.time()
+        try:
+            connection = self._connection()
+            # A run claim expires like a pending request, so a run lost with its worker is retried
+            claimed = connection.execute(CLAIM_TOOL, {
+                "key": key, "now": now, "expires": now + self.config["pending_timeout_seconds"]
+            }).fetchone()
+            if claimed:
+                return "run", None
+            row = connection.execute("SELECT state, output FROM tool_runs WHERE key = ?", (key,)).fetchone()
+        except sqlite3.Error as e:
+            logger.error("Idempotency store error, running tool %s unclaimed: %s", tool_name, e)
+            return "run", None
+
+        if row and row[0] in ("done", "failed"):
+            logger.info("Tool %s already ran for this Idempotency-Key, not running it again", tool_name)
+            return row[0], row[1]
+        return "running", None
+
+    def complete_tool(self, tool_name, output, ok=True):
+        """
+        Store the outcome of a tool run claimed with claim_tool(), for retries to replay.
+
+        Args:
+            tool_name (str): The tool.
+            output (str): The tool output, or the error.
+            ok (bool, optional): Whether the tool succeeded. Defaults to True.
+        """
+        request_key = _current_key.get()
+        if request_key is None:
+            return
+
+        try:
+            self._connection().execute(
+                "UPDATE tool_runs SET state = ?, output = ?, expires = ? WHERE key = ?",
+                ("done" if ok else "failed", output, time.time() + self.config["ttl_seconds"],
+                 f"{request_key}:{tool_name}")
+            )
+        except sqlite3.Error as e:
+            logger.error("Idempotency store error, output of tool %s not stored: %s", tool_name, e)
+
+# The process-wide store; the app applies the "idempotency" settings to it
+store = IdempotencyStore()
@@ -0,0 +1,375 @@
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+
+from utils.logger import get_logger, set_request_id, clear_request_id
+from utils.metrics import registry
+from services.admission import lane
+
+logger = get_logger(__name__)
+
+JOBS = registry.counter(
+    "robert_jobs_total", "Background jobs by state change (queued, succeeded, failed, requeued)", ("state",))
+JOB_WAIT = registry.histogram(
+    "robert_job_queue_wait_seconds", "Time jobs waited in the queue before a worker took them")
+JOB_DURATION = registry.histogram(
+    "robert_job_duration_seconds", "Time workers spent running a job", ("status",))
+
+DEFAULT_CONFIG = {
+    "enabled": True,
+    # SQLite file shared by the worker processes; empty for one in the temp directory
+    "database": "",
+    # Where uploads wait for their job; empty for a directory in the temp directory
+    "spool_dir": "",
+    # Worker threads per process
+    "workers": 2,
+    # Submissions are refused while this many jobs are queued
+    "max_queued": 100,
+    # A job whose worker died is run again after lease_seconds, up to max_attempts times; a running
+    # job's lease is renewed every third of that
+    "lease_seconds": 600,
+    "max_attempts": 3,
+    # How long finished jobs can be fetched
+    "ttl_seconds": 86400,
+    # How often idle workers and event streams look for changes made by other processes
+    "poll_seconds": 0.5,
+    # The admission priority lane of the jobs' provider calls
+    "lane": "standard",
+}
+
+FINISHED = ("succeeded", "failed")
+
+SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS jobs (
+        id TEXT PRIMARY KEY,
+        state TEXT NOT NULL,
+        audio_path TEXT NOT NULL,
+        filename TEXT,
+        mimetype TEXT,
+        language TEXT,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        result TEXT,
+        error TEXT,
+        created REAL NOT NULL,
+        started REAL,
+        finished REAL,
+        lease_expires REAL
+    ) WITHOUT ROWID
+    """,
+    "CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, created)",
+)
+
+# Take the oldest queued job, or one whose worker's lease ran out. A single statement, so two
+# workers never take the same job.
+CLAIM = """
+UPDATE jobs SET state = 'running', attempts = attempts + 1, started = :now, lease_expires = :lease
+WHERE id = (
+    SELECT id FROM jobs
+    WHERE state = 'queued' OR (state = 'running' AND lease_expires < :now)
+    ORDER BY created LIMIT 1
+)
+RETURNING id, audio_path, filename, mimetype, language, attempts, created
+"""
+
+class QueueFull(Exception):
+    """Raised when a job is submitted while max_queued jobs are waiting."""
+
+    def __init__(self, queued, retry_after):
+        super().__init__(f"{queued} jobs are already queued")
+        self.queued = queued
+        self.retry_after = retry_after
+
+class Job:
+    """A claimed job, as passed to the handler."""
+
+    def __init__(self, id, audio_path, filename, mimetype, language, attempts, created):
+        self.id = id
+        self.audio_path = audio_path
+        self.filename = filename
+        self.mimetype = mimetype
+        self.language = language
+        self.attempts = attempts
+        self.created = created
+
+class JobQueue:
+    """
+    A persistent queue of transcription jobs, run by a pool of worker threads.
+
+    Jobs and their state live in a SQLite database in WAL mode and the uploads in a spool
+    directory, so queued jobs survive a restart and the workers of every gunicorn process share
+    one queue. A job that was running when its process died is taken up again once its lease runs
+    out; while it runs, its worker keeps renewing the lease, so a long job is not taken over.
+    """
+
+    def __init__(self, config=None):
+        self._threads = []
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self.configure(config)
+
+    def configure(self, config=None):
+        """
+        Apply the "jobs" settings. Worker threads already running keep running.
+
+        Args:
+            config (dict, optional): The settings. Defaults to None (DEFAULT_CONFIG).
+        """
+        self.config = {**DEFAULT_CONFIG, **(config or {})}
+        self.enabled = self.config["enabled"]
+        self.path = self.config["database"] or os.path.join(tempfile.gettempdir(), "robert-jobs.sqlite3")
+        self.spool_dir = self.config["spool_dir"] or os.path.join(tempfile.gettempdir(), "robert-jobs")
+        os.makedirs(self.spool_dir, exist_ok=True)
+        self._local = threading.local()
+        self._last_cleanup = 0
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False, timeout=5.0)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            for statement in SCHEMA:
+                connection.execute(statement)
+            self._local.connection = connection
+        return connection
+
+    def start(self, handler):
+        """
+        Start the worker threads of this process, up to the configured number.
+
+        Args:
+            handler (callable): Runs a Job; returns a result dict with "status" ("success" or
+                                "error") and either the result fields or "error".
+        """
+        if not self.enabled:
+            return
+        while len(self._threads) < self.config["workers"]:
+            thread = threading.Thread(target=self._work, args=(handler,), name=f"job-worker-{len(self._threads)}",
+                                      daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        """Stop the worker threads once their current job is done."""
+        self._stop.set()
+        self._wake.set()
+
+    def submit(self, audio_file, language=None):
+        """
+        Spool an upload to disk and queue a job for it.
+
+        Args:
+            audio_file (FileStorage): The upload; saved in chunks, not read into memory.
+            language (str, optional): The requested language. Defaults to None (auto-detect).
+
+        Returns:
+            str: The job id.
+
+        Raises:
+            QueueFull: If max_queued jobs are already waiting.
+        """
+        connection = self._connection()
+        queued = connection.execute("SELECT count(*) FROM jobs WHERE state = 'queued'").fetchone()[0]
+        if queued >= self.config["max_queued"]:
+            raise QueueFull(queued, max(1, round(queued * self.config["poll_seconds"])))
+
+        job_id = uuid.uuid4().hex
+        audio_path = os.path.join(self.spool_dir, job_id)
+        audio_file.save(audio_path)
+
+        connection.execute(
+            "INSERT INTO jobs (id, state, audio_path, filename, mimetype, language, created) "
+            "VALUES (?, 'queued', ?, ?, ?, ?, ?)",
+            (job_id, audio_path, audio_file.filename, audio_file.mimetype, language, time.time())
+        )
+        JOBS.inc(state="queued")
+        # Wake an idle worker of this process; other processes find the job when they next poll
+        self._wake.set()
+        return job_id
+
+    def get(self, job_id):
+        """
+        Get the state of a job.
+
+        Args:
+            job_id (str): The job id.
+
+        Returns:
+            dict: "id", "status" (queued, running, succeeded or failed), the timestamps and attempts,
+                  and "queue_position", "result" or "error" depending on the status; None if there is
+                  no such job.
+        """
+        row = self._connection().execute(
+            "SELECT id, state, attempts, result, error, created, started, finished FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+
+        job_id, state, attempts, result, error, created, started, finished = row
+        job = {"id": job_id, "status": state, "attempts": attempts, "created": created, "started": started,
+               "finished": finished}
+        if state == "queued":
+            job["queue_position"] = self._connection().execute(
+                "SELECT count(*) FROM jobs WHERE state = 'queued' AND created < ?", (created,)
+            ).fetchone()[0]
+        elif state == "succeeded":
+            job["result"] = json.loads(result)
+        elif state == "failed":
+            job["error"] = error
+        return job
+
+    def watch(self, job_id, timeout=None):
+        """
+        Follow a job until it finishes.
+
+        Args:
+            job_id (str): The job id.
+            timeout (float, optional): Stop after this many seconds. Defaults to None (no limit).
+
+        Yields:
+            dict: The job (see get()) whenever its status changes, or None when nothing changed for
+                  a while (e.g. for a keep-alive). The last one is the finished job.
+        """
+        deadline = time.monotonic() + timeout if timeout else None
+        last_status = None
+        last_yield = time.monotonic()
+        while deadline is None or time.monotonic() < deadline:
+            job = self.get(job_id)
+            if job is None:
+                return
+            if job["status"] != last_status:
+                last_status = job["status"]
+                last_yield = time.monotonic()
+                yield job
+                if last_status in FINISHED:
+                    return
+            elif time.monotonic() - last_yield >= 15:
+                last_yield = time.monotonic()
+                yield None
+            time.sleep(self.config["poll_seconds"])
+
+    def claim(self):
+        """
+        Take the next job to run.
+
+        Returns:
+            Job: The job, or None if there is none.
+        """
+        now = time.time()
+        connection = self._connection()
+        self._cleanup(connection, now)
+        row = connection.execute(CLAIM, {"now": now, "lease": now + self.config["lease_seconds"]}).fetchone()
+        if row is None:
+            return None
+
+        job = Job(*row)
+        if job.attempts > 1:
+            JOBS.inc(state="requeued")
+            logger.warning("Job %s is run again (attempt %d), its worker did not finish it", job.id, job.attempts)
+        return job
+
+    def _work(self, handler):
+        while not self._stop.is_set():
+            try:
+                job = self.claim()
+            except sqlite3.Error as e:
+                logger.error("Job queue error: %s", e)
+                job = None
+
+            if job is None:
+                self._wake.wait(self.config["poll_seconds"])
+                self._wake.clear()
+                continue
+
+            self._run(job, handler)
+
+    def _run(self, job, handler):
+        set_request_id(job.id)
+        start = time.time()
+        JOB_WAIT.observe(max(start - job.created, 0))
+
+        if job.attempts > self.config["max_attempts"]:
+            result = {"status": "error", "error": f"Gave up after {job.attempts - 1} attempts"}
+        else:
+            done = threading.Event()
+            threading.Thread(target=self._renew_lease, args=(job, done), name="job-lease", daemon=True).start()
+            try:
+                with lane(self.config["lane"]):
+                    result = handler(job)
+            except Exception as e:
+                logger.exception("Job %s failed", job.id)
+                result = {"status": "error", "error": str(e)}
+            finally:
+                done.set()
+
+        try:
+            self._finish(job, result)
+        except sqlite3.Error as e:
+            # The job runs again once its lease runs out
+            logger.error("Job queue error, result of job %s not stored: %s", job.id, e)
+        JOB_DURATION.observe(time.time() - start, status=result["status"])
+        clear_request_id()
+
+    def _renew_lease(self, job, done):
+        """Extend the lease of a running job until done is set, or until another worker took the job over."""
+        interval = self.config["lease_seconds"] / 3
+        while not done.wait(interval):
+            try:
+                renewed = self._connection().execute(
+                    "UPDATE jobs SET lease_expires = ? WHERE id = ? AND state = 'running' AND attempts = ?",
+                    (time.time() + self.config["lease_seconds"], job.id, job.attempts)
+                ).rowcount
+            except sqlite3.Error as e:
+                logger.error("Job queue error, lease of job %s not renewed: %s", job.id, e)
+                continue
+            if not renewed:
+                logger.warning("Job %s was taken over by another worker, no longer renewing its lease", job.id)
+                return
+
+    def _finish(self, job, result):
+        # Only the run that holds the job may finish it; a run whose lease ran out leaves it to the new one
+        if result["status"] == "success":
+            payload = {key: value for key, value in result.items() if key not in ("status", "code")}
+            finished = self._connection().execute(
+                "UPDATE jobs SET state = 'succeeded', result = ?, finished = ? "
+                "WHERE id = ? AND state = 'running' AND attempts = ?",
+                (json.dumps(payload), time.time(), job.id, job.attempts)
+            ).rowcount
+        else:
+            finished = self._connection().execute(
+                "UPDATE jobs SET state = 'failed', error = ?, finished = ? "
+                "WHERE id = ? AND state = 'running' AND attempts = ?",
+                (result.get("error", "Job failed"), time.time(), job.id, job.attempts)
+            ).rowcount
+
+        if not finished:
+            logger.warning("Job %s was taken over by another worker, discarding the result of attempt %d",
+                           job.id, job.attempts)
+            return
+
+        if result["status"] == "success":
+            JOBS.inc(state="succeeded")
+        else:
+            JOBS.inc(state="failed")
+            logger.error("Job %s failed: %s", job.id, result.get("error"))
+
+        # The upload is no longer needed once the job is done
+        try:
+            os.remove(job.audio_path)
+        except OSError:
+            pass
+
+    def _cleanup(self, connection, now):
+        if now - self._last_cleanup < 60:
+            return
+        self._last_cleanup = now
+        connection.execute("DELETE FROM jobs WHERE state IN ('succeeded', 'failed') AND finished < ?",
+                           (now - self.config["ttl_seconds"],))
+
+# The process-wide job queue; the app applies the "jobs" settings to it and starts its workers
+queue = JobQueue()
@@ -0,0 +1,63 @@
+import io
+import math
+import os
+import struct
+import time
+import wave
+
+class LocalSpeechService:
+    """
+    A stand-in speech synthesizer that needs no API key or network.
+
+    Renders a soft tone whose length follows the length of the text, as a WAV file, after an
+    optional delay that emulates a provider's latency. For tests and benchmarks of the speech
+    pipeline, not for users' ears.
+    """
+
+    SAMPLE_RATE = 16000
+
+    def __init__(self, api_key=None, latency_ms=None, ms_per_char=None):
+        """
+        Initialize the local speech service.
+
+        Args:
+            api_key (str, optional): Ignored; accepted like the other services.
+            latency_ms (float, optional): Delay before each result. If not provided, LOCAL_TTS_LATENCY_MS
+                                          or 0 is used.
+            ms_per_char (float, optional): Audio length per character of text. If not provided,
+                                           LOCAL_TTS_MS_PER_CHAR or 60 is used.
+        """
+        self.latency_ms = float(latency_ms if latency_ms is not None else os.getenv("LOCAL_TTS_LATENCY_MS", 0))
+        self.ms_per_char = float(ms_per_char if ms_per_char is not None else os.getenv("LOCAL_TTS_MS_PER_CHAR", 60))
+
+    def synthesize_speech(self, text, model_id="local", voice="tone", response_format="wav"):
+        """
+        Turn text into a tone of matching length.
+
+        Args:
+            text (str): The text to speak.
+            model_id (str, optional): Ignored. Defaults to "local".
+            voice (str, optional): Ignored. Defaults to "tone".
+            response_format (str, optional): Ignored; the audio is always WAV. Defaults to "wav".
+
+        Returns:
+            dict: The result, with "audio" (bytes) and "mimetype".
+        """
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+
+        frames = int(self.SAMPLE_RATE * len(text) * self.ms_per_char / 1000)
+        fade = min(frames // 2, self.SAMPLE_RATE // 50)
+        samples = bytearray()
+        for i in range(frames):
+            # A 220 Hz tone with 20 ms fades, so consecutive sentences join without clicks
+            envelope = min(1.0, i / fade, (frames - i) / fade) if fade else 1.0
+            samples += struct.pack("<h", int(3000 * envelope * math.sin(2 * math.pi * 220 * i / self.SAMPLE_RATE)))
+
+        buffer = io.BytesIO()
+        with wave.open(buffer, "wb") as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(self.SAMPLE_RATE)
+            wav.writeframes(bytes(samples))
+        return {"audio": buffer.getvalue(), "mimetype": "audio/wav", "status": "success"}
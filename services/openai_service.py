@@ -1,19 +1,23 @@
 import os
-import requests
 import json
 from flask import jsonify
 
+from services import http_client
+from services.tool_calls import to_openai_tools, parse_openai_tool_calls
+
 class OpenAIService:
-    def __init__(self, api_key=None):
+    def __init__(self, api_key=None, base_url=None):
         """
         Initialize the OpenAI service.
         
         Args:
             api_key (str, optional): The OpenAI API key. If not provided, it will be loaded from the environment.
+            base_url (str, optional): The API base URL. If not provided, OPENAI_BASE_URL or the public API is used.
         """
         self.api_key = api_key or os.getenv("OPENAI_API_KEY")
         if not self.api_key:
             raise ValueError("OpenAI API key not configured")
+        self.base_url = (base_url or os.getenv("OPENAI_BASE_URL") or "https://api.openai.com/v1").rstrip("/")
     
     def transcribe_audio(self, audio_file, model_id="gpt-4o-transcribe", language=None):
         """
@@ -51,8 +55,9 @@ class OpenAIService:
             }
             
             # Send the request to OpenAI
-            response = requests.post(
-                "https://api.openai.com/v1/audio/transcriptions",
+            response = http_client.post(
+                "OpenAI", model_id, "transcription",
+                f"{self.base_url}/audio/transcriptions",
                 headers=headers,
                 files=files,
                 data=data
@@ -61,6 +66,7 @@ class OpenAIService:
             # Check if the request was successful
             if response.status_code == 200:
                 result = response.json()
+                http_client.record_usage("OpenAI", model_id, result)
                 transcription_text = result.get("text", "")
                 return {"text": transcription_text, "status": "success"}
             else:
@@ -68,7 +74,94 @@ class OpenAIService:
         except Exception as e:
             return {"error": str(e), "status": "error"}
     
-    def get_chat_completion(self, messages, model_id="gpt-4o", response_format=None):
+    def stream_transcription(self, audio_file, model_id="gpt-4o-transcribe", language=None):
+        """
+        Transcribe audio using OpenAI's API, streaming the transcript as it is produced.
+        
+        Args:
+            audio_file: The audio file object from Flask's request.files.
+            model_id (str, optional): The model ID to use for transcription. Defaults to "gpt-4o-transcribe".
+            language (str, optional): The language of the audio. Defaults to None (auto-detect).
+            
+        Yields:
+            dict: {"type": "delta", "text": ...} for each part of the transcript, then the result:
+                  {"type": "done", "text": ..., "status": "success"} or {"type": "error", "error": ..., "status": "error"}.
+        """
+        try:
+            audio_file.stream.seek(0)
+            files = {
+                "file": (audio_file.filename, audio_file.stream, audio_file.mimetype),
+            }
+            data = {
+                "model": model_id,
+                "stream": "true",
+            }
+            if language:
+                data["language"] = language
+            
+            with http_client.stream(
+                "OpenAI", model_id, "transcription",
+                f"{self.base_url}/audio/transcriptions",
+                headers={"Authorization": f"Bearer {self.api_key}"},
+                files=files,
+                data=data
+            ) as response:
+                if response.status_code != 200:
+                    yield {"type": "error", "error": response.text, "status": "error", "status_code": response.status_code}
+                    return
+                
+                deltas = []
+                for event in http_client.iter_events(response):
+                    if event.get("type") == "transcript.text.delta":
+                        deltas.append(event["delta"])
+                        yield {"type": "delta", "text": event["delta"]}
+                    elif event.get("type") == "transcript.text.done":
+                        http_client.record_usage("OpenAI", model_id, event)
+                        yield {"type": "done", "text": event.get("text", "".join(deltas)), "status": "success"}
+                        return
+            
+            yield {"type": "error", "error": "The transcription stream ended early", "status": "error"}
+        except Exception as e:
+            yield {"type": "error", "error": str(e), "status": "error"}
+    
+    def synthesize_speech(self, text, model_id="gpt-4o-mini-tts", voice="alloy", response_format="mp3"):
+        """
+        Turn text into speech using OpenAI's API.
+        
+        Args:
+            text (str): The text to speak.
+            model_id (str, optional): The model ID to use. Defaults to "gpt-4o-mini-tts".
+            voice (str, optional): The voice. Defaults to "alloy".
+            response_format (str, optional): The audio format (mp3, wav, opus, aac, flac). Defaults to "mp3".
+            
+        Returns:
+            dict: The result, with "audio" (bytes) and "mimetype" on success.
+        """
+        try:
+            payload = {
+                "model": model_id,
+                "voice": voice,
+                "input": text,
+                "response_format": response_format
+            }
+            
+            response = http_client.post(
+                "OpenAI", model_id, "speech",
+                f"{self.base_url}/audio/speech",
+                headers={"Authorization": f"Bearer {self.api_key}"},
+                json=payload,
+                timeout=60
+            )
+            
+            if response.status_code == 200:
+                mimetype = response.headers.get("Content-Type", f"audio/{response_format}").split(";")[0]
+                return {"audio": response.content, "mimetype": mimetype, "status": "success"}
+            else:
+                return {"error": response.text, "status": "error", "status_code": response.status_code}
+        except Exception as e:
+            return {"error": str(e), "status": "error"}
+    
+    def get_chat_completion(self, messages, model_id="gpt-4o", response_format=None, tools=None):
         """
         Get a chat completion from OpenAI's API.
         
@@ -76,6 +169,8 @@ class OpenAIService:
             messages (list): The messages to send to the API.
             model_id (str, optional): The model ID to use. Defaults to "gpt-4o".
             response_format (dict, optional): The response format. Defaults to None.
+            tools (list, optional): Tool declarations ({"name", "description", "parameters"}) for
+                                    native function calling. Defaults to None.
             
         Returns:
             dict: The chat completion result.
@@ -91,6 +186,10 @@ class OpenAIService:
             if response_format:
                 payload["response_format"] = response_format
             
+            # Add tools for native function calling if specified
+            if tools:
+                payload["tools"] = to_openai_tools(tools)
+            
             # Prepare the headers for the request
             headers = {
                 "Authorization": f"Bearer {self.api_key}",
@@ -98,8 +197,9 @@ class OpenAIService:
             }
             
             # Send the request to OpenAI
-            response = requests.post(
-                "https://api.openai.com/v1/chat/completions",
+            response = http_client.post(
+                "OpenAI", model_id, "chat",
+                f"{self.base_url}/chat/completions",
                 headers=headers,
                 data=json.dumps(payload),
                 timeout=60  # Add a timeout to prevent hanging
@@ -108,8 +208,10 @@ class OpenAIService:
             # Check if the request was successful
             if response.status_code == 200:
                 result = response.json()
-                content = result["choices"][0]["message"]["content"]
-                return {"content": content, "status": "success"}
+                http_client.record_usage("OpenAI", model_id, result)
+                message = result["choices"][0]["message"]
+                content = message.get("content") or ""
+                return {"content": content, "tool_calls": parse_openai_tool_calls(message), "status": "success"}
             else:
                 return {"error": response.text, "status": "error", "status_code": response.status_code}
         except Exception as e:
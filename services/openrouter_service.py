@@ -1,21 +1,26 @@
 import os
-import requests
 import json
 from flask import request
 
+from services import http_client
+from services.tool_calls import to_openai_tools, parse_openai_tool_calls
+from utils.response_parser import parse_response
+
 class OpenRouterService:
-    def __init__(self, api_key=None):
+    def __init__(self, api_key=None, base_url=None):
         """
         Initialize the OpenRouter service.
         
         Args:
             api_key (str, optional): The OpenRouter API key. If not provided, it will be loaded from the environment.
+            base_url (str, optional): The API base URL. If not provided, OPENROUTER_BASE_URL or the public API is used.
         """
         self.api_key = api_key or os.getenv("OPENROUTER_API_KEY")
         if not self.api_key:
             raise ValueError("OpenRouter API key not configured")
+        self.base_url = (base_url or os.getenv("OPENROUTER_BASE_URL") or "https://openrouter.ai/api/v1").rstrip("/")
     
-    def get_chat_completion(self, messages, model_id, response_format=None):
+    def get_chat_completion(self, messages, model_id, response_format=None, tools=None):
         """
         Get a chat completion from OpenRouter's API.
         
@@ -23,6 +28,8 @@ class OpenRouterService:
             messages (list): The messages to send to the API.
             model_id (str): The model ID to use.
             response_format (dict, optional): The response format. Defaults to None.
+            tools (list, optional): Tool declarations ({"name", "description", "parameters"}) for
+                                    native function calling. Defaults to None.
             
         Returns:
             dict: The chat completion result.
@@ -38,6 +45,10 @@ class OpenRouterService:
             if response_format and ("gpt-4" in model_id.lower() or "openai" in model_id.lower()):
                 payload["response_format"] = response_format
             
+            # Add tools for native function calling if specified
+            if tools:
+                payload["tools"] = to_openai_tools(tools)
+            
             # Prepare the headers for the request
             headers = {
                 "Authorization": f"Bearer {self.api_key}",
@@ -47,8 +58,9 @@ class OpenRouterService:
             }
             
             # Send the request to OpenRouter
-            response = requests.post(
-                "https://openrouter.ai/api/v1/chat/completions",
+            response = http_client.post(
+                "OpenRouter", model_id, "chat",
+                f"{self.base_url}/chat/completions",
                 headers=headers,
                 data=json.dumps(payload),
                 timeout=60  # Add a timeout to prevent hanging
@@ -57,8 +69,10 @@ class OpenRouterService:
             # Check if the request was successful
             if response.status_code == 200:
                 result = response.json()
-                content = result["choices"][0]["message"]["content"]
-                return {"content": content, "status": "success"}
+                http_client.record_usage("OpenRouter", model_id, result)
+                message = result["choices"][0]["message"]
+                content = message.get("content") or ""
+                return {"content": content, "tool_calls": parse_openai_tool_calls(message), "status": "success"}
             else:
                 return {"error": response.text, "status": "error", "status_code": response.status_code}
         except Exception as e:
@@ -137,63 +151,15 @@ class OpenRouterService:
             if result["status"] == "success":
                 content = result["content"]
                 
-                # Try to parse the JSON response
-                try:
-                    json_response = json.loads(content)
-                    transcription = json_response.get("transcription", "")
-                    ai_response = json_response.get("response", "")
-                    
-                    if not transcription and not ai_response:
-                        # If neither field is present, try to extract from text
-                        if "transcription:" in content.lower() or "transcript:" in content.lower():
-                            if "transcription:" in content.lower():
-                                parts = content.lower().split("transcription:", 1)
-                            elif "transcript:" in content.lower():
-                                parts = content.lower().split("transcript:", 1)
-                            
-                            if len(parts) > 1:
-                                transcription_part = parts[1].strip()
-                                
-                                if "response:" in transcription_part:
-                                    resp_parts = transcription_part.split("response:", 1)
-                                    transcription = resp_parts[0].strip()
-                                    ai_response = resp_parts[1].strip()
-                                else:
-                                    transcription = transcription_part
-                                    ai_response = transcription_part
-                        else:
-                            transcription = content
-                            ai_response = content
-                    
-                    return {
-                        "text": transcription,
-                        "ai_response": ai_response,
-                        "status": "success"
-                    }
-                except json.JSONDecodeError:
-                    # If not valid JSON, try to extract from text
-                    transcription = content
-                    ai_response = content
-                    
-                    if "transcription:" in content.lower() or "transcript:" in content.lower():
-                        if "transcription:" in content.lower():
-                            parts = content.lower().split("transcription:", 1)
-                        elif "transcript:" in content.lower():
-                            parts = content.lower().split("transcript:", 1)
-                        
-                        if len(parts) > 1:
-                            transcription_part = parts[1].strip()
-                            
-                            if "response:" in transcription_part:
-                                resp_parts = transcription_part.split("response:", 1)
-                                transcription = resp_parts[0].strip()
-                                ai_response = resp_parts[1].strip()
-                    
-                    return {
-                        "text": transcription,
-                        "ai_response": ai_response,
-                        "status": "success"
-                    }
+                # Parse the response once into transcription, response and tool calls
+                envelope = parse_response(content)
+                
+                return {
+                    "text": envelope.transcription or envelope.response,
+                    "ai_response": envelope.response,
+                    "tool_calls": envelope.tool_calls,
+                    "status": "success"
+                }
             else:
                 return result
         except Exception as e:
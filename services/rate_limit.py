@@ -0,0 +1,197 @@
+import hashlib
+import math
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from utils.logger import get_logger
+from utils.metrics import registry
+
+logger = get_logger(__name__)
+
+RATE_LIMITED = registry.counter(
+    "robert_rate_limited_total", "Requests rejected by the per-client rate limits", ("bucket",))
+
+DEFAULT_CONFIG = {
+    "enabled": True,
+    # SQLite file shared by the worker processes; empty for one in the temp directory
+    "database": "",
+    # Use the first X-Forwarded-For address as the client IP (only behind a trusted proxy)
+    "trust_proxy": False,
+    # Used to estimate the audio length of an upload from its size before it is read: 16 kHz 16-bit
+    # PCM; compressed recordings take fewer bytes per second, so they are not undercharged by much
+    "audio_bytes_per_second": 32000,
+    "buckets": {
+        "text": {"capacity": 30, "refill_per_second": 0.5},
+        # Holds a whole upload of the default max_bytes (50 MB is about 1560 s at 32000 bytes per second)
+        "audio_seconds": {"capacity": 1800, "refill_per_second": 1.0},
+        # Messages sent to /chat/batch, which also takes one "text" token per batch
+        "batch_items": {"capacity": 1000, "refill_per_second": 1.0},
+    },
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (
+    key TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL
+) WITHOUT ROWID
+"""
+
+# Refill, then take the cost only if the bucket holds enough. A row is returned only when the
+# tokens were taken, so the check is a single atomic statement and needs no explicit transaction.
+TAKE = """
+INSERT INTO buckets (key, tokens, updated) VALUES (:key, :capacity - :cost, :now)
+ON CONFLICT (key) DO UPDATE
+SET tokens = min(:capacity, tokens + max(:now - updated, 0) * :rate) - :cost, updated = :now
+WHERE min(:capacity, tokens + max(:now - updated, 0) * :rate) >= :cost
+RETURNING tokens
+"""
+
+PEEK = "SELECT tokens, updated FROM buckets WHERE key = ?"
+
+class RateLimited(Exception):
+    """
+    Raised when a client has used up one of its buckets.
+
+    Attributes:
+        bucket (str): The bucket that is empty.
+        retry_after (int): Seconds until the bucket holds enough tokens again.
+        quota (dict): The client's quota, as returned by RateLimiter.take().
+    """
+
+    def __init__(self, bucket, retry_after, quota):
+        super().__init__(f"Rate limit exceeded for {bucket.replace('_', ' ')}"
+                         + f", retry after {retry_after} s")
+        self.bucket = bucket
+        self.retry_after = retry_after
+        self.quota = quota
+
+class RateLimiter:
+    """
+    Per-client token buckets kept in a SQLite database, so the limits hold across gunicorn workers.
+
+    Each bucket holds up to `capacity` tokens and refills continuously at `refill_per_second`.
+    The database runs in WAL mode without fsync: the buckets are cheap to lose, and a check is one
+    UPSERT on a per-thread connection.
+    """
+
+    def __init__(self, config=None):
+        self.configure(config)
+
+    def configure(self, config=None):
+        """
+        Apply the "rate_limit" settings.
+
+        Args:
+            config (dict, optional): The settings. Defaults to None (DEFAULT_CONFIG).
+        """
+        self.config = {**DEFAULT_CONFIG, **(config or {})}
+        # RATE_LIMIT_ENABLED=0 turns the limits off, e.g. for load tests from a single client
+        self.enabled = self.config["enabled"] and os.getenv("RATE_LIMIT_ENABLED", "1") != "0"
+        self.buckets = self.config["buckets"]
+        # The API keys issued to clients (RATE_LIMIT_API_KEYS, comma-separated), kept only as hashes
+        self.api_keys = {_hash(key.strip()) for key in os.getenv("RATE_LIMIT_API_KEYS", "").split(",") if key.strip()}
+        self.path = self.config["database"] or os.path.join(tempfile.gettempdir(), "robert-rate-limit.sqlite3")
+        self._local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False, timeout=1.0)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=OFF")
+            connection.execute(SCHEMA)
+            self._local.connection = connection
+        return connection
+
+    def client_key(self, request):
+        """
+        Identify the client of a request: its API key if it is one of the issued keys, else its IP.
+
+        Unknown keys are ignored rather than trusted, so a client cannot get fresh buckets by making
+        up a new key for every request. Keys are hashed, so the database never holds them.
+
+        Args:
+            request (flask.Request): The request.
+
+        Returns:
+            str: The client key, e.g. "key:3f2a..." or "ip:203.0.113.7".
+        """
+        api_key = request.headers.get("X-API-Key")
+        if api_key:
+            digest = _hash(api_key)
+            if digest in self.api_keys:
+                return "key:" + digest[:24]
+
+        address = request.remote_addr or "unknown"
+        if self.config["trust_proxy"] and request.headers.get("X-Forwarded-For"):
+            address = request.headers["X-Forwarded-For"].split(",", 1)[0].strip()
+        return "ip:" + address
+
+    def estimate_audio_seconds(self, content_length):
+        """Estimate the audio length of an upload from its size."""
+        return (content_length or 0) / self.config["audio_bytes_per_second"]
+
+    def take(self, client, costs):
+        """
+        Take tokens from the client's buckets.
+
+        The buckets are checked in order and each one is charged only if it holds enough, so a
+        rejection by a later bucket leaves the tokens of an earlier one taken; requests are
+        rejected rarely enough that this does not matter. A cost above a bucket's capacity is
+        charged as the full bucket, so a large upload waits for a full bucket instead of being
+        refused for good.
+
+        Args:
+            client (str): The client key from client_key().
+            costs (dict): Bucket names mapped to the tokens to take.
+
+        Returns:
+            dict: Bucket names mapped to (limit, remaining, seconds until full) for the headers.
+
+        Raises:
+            RateLimited: If a bucket holds too few tokens.
+        """
+        quota = {}
+        if not self.enabled:
+            return quota
+
+        now = time.time()
+        try:
+            connection = self._connection()
+            for bucket, cost in costs.items():
+                limits = self.buckets.get(bucket)
+                if not limits:
+                    continue
+                capacity, rate = limits["capacity"], limits["refill_per_second"]
+                key = f"{bucket}:{client}"
+                cost = min(cost, capacity)
+
+                row = connection.execute(TAKE, {"key": key, "capacity": capacity, "cost": cost,
+                                                "rate": rate, "now": now}).fetchone()
+
+                if row is None:
+                    tokens, updated = connection.execute(PEEK, (key,)).fetchone() or (capacity, now)
+                    remaining = min(capacity, tokens + max(now - updated, 0) * rate)
+                    quota[bucket] = (capacity, remaining, _seconds_until(capacity - remaining, rate))
+                    RATE_LIMITED.inc(bucket=bucket)
+                    raise RateLimited(bucket, _seconds_until(cost - remaining, rate), quota)
+
+                remaining = row[0]
+                quota[bucket] = (capacity, remaining, _seconds_until(capacity - remaining, rate))
+        except sqlite3.Error as e:
+            # Fail open: a broken store must not take the app down
+            logger.error("Rate limit store error: %s", e)
+        return quota
+
+def _hash(secret):
+    return hashlib.sha256(secret.encode()).hexdigest()
+
+def _seconds_until(tokens, rate):
+    return math.ceil(tokens / rate) if rate > 0 else 0
+
+# The process-wide rate limiter; the app applies the "rate_limit" settings to it
+limiter = RateLimiter()
@@ -0,0 +1,158 @@
+import contextvars
+import re
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.logger import get_logger
+from utils.metrics import registry
+from services import cancellation
+
+logger = get_logger(__name__)
+
+SPEECH_FIRST_AUDIO = registry.histogram(
+    "robert_speech_first_audio_seconds", "Time from a reply's text to the audio of its first sentence", ("provider",))
+SPEECH_SENTENCES = registry.counter(
+    "robert_speech_sentences_total", "Sentences synthesized, by status", ("provider", "status"))
+
+DEFAULT_CONFIG = {
+    "enabled": True,
+    # "OpenAI", or "Local" for the stand-in synthesizer
+    "provider": "OpenAI",
+    "model": "gpt-4o-mini-tts",
+    "voice": "alloy",
+    "format": "mp3",
+    # Sentences synthesized at a time
+    "concurrency": 4,
+    # Shorter sentences are joined with the next, so a reply is not spoken in tiny pieces
+    "min_sentence_chars": 20,
+    # Longer replies are cut at a sentence boundary before this many characters
+    "max_chars": 1500,
+}
+
+# The end of a sentence: terminal punctuation, any closing quotes or brackets, then whitespace
+SENTENCE_END = re.compile(r"[.!?…。！？][\"'”’)\]]*\s+")
+
+# Tool output appended to a reply is shown, not spoken
+TOOL_OUTPUT = re.compile(r"\n\n[✅❌] Tool ")
+
+class SentenceSplitter:
+    """
+    Splits text into sentences as it arrives.
+
+    feed() returns the sentences completed by a piece of text; flush() returns what is left once
+    the text is done.
+    """
+
+    def __init__(self, min_chars=20):
+        self.min_chars = min_chars
+        self._buffer = ""
+
+    def feed(self, text):
+        """
+        Add text.
+
+        Args:
+            text (str): The next piece of the text.
+
+        Returns:
+            list: The sentences completed so far.
+        """
+        self._buffer += text
+        sentences = []
+        start = 0
+        for match in SENTENCE_END.finditer(self._buffer):
+            sentence = self._buffer[start:match.end()].strip()
+            if len(sentence) >= self.min_chars:
+                sentences.append(sentence)
+                start = match.end()
+        self._buffer = self._buffer[start:]
+        return sentences
+
+    def flush(self):
+        """Return the rest of the text as a last sentence, if there is any."""
+        rest = self._buffer.strip()
+        self._buffer = ""
+        return [rest] if rest else []
+
+def spoken_text(reply, max_chars=1500):
+    """
+    Get the part of a reply to speak: without tool output, and cut at a sentence end after max_chars.
+
+    Args:
+        reply (str): The AI response.
+        max_chars (int, optional): The longest text to speak. Defaults to 1500.
+
+    Returns:
+        str: The text to speak.
+    """
+    text = TOOL_OUTPUT.split(reply, 1)[0].strip()
+    if len(text) <= max_chars:
+        return text
+
+    ends = [match.end() for match in SENTENCE_END.finditer(text, 0, max_chars)]
+    return text[:ends[-1]].strip() if ends else text[:max_chars]
+
+def synthesize_sentences(text_pieces, service, config=None):
+    """
+    Speak text sentence by sentence, synthesizing the sentences concurrently.
+
+    A sentence is sent to the synthesizer as soon as it is complete, while the text is still
+    arriving and while earlier sentences are still being synthesized. The audio comes back in
+    sentence order, so the first sentence can play while the rest is being synthesized.
+
+    Args:
+        text_pieces (iterable): The text, whole or in pieces as it arrives.
+        service: The speech service (see SpeechFactory).
+        config (dict, optional): The "tts" settings. Defaults to None (DEFAULT_CONFIG).
+
+    Yields:
+        dict: One per sentence, in order: "index", "text", "status", and "audio" and "mimetype" or "error".
+    """
+    config = {**DEFAULT_CONFIG, **(config or {})}
+    splitter = SentenceSplitter(config["min_sentence_chars"])
+    executor = ThreadPoolExecutor(max_workers=config["concurrency"], thread_name_prefix="speech")
+    pending = deque()
+    start = time.perf_counter()
+    index = 0
+
+    def submit(sentence):
+        nonlocal index
+        # Each synthesis runs with the request's context: its admission lane, cancel token and log id
+        future = executor.submit(contextvars.copy_context().run, synthesize, service, sentence, config)
+        pending.append((index, sentence, future))
+        index += 1
+
+    def result(item):
+        position, sentence, future = item
+        outcome = future.result()
+        SPEECH_SENTENCES.inc(provider=config["provider"], status=outcome["status"])
+        if position == 0 and outcome["status"] == "success":
+            SPEECH_FIRST_AUDIO.observe(time.perf_counter() - start, provider=config["provider"])
+        return {"index": position, "text": sentence, **outcome}
+
+    try:
+        for piece in text_pieces:
+            for sentence in splitter.feed(piece):
+                submit(sentence)
+            # Hand over the audio that is ready without waiting for the rest of the text
+            while pending and pending[0][2].done():
+                yield result(pending.popleft())
+
+        for sentence in splitter.flush():
+            submit(sentence)
+        while pending:
+            yield result(pending.popleft())
+    finally:
+        # The client may stop listening early; sentences not started yet are dropped
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def synthesize(service, sentence, config):
+    """Synthesize one sentence, unless its request was cancelled. Runs on a speech worker thread."""
+    if cancellation.skip("speech"):
+        return {"error": "Request cancelled", "status": "error"}
+    try:
+        return service.synthesize_speech(sentence, config["model"], config["voice"], config["format"])
+    except Exception as e:
+        logger.error("Speech synthesis failed: %s", e)
+        return {"error": str(e), "status": "error"}
@@ -0,0 +1,32 @@
+from .openai_service import OpenAIService
+from .local_speech_service import LocalSpeechService
+
+class SpeechFactory:
+    """
+    Factory class for creating speech synthesis service instances.
+    """
+
+    @staticmethod
+    def create_service(provider, api_key=None):
+        """
+        Create a speech service instance based on the provider.
+
+        Every service has synthesize_speech(text, model_id, voice, response_format), returning a dict
+        with "status" and "audio" and "mimetype" or "error".
+
+        Args:
+            provider (str): The provider name (OpenAI, or Local for the stand-in synthesizer).
+            api_key (str, optional): The API key to use. If not provided, it will be loaded from the environment.
+
+        Returns:
+            object: The service instance.
+
+        Raises:
+            ValueError: If the provider is not supported.
+        """
+        if provider.lower() == "openai":
+            return OpenAIService(api_key)
+        elif provider.lower() == "local":
+            return LocalSpeechService(api_key)
+        else:
+            raise ValueError(f"Unsupported speech provider: {provider}")
@@ -0,0 +1,94 @@
+import json
+
+def to_openai_tools(tools):
+    """
+    Convert tool declarations to the OpenAI/OpenRouter "tools" format.
+
+    Args:
+        tools (list): Tool declarations ({"name", "description", "parameters"}).
+
+    Returns:
+        list: The tools in OpenAI's function calling format.
+    """
+    return [
+        {
+            "type": "function",
+            "function": {
+                "name": tool["name"],
+                "description": tool.get("description", ""),
+                "parameters": tool.get("parameters") or {"type": "object", "properties": {}}
+            }
+        }
+        for tool in tools
+    ]
+
+def to_gemini_tools(tools):
+    """
+    Convert tool declarations to the Gemini "functionDeclarations" format.
+
+    Args:
+        tools (list): Tool declarations ({"name", "description", "parameters"}).
+
+    Returns:
+        list: The tools in Gemini's function calling format.
+    """
+    declarations = []
+    for tool in tools:
+        declaration = {
+            "name": tool["name"],
+            "description": tool.get("description", "")
+        }
+
+        # Gemini rejects object schemas without properties, so only send non-empty ones
+        parameters = tool.get("parameters")
+        if parameters and parameters.get("properties"):
+            declaration["parameters"] = parameters
+
+        declarations.append(declaration)
+
+    return [{"functionDeclarations": declarations}]
+
+def parse_openai_tool_calls(message):
+    """
+    Extract tool calls from an OpenAI/OpenRouter chat completion message.
+
+    Args:
+        message (dict): The "message" of the first choice.
+
+    Returns:
+        list: Tool calls as {"name": str, "arguments": dict}.
+    """
+    tool_calls = []
+    for tool_call in message.get("tool_calls") or []:
+        function = tool_call.get("function", {})
+        arguments = function.get("arguments") or "{}"
+
+        # Arguments arrive as a JSON string
+        if isinstance(arguments, str):
+            try:
+                arguments = json.loads(arguments)
+            except json.JSONDecodeError:
+                arguments = {}
+
+        if function.get("name"):
+            tool_calls.append({"name": function["name"], "arguments": arguments or {}})
+
+    return tool_calls
+
+def parse_gemini_tool_calls(parts):
+    """
+    Extract tool calls from the parts of a Gemini candidate.
+
+    Args:
+        parts (list): The "parts" of the candidate's content.
+
+    Returns:
+        list: Tool calls as {"name": str, "arguments": dict}.
+    """
+    tool_calls = []
+    for part in parts:
+        function_call = part.get("functionCall")
+        if function_call and function_call.get("name"):
+            tool_calls.append({"name": function_call["name"], "arguments": function_call.get("args") or {}})
+
+    return tool_calls
@@ -0,0 +1,383 @@
+import mmap
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from werkzeug.datastructures import FileStorage
+
+from utils.logger import get_logger
+from utils.metrics import registry
+
+logger = get_logger(__name__)
+
+UPLOADS = registry.counter(
+    "robert_uploads_total", "Resumable uploads by event (created, rejected, interrupted, finalized, expired)",
+    ("event",))
+UPLOAD_RECEIVED = registry.counter(
+    "robert_upload_received_bytes_total", "Bytes received in resumable upload chunks")
+
+DEFAULT_CONFIG = {
+    "enabled": True,
+    # SQLite file shared by the worker processes; empty for one in the temp directory
+    "database": "",
+    # Where partial uploads are spooled; empty for a directory in the temp directory
+    "spool_dir": "",
+    # Uploads declaring a larger length are refused before any of it is sent
+    "max_bytes": 50000000,
+    # The largest chunk one PATCH can carry
+    "max_chunk_bytes": 8388608,
+    # Unfinished uploads a client can have at a time
+    "max_pending": 5,
+    # Uploads untouched for this long are deleted
+    "stale_seconds": 3600,
+    # How long a chunk write or a finalize may hold an upload before another request can take it
+    "lock_seconds": 300,
+}
+
+SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS uploads (
+        id TEXT PRIMARY KEY,
+        client TEXT NOT NULL,
+        filename TEXT,
+        mimetype TEXT,
+        length INTEGER NOT NULL,
+        received INTEGER NOT NULL DEFAULT 0,
+        created REAL NOT NULL,
+        updated REAL NOT NULL,
+        locked_until REAL
+    ) WITHOUT ROWID
+    """,
+    "CREATE INDEX IF NOT EXISTS uploads_updated ON uploads (updated)",
+)
+
+# Take an upload for a chunk at the offset it has reached, unless another request holds it. A
+# single statement, so two retries of the same chunk never write at once.
+CLAIM_CHUNK = """
+UPDATE uploads SET locked_until = :lock, updated = :now
+WHERE id = :id AND client = :client AND received = :offset AND received < length
+    AND (locked_until IS NULL OR locked_until < :now)
+RETURNING length
+"""
+
+CLAIM_FINALIZE = """
+UPDATE uploads SET locked_until = :lock, updated = :now
+WHERE id = :id AND client = :client AND received = length AND (locked_until IS NULL OR locked_until < :now)
+RETURNING filename, mimetype
+"""
+
+# Bytes copied from the request body to the spool file at a time
+COPY_BUFFER = 65536
+
+class UploadError(Exception):
+    """Raised when an upload request cannot be served; code is the HTTP status to answer with."""
+
+    def __init__(self, message, code, offset=None):
+        super().__init__(message)
+        self.code = code
+        self.offset = offset
+
+class UploadStore:
+    """
+    Resumable uploads of large recordings, sent in chunks.
+
+    A client declares the length of a recording, then sends it in chunks at increasing offsets.
+    Chunks are written straight to a spool file, so a broken connection loses only the part of a
+    chunk that did not arrive: the client asks for the offset reached and sends the rest. Once
+    complete, the spool file is memory-mapped for the transcription pipeline instead of being read
+    into memory.
+
+    Uploads live in a SQLite database in WAL mode, so chunks of one upload can land on any gunicorn
+    worker. Uploads left unfinished for stale_seconds are deleted.
+    """
+
+    def __init__(self, config=None):
+        self.configure(config)
+
+    def configure(self, config=None):
+        """
+        Apply the "uploads" settings.
+
+        Args:
+            config (dict, optional): The settings. Defaults to None (DEFAULT_CONFIG).
+        """
+        self.config = {**DEFAULT_CONFIG, **(config or {})}
+        self.enabled = self.config["enabled"]
+        self.path = self.config["database"] or os.path.join(tempfile.gettempdir(), "robert-uploads.sqlite3")
+        self.spool_dir = self.config["spool_dir"] or os.path.join(tempfile.gettempdir(), "robert-uploads")
+        os.makedirs(self.spool_dir, exist_ok=True)
+        self._local = threading.local()
+        self._last_cleanup = 0
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False, timeout=5.0)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            for statement in SCHEMA:
+                connection.execute(statement)
+            self._local.connection = connection
+        return connection
+
+    def _spool_path(self, upload_id):
+        return os.path.join(self.spool_dir, f"{upload_id}.part")
+
+    def check_length(self, length):
+        """
+        Check the declared length of a recording against max_bytes.
+
+        Raises:
+            UploadError: 400 if the length is missing or not positive, 413 if it is too large.
+        """
+        if not isinstance(length, int) or isinstance(length, bool) or length <= 0:
+            raise UploadError("The upload length must be a positive number of bytes", 400)
+        if length > self.config["max_bytes"]:
+            UPLOADS.inc(event="rejected")
+            raise UploadError(f"The upload is too large: {length} bytes (at most {self.config['max_bytes']})", 413)
+
+    def create(self, client, length, filename=None, mimetype=None):
+        """
+        Start an upload.
+
+        Args:
+            client (str): The client key; only the same client can send chunks or finalize it.
+            length (int): The declared length in bytes.
+            filename (str, optional): The name of the recording. Defaults to None.
+            mimetype (str, optional): The content type of the recording. Defaults to None.
+
+        Returns:
+            dict: The upload (see get()).
+
+        Raises:
+            UploadError: If the length is refused, or the client has max_pending unfinished uploads.
+        """
+        self.check_length(length)
+
+        now = time.time()
+        connection = self._connection()
+        self._cleanup(connection, now)
+        pending = connection.execute("SELECT count(*) FROM uploads WHERE client = ?", (client,)).fetchone()[0]
+        if pending >= self.config["max_pending"]:
+            UPLOADS.inc(event="rejected")
+            raise UploadError(f"Too many unfinished uploads ({pending}), finish or delete one first", 429)
+
+        upload_id = uuid.uuid4().hex
+        # A sparse file of the declared length, so chunks can be written at their offset
+        with open(self._spool_path(upload_id), "wb") as f:
+            f.truncate(length)
+
+        connection.execute(
+            "INSERT INTO uploads (id, client, filename, mimetype, length, created, updated) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (upload_id, client, filename, mimetype, length, now, now)
+        )
+        UPLOADS.inc(event="created")
+        return {"id": upload_id, "offset": 0, "length": length, "complete": False}
+
+    def get(self, upload_id, client):
+        """
+        Get the progress of an upload.
+
+        Args:
+            upload_id (str): The upload id.
+            client (str): The client key of the caller.
+
+        Returns:
+            dict: "id", "offset" (the bytes received), "length" and "complete"; None if the client has
+                  no such upload.
+        """
+        row = self._connection().execute(
+            "SELECT received, length FROM uploads WHERE id = ? AND client = ?", (upload_id, client)
+        ).fetchone()
+        if row is None:
+            return None
+        received, length = row
+        return {"id": upload_id, "offset": received, "length": length, "complete": received == length}
+
+    def write_chunk(self, upload_id, client, offset, stream, content_length=None):
+        """
+        Write a chunk of an upload to its spool file.
+
+        The chunk is copied in small pieces, never held in memory. If the body breaks off, the
+        bytes that arrived are kept and the offset moves past them.
+
+        Args:
+            upload_id (str): The upload id.
+            client (str): The client key of the caller.
+            offset (int): Where the chunk starts; must be the offset the upload has reached.
+            stream: The request body.
+            content_length (int, optional): The length of the chunk, if declared. Defaults to None.
+
+        Returns:
+            dict: The upload after the chunk (see get()).
+
+        Raises:
+            UploadError: 404 for an unknown upload, 409 (with the current offset) for a wrong offset
+                         or while another chunk is being written, 413 for a chunk that is too large
+                         or runs past the declared length, 400 if the body broke off.
+        """
+        if content_length is not None and content_length > self.config["max_chunk_bytes"]:
+            raise UploadError(f"The chunk is too large: {content_length} bytes "
+                              f"(at most {self.config['max_chunk_bytes']})", 413)
+
+        now = time.time()
+        connection = self._connection()
+        claimed = connection.execute(CLAIM_CHUNK, {
+            "id": upload_id, "client": client, "offset": offset, "now": now, "lock": now + self.config["lock_seconds"]
+        }).fetchone()
+        if claimed is None:
+            self._refuse(upload_id, client, offset)
+        length = claimed[0]
+
+        if content_length is not None and offset + content_length > length:
+            self._release(upload_id, offset)
+            raise UploadError(f"The chunk runs past the declared length of {length} bytes", 413, offset)
+
+        limit = min(length - offset, self.config["max_chunk_bytes"])
+        written = 0
+        interrupted = None
+        try:
+            with open(self._spool_path(upload_id), "r+b") as f:
+                f.seek(offset)
+                while written < limit:
+                    data = stream.read(min(COPY_BUFFER, limit - written))
+                    if not data:
+                        break
+                    f.write(data)
+                    written += len(data)
+                overflow = written == limit and content_length is None and stream.read(1)
+        except Exception as e:
+            # The client went away mid-chunk; keep what arrived
+            interrupted = e
+            overflow = False
+        finally:
+            self._release(upload_id, offset + written)
+            UPLOAD_RECEIVED.inc(written)
+
+        if interrupted is not None:
+            UPLOADS.inc(event="interrupted")
+            logger.info("Upload %s interrupted at offset %d: %s", upload_id, offset + written, interrupted)
+            raise UploadError("The chunk broke off; resume from the returned offset", 400, offset + written)
+        if overflow:
+            if offset + written == length:
+                raise UploadError(f"The chunk runs past the declared length of {length} bytes", 413, offset + written)
+            raise UploadError(f"The chunk is too large (at most {self.config['max_chunk_bytes']} bytes); "
+                              "resume from the returned offset", 413, offset + written)
+
+        return {"id": upload_id, "offset": offset + written, "length": length, "complete": offset + written == length}
+
+    def _release(self, upload_id, received):
+        self._connection().execute(
+            "UPDATE uploads SET received = ?, locked_until = NULL, updated = ? WHERE id = ?",
+            (received, time.time(), upload_id)
+        )
+
+    def _refuse(self, upload_id, client, offset):
+        upload = self.get(upload_id, client)
+        if upload is None:
+            raise UploadError("Upload not found", 404)
+        if upload["complete"]:
+            raise UploadError("The upload is already complete", 409, upload["offset"])
+        if upload["offset"] != offset:
+            raise UploadError(f"Wrong offset {offset}, the upload is at {upload['offset']}", 409, upload["offset"])
+        raise UploadError("Another chunk of this upload is being written", 409, upload["offset"])
+
+    @contextmanager
+    def open(self, upload_id, client):
+        """
+        Take a complete upload for processing, memory-mapped.
+
+        The upload stays locked while the context is open; call finish() once it has been
+        processed, or leave it to be finalized again.
+
+        Args:
+            upload_id (str): The upload id.
+            client (str): The client key of the caller.
+
+        Yields:
+            FileStorage: The recording, over a read-only memory map of the spool file.
+
+        Raises:
+            UploadError: 404 for an unknown upload, 409 if it is not complete or already being finalized.
+        """
+        now = time.time()
+        claimed = self._connection().execute(CLAIM_FINALIZE, {
+            "id": upload_id, "client": client, "now": now, "lock": now + self.config["lock_seconds"]
+        }).fetchone()
+        if claimed is None:
+            upload = self.get(upload_id, client)
+            if upload is None:
+                raise UploadError("Upload not found", 404)
+            if not upload["complete"]:
+                raise UploadError(f"The upload is not complete: {upload['offset']} of {upload['length']} bytes",
+                                  409, upload["offset"])
+            raise UploadError("The upload is already being finalized", 409, upload["offset"])
+
+        filename, mimetype = claimed
+        try:
+            with open(self._spool_path(upload_id), "rb") as f, \
+                    mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                yield FileStorage(stream=data, filename=filename, content_type=mimetype or "application/octet-stream")
+        finally:
+            try:
+                self._connection().execute("UPDATE uploads SET locked_until = NULL WHERE id = ?", (upload_id,))
+            except sqlite3.Error as e:
+                logger.error("Upload store error, upload %s stays locked: %s", upload_id, e)
+
+    def finish(self, upload_id, client):
+        """Delete an upload once the pipeline has processed it."""
+        if self.delete(upload_id, client):
+            UPLOADS.inc(event="finalized")
+
+    def delete(self, upload_id, client):
+        """
+        Delete an upload and its spool file.
+
+        Returns:
+            bool: True if the client had such an upload.
+        """
+        deleted = self._connection().execute(
+            "DELETE FROM uploads WHERE id = ? AND client = ? RETURNING id", (upload_id, client)
+        ).fetchone()
+        if deleted is None:
+            return False
+        self._remove(upload_id)
+        return True
+
+    def _remove(self, upload_id):
+        try:
+            os.remove(self._spool_path(upload_id))
+        except OSError:
+            pass
+
+    def _cleanup(self, connection, now):
+        if now - self._last_cleanup < 60:
+            return
+        self._last_cleanup = now
+
+        stale = connection.execute(
+            "DELETE FROM uploads WHERE updated < ? AND (locked_until IS NULL OR locked_until < ?) RETURNING id",
+            (now - self.config["stale_seconds"], now)
+        ).fetchall()
+        for (upload_id,) in stale:
+            self._remove(upload_id)
+        if stale:
+            UPLOADS.inc(len(stale), event="expired")
+            logger.info("Deleted %d stale uploads", len(stale))
+
+        # Spool files left without a row, e.g. by a crash between creating the file and the row
+        known = {row[0] for row in connection.execute("SELECT id FROM uploads")}
+        for name in os.listdir(self.spool_dir):
+            path = os.path.join(self.spool_dir, name)
+            try:
+                if name[:-len(".part")] not in known and os.path.getmtime(path) < now - self.config["stale_seconds"]:
+                    os.remove(path)
+            except OSError:
+                pass
+
+# The process-wide upload store; the app applies the "uploads" settings to it
+store = UploadStore()
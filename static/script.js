@@ -2,6 +2,7 @@ let mediaRecorder;
 let audioChunks = [];
 let isProcessing = false;
 let isRecording = false;
+let audioContext = null;
 
 // DOM Elements
 const speakButton = document.getElementById("speakButton");
@@ -64,6 +65,95 @@ function addMessage(text, isUser = false) {
   
   // Scroll to bottom
   chatContainer.scrollTop = chatContainer.scrollHeight;
+  
+  return messageDiv;
+}
+
+// Function to read a stream of server-sent events from a fetch response
+async function readEvents(response, onEvent) {
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  
+  while (true) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    
+    // Events are separated by a blank line
+    let boundary;
+    while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+      const block = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+      
+      let event = "message";
+      let data = "";
+      for (const line of block.split("\n")) {
+        if (line.startsWith("event:")) {
+          event = line.slice(6).trim();
+        } else if (line.startsWith("data:")) {
+          data += line.slice(5).trim();
+        }
+      }
+      if (data) {
+        onEvent(event, JSON.parse(data));
+      }
+    }
+  }
+}
+
+// Function to play spoken replies: sentences arrive one by one and play back to back
+function createSpeechPlayer() {
+  let nextStartTime = 0;
+  let decoded = Promise.resolve();
+  
+  return function playSentence(data) {
+    const bytes = Uint8Array.from(atob(data.audio), c => c.charCodeAt(0));
+    const decoding = audioContext.decodeAudioData(bytes.buffer);
+    
+    // Decode concurrently, but schedule in sentence order
+    decoded = decoded.then(() => decoding).then(buffer => {
+      const source = audioContext.createBufferSource();
+      source.buffer = buffer;
+      source.connect(audioContext.destination);
+      
+      // Start right after the previous sentence, or now if it has already finished
+      const startTime = Math.max(audioContext.currentTime, nextStartTime);
+      source.start(startTime);
+      nextStartTime = startTime + buffer.duration;
+    }).catch(error => console.error("Speech playback error:", error));
+  };
+}
+
+// Function to show the AI response to a voice message, with any tool output after it
+function showVoiceResponse(aiResponse) {
+  statusText.textContent = "✅ Response received";
+  
+  // Add a slight delay to make the conversation feel more natural
+  setTimeout(() => {
+    // Check if the response contains tool output (indicated by ✅ or ❌)
+    if (aiResponse.includes("✅ Tool") || aiResponse.includes("❌ Tool")) {
+      // Split the response into the AI part and the tool output part
+      const parts = aiResponse.split(/\n\n(✅ Tool|\❌ Tool)/);
+      
+      if (parts.length > 1) {
+        // Add the AI response part
+        addMessage(parts[0]);
+        
+        // Add the tool output with special formatting
+        setTimeout(() => {
+          const toolOutput = parts.slice(1).join("");
+          addToolOutput(toolOutput);
+        }, 500);
+      } else {
+        // If splitting didn't work, just add the whole response
+        addMessage(aiResponse);
+      }
+    } else {
+      // No tool output, just add the response
+      addMessage(aiResponse);
+    }
+  }, 500);
 }
 
 // Function to add a tool output message to the chat
@@ -177,6 +267,14 @@ messageInput.addEventListener("keypress", (e) => {
 speakButton.addEventListener("click", async () => {
   if (isProcessing) return; // Prevent actions while processing
   
+  // Browsers only allow audio started from a user gesture, so the context is created on this click
+  if (!audioContext) {
+    audioContext = new (window.AudioContext || window.webkitAudioContext)();
+  }
+  if (audioContext.state === "suspended") {
+    audioContext.resume();
+  }
+  
   if (isRecording) {
     // Stop recording
     if (mediaRecorder && mediaRecorder.state !== "inactive") {
@@ -211,6 +309,9 @@ speakButton.addEventListener("click", async () => {
         const formData = new FormData();
         formData.append("audio", audioBlob, "recording.webm");
         
+        // Ask for the reply to be spoken as well
+        formData.append("speak", "1");
+        
         // Add language if selected
         const selectedLanguage = languageSelect.value;
         if (selectedLanguage) {
@@ -220,48 +321,60 @@ speakButton.addEventListener("click", async () => {
         statusText.textContent = "⏳ Transcribing...";
         
         try {
-          const response = await fetch("/transcribe", {
+          // The transcript streams in as server-sent events while it is produced
+          const response = await fetch("/transcribe/stream", {
             method: "POST",
             body: formData
           });
           
-          const result = await response.json();
+          // Errors before the stream starts (e.g. rate limits) come back as JSON
+          if (!response.ok) {
+            const error = await response.json();
+            throw new Error(error.error || response.statusText);
+          }
           
-          if (result.text) {
-            // Add user's transcribed message to chat
-            addMessage(result.text, true);
-            statusText.textContent = "✅ Transcription complete!";
-            
-            // If there's an AI response, add it to the chat
-            if (result.ai_response) {
-              // Add a slight delay to make the conversation feel more natural
-              setTimeout(() => {
-                // Check if the response contains tool output (indicated by ✅ or ❌)
-                if (result.ai_response.includes("✅ Tool") || result.ai_response.includes("❌ Tool")) {
-                  // Split the response into the AI part and the tool output part
-                  const parts = result.ai_response.split(/\n\n(✅ Tool|\❌ Tool)/);
-                  
-                  if (parts.length > 1) {
-                    // Add the AI response part
-                    addMessage(parts[0]);
-                    
-                    // Add the tool output with special formatting
-                    setTimeout(() => {
-                      const toolOutput = parts.slice(1).join("");
-                      addToolOutput(toolOutput);
-                    }, 500);
-                  } else {
-                    // If splitting didn't work, just add the whole response
-                    addMessage(result.ai_response);
-                  }
-                } else {
-                  // No tool output, just add the response
-                  addMessage(result.ai_response);
-                }
-              }, 500);
+          let transcriptMessage = null;
+          let result = {};
+          const playSentence = createSpeechPlayer();
+          await readEvents(response, (event, data) => {
+            if (event === "transcript.delta") {
+              // Show the user's message as it is transcribed
+              if (!transcriptMessage) {
+                transcriptMessage = addMessage("", true);
+              }
+              transcriptMessage.textContent += data.text;
+              chatContainer.scrollTop = chatContainer.scrollHeight;
+            } else if (event === "transcript") {
+              if (!transcriptMessage) {
+                transcriptMessage = addMessage("", true);
+              }
+              transcriptMessage.textContent = data.text;
+              statusText.textContent = "✅ Transcription complete! Thinking...";
+            } else if (event === "response") {
+              result = data;
+              if (transcriptMessage) {
+                transcriptMessage.textContent = data.text;
+              }
+              // Show the reply now; its speech keeps streaming in after it
+              if (data.ai_response) {
+                spinner.style.display = "none";
+                showVoiceResponse(data.ai_response);
+              }
+            } else if (event === "speech") {
+              if (data.audio) {
+                playSentence(data);
+              }
+            } else if (event === "speech.done") {
+              if (data.failed) {
+                console.error("Speech failed for", data.failed, "sentence(s)", data.error || "");
+              }
+            } else if (event === "error") {
+              result = data;
             }
-          } else {
-            statusText.textContent = "❌ Failed to transcribe";
+          });
+          
+          if (!result.ai_response) {
+            statusText.textContent = transcriptMessage ? "❌ Failed to get response" : "❌ Failed to transcribe";
             console.error("Error:", result.error || "Unknown error");
           }
         } catch (error) {
@@ -0,0 +1,276 @@
+"""
+Offline bulk transcription of an archive of recordings.
+
+Walks a directory for audio files and transcribes them with the configured transcription model
+(or --model), through the same services as /transcribe but without the Flask app, a few files at
+a time in a pool of worker processes. Each result is appended to a JSONL file as soon as it is
+ready. Files with the same content are transcribed once.
+
+Finished files are recorded in a checkpoint file next to the output, so an interrupted run picks
+up where it stopped when started again with the same output; files that failed are retried.
+
+Usage:
+    python transcribe_archive.py recordings/ --output transcripts.jsonl [--workers 4] [--language sv]
+                                             [--model gpt-4o-mini-transcribe] [--retries 2]
+
+At the end, a JSON report with the counts, files/s and audio-seconds/s is printed to stdout; the
+log goes to stderr.
+"""
+import argparse
+import hashlib
+import json
+import mimetypes
+import multiprocessing
+import os
+import sys
+import time
+import wave
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from dotenv import load_dotenv
+from werkzeug.datastructures import FileStorage
+
+from utils.logger import setup_logging, get_logger
+from models.settings import load_settings
+from models.model_info import load_models, get_model_info
+
+logger = get_logger("transcribe_archive")
+
+AUDIO_EXTENSIONS = (".wav", ".mp3", ".m4a", ".mp4", ".mpeg", ".mpga", ".ogg", ".oga", ".webm", ".flac")
+
+# Provider statuses worth another attempt; a missing status means the request itself failed
+RETRY_STATUS_CODES = (None, 408, 429, 500, 502, 503, 504)
+
+def find_audio_files(directory, extensions=AUDIO_EXTENSIONS):
+    """
+    List the audio files under a directory, in a stable order.
+
+    Args:
+        directory (str): The directory to walk.
+        extensions (tuple, optional): The file extensions to include. Defaults to AUDIO_EXTENSIONS.
+
+    Returns:
+        list: The file paths.
+    """
+    paths = []
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith(extensions):
+                paths.append(os.path.join(root, name))
+    return paths
+
+def content_hash(path, chunk_size=1024 * 1024):
+    """Return the SHA-256 of a file's contents, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def audio_seconds(path, bytes_per_second=16000):
+    """
+    Get the length of a recording.
+
+    WAV files are measured exactly; other formats are estimated from their size, like the rate
+    limits do for uploads.
+
+    Args:
+        path (str): The audio file.
+        bytes_per_second (int, optional): The assumed bitrate of compressed formats. Defaults to 16000.
+
+    Returns:
+        tuple: (seconds, estimated)
+    """
+    if path.lower().endswith(".wav"):
+        try:
+            with wave.open(path, "rb") as wav:
+                return wav.getnframes() / wav.getframerate(), False
+        except (wave.Error, EOFError):
+            pass
+    return os.path.getsize(path) / bytes_per_second, True
+
+def load_checkpoint(path):
+    """Return the content hashes already transcribed in an earlier run."""
+    if not os.path.exists(path):
+        return set()
+    with open(path) as f:
+        return {line.strip() for line in f if line.strip()}
+
+# State of a worker process, set up once by _init_worker
+_worker = {}
+
+def _init_worker(model_id, language, retries, log_level):
+    # The environment, with the API keys from .env, is inherited from the parent process
+    setup_logging(level=log_level, stream=sys.stderr)
+
+    from services.service_factory import ServiceFactory
+
+    model_info = get_model_info(model_id)
+    _worker.update({
+        "service": ServiceFactory.create_service_for_model(model_info),
+        "model_id": model_id,
+        "language": language,
+        "retries": retries,
+        "bytes_per_second": load_settings().get("rate_limit", {}).get("audio_bytes_per_second", 16000),
+    })
+
+def transcribe_file(path):
+    """
+    Transcribe one file in a worker process.
+
+    Args:
+        path (str): The audio file.
+
+    Returns:
+        dict: The result, with "status" and "text" or "error", the model, the audio length and the time taken.
+    """
+    start = time.perf_counter()
+    seconds, estimated = audio_seconds(path, _worker["bytes_per_second"])
+
+    with open(path, "rb") as stream:
+        audio_file = FileStorage(stream=stream, filename=os.path.basename(path),
+                                 content_type=mimetypes.guess_type(path)[0] or "application/octet-stream")
+        for attempt in range(_worker["retries"] + 1):
+            if attempt:
+                time.sleep(min(2 ** attempt, 30))
+                logger.warning("Retrying %s (attempt %d): %s", path, attempt + 1, result.get("error"))
+            result = _worker["service"].transcribe_audio(audio_file, language=_worker["language"],
+                                                         model_id=_worker["model_id"])
+            if result["status"] == "success" or result.get("status_code") not in RETRY_STATUS_CODES:
+                break
+
+    outcome = {
+        "status": result["status"],
+        "model": _worker["model_id"],
+        "audio_seconds": round(seconds, 2),
+        "elapsed_ms": round((time.perf_counter() - start) * 1000, 1),
+    }
+    if estimated:
+        outcome["audio_seconds_estimated"] = True
+    if result["status"] == "success":
+        outcome["text"] = result["text"]
+    else:
+        outcome["error"] = result.get("error", "Failed to transcribe audio")
+    return outcome
+
+def run(directory, output, checkpoint, model_id, language=None, workers=4, retries=2, log_level="INFO"):
+    """
+    Transcribe the new recordings of an archive.
+
+    Args:
+        directory (str): The archive directory.
+        output (str): The JSONL file results are appended to.
+        checkpoint (str): The file recording the content hashes that are done.
+        model_id (str): The transcription model.
+        language (str, optional): The language of the recordings. Defaults to None (auto-detect).
+        workers (int, optional): The number of files transcribed at a time. Defaults to 4.
+        retries (int, optional): Extra attempts for a file after a transient provider error. Defaults to 2.
+        log_level (str, optional): The log level of the worker processes. Defaults to "INFO".
+
+    Returns:
+        dict: The report.
+    """
+    start = time.perf_counter()
+    paths = find_audio_files(directory)
+    done = load_checkpoint(checkpoint)
+
+    # Group the files by content, so each recording is transcribed once
+    groups = {}
+    for path in paths:
+        groups.setdefault(content_hash(path), []).append(path)
+    pending = {digest: files for digest, files in groups.items() if digest not in done}
+    logger.info("%d files, %d distinct recordings, %d already done, %d to transcribe",
+                len(paths), len(groups), len(groups) - len(pending), len(pending))
+
+    report = {
+        "files": len(paths),
+        "duplicates": len(paths) - len(groups),
+        "skipped": len(groups) - len(pending),
+        "transcribed": 0,
+        "failed": 0,
+        "audio_seconds": 0.0,
+    }
+
+    transcribe_start = time.perf_counter()
+    # Worker processes are spawned, not forked, so they do not inherit the log writer thread
+    context = multiprocessing.get_context("spawn")
+    executor = ProcessPoolExecutor(max_workers=max(1, min(workers, len(pending) or 1)), mp_context=context,
+                                   initializer=_init_worker, initargs=(model_id, language, retries, log_level))
+    try:
+        futures = {executor.submit(transcribe_file, files[0]): digest for digest, files in pending.items()}
+        with open(output, "a", encoding="utf-8") as out, open(checkpoint, "a") as marks:
+            for future in as_completed(futures):
+                digest = futures[future]
+                files = pending[digest]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = {"status": "error", "model": model_id, "error": str(e)}
+
+                line = {"path": os.path.relpath(files[0], directory), "sha256": digest}
+                if len(files) > 1:
+                    line["duplicates"] = [os.path.relpath(path, directory) for path in files[1:]]
+                line.update(result)
+                out.write(json.dumps(line, ensure_ascii=False) + "\n")
+                out.flush()
+
+                if result["status"] == "success":
+                    # Marked done only once its line is written, so a crash never loses a transcript
+                    marks.write(digest + "\n")
+                    marks.flush()
+                    report["transcribed"] += 1
+                    report["audio_seconds"] += result["audio_seconds"]
+                else:
+                    report["failed"] += 1
+                    logger.error("Failed to transcribe %s: %s", files[0], result["error"])
+
+                finished = report["transcribed"] + report["failed"]
+                if finished % 10 == 0 or finished == len(pending):
+                    elapsed = time.perf_counter() - transcribe_start
+                    logger.info("%d/%d recordings, %.2f files/s, %.1f audio-s/s", finished, len(pending),
+                                finished / elapsed, report["audio_seconds"] / elapsed)
+    except KeyboardInterrupt:
+        logger.warning("Interrupted; run again with the same output to resume")
+        executor.shutdown(wait=False, cancel_futures=True)
+        raise
+    else:
+        executor.shutdown()
+
+    elapsed = time.perf_counter() - transcribe_start
+    report.update({
+        "audio_seconds": round(report["audio_seconds"], 1),
+        "elapsed_seconds": round(time.perf_counter() - start, 2),
+        "files_per_second": round((report["transcribed"] + report["failed"]) / elapsed, 2) if pending else 0,
+        "audio_seconds_per_second": round(report["audio_seconds"] / elapsed, 1) if pending else 0,
+    })
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("directory", help="The directory of recordings")
+    parser.add_argument("--output", default="transcripts.jsonl", help="The JSONL file results are appended to")
+    parser.add_argument("--checkpoint", help="The progress file (default: <output>.checkpoint)")
+    parser.add_argument("--model", help="The transcription model (default: transcription_model in settings.json)")
+    parser.add_argument("--language", help="The language of the recordings (default: auto-detect)")
+    parser.add_argument("--workers", type=int, default=4, help="Files transcribed at a time")
+    parser.add_argument("--retries", type=int, default=2, help="Extra attempts after a transient provider error")
+    args = parser.parse_args()
+
+    load_dotenv()
+    log_level = os.getenv("LOG_LEVEL", "INFO")
+    setup_logging(level=log_level, stream=sys.stderr)
+
+    model_id = args.model or load_settings()["transcription_model"]
+    model_info = get_model_info(model_id, load_models())
+    if not model_info or not model_info.get("can_transcribe", False):
+        parser.error(f"Model {model_id} cannot transcribe audio")
+    if not os.path.isdir(args.directory):
+        parser.error(f"Not a directory: {args.directory}")
+
+    report = run(args.directory, args.output, args.checkpoint or f"{args.output}.checkpoint", model_id,
+                 args.language, args.workers, args.retries, log_level)
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
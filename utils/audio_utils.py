@@ -1,20 +1,40 @@
 import base64
+import mmap
 
-def audio_to_base64(audio_file):
+def read_audio(audio_file):
     """
-    Convert an audio file to base64.
+    Get the audio data of an upload.
+    
+    Resumable uploads arrive memory-mapped; their map is returned as is rather than copied into
+    memory, since len() and base64 work on it directly.
     
     Args:
         audio_file: The audio file object from Flask's request.files.
         
     Returns:
-        tuple: (audio_base64, audio_data) - The base64-encoded audio and the raw audio data.
+        bytes: The raw audio data (an mmap for memory-mapped uploads).
     """
+    if isinstance(audio_file.stream, mmap.mmap):
+        return audio_file.stream
+    
     # Reset the file pointer to the beginning of the file
     audio_file.stream.seek(0)
     
     # Read the audio data
-    audio_data = audio_file.stream.read()
+    return audio_file.stream.read()
+
+def audio_to_base64(audio_file):
+    """
+    Convert an audio file to base64.
+    
+    Args:
+        audio_file: The audio file object from Flask's request.files.
+        
+    Returns:
+        tuple: (audio_base64, audio_data) - The base64-encoded audio and the raw audio data.
+    """
+    # Read the audio data
+    audio_data = read_audio(audio_file)
     
     # Convert to base64
     audio_base64 = base64.b64encode(audio_data).decode('utf-8')
@@ -0,0 +1,218 @@
+import re
+import threading
+from collections import deque
+
+# Words that carry no intent on their own ("Robert, can you please dance for me?")
+FILLER_WORDS = {
+    "en": {"robert", "hey", "hi", "please", "can", "could", "would", "will", "you", "u", "for", "me", "us",
+           "a", "an", "the", "some", "little", "bit", "now", "again", "do", "go", "ahead", "let's", "lets", "ok", "okay"},
+    "sv": {"robert", "hej", "hallå", "snälla", "kan", "du", "kunde", "skulle", "vill", "för", "mig", "oss",
+           "en", "ett", "lite", "nu", "igen", "gör", "gärna", "okej"},
+}
+
+# Words that flip the meaning of a trigger ("please don't dance")
+NEGATION_WORDS = {"don't", "dont", "not", "no", "never", "stop", "inte", "aldrig", "sluta", "nej"}
+
+TOKEN_PATTERN = re.compile(r"[\w']+", re.UNICODE)
+
+
+def tokenize(text):
+    """
+    Split text into lowercase word tokens.
+
+    Args:
+        text (str): The text to tokenize.
+
+    Returns:
+        list: The tokens.
+    """
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class IntentMatch:
+    """
+    A tool intent found in a user message.
+    """
+
+    def __init__(self, tool_name, language, phrases, confidence):
+        self.tool_name = tool_name
+        self.language = language
+        self.phrases = phrases
+        self.confidence = confidence
+
+    def __repr__(self):
+        return f"IntentMatch(tool={self.tool_name!r}, language={self.language!r}, confidence={self.confidence:.2f})"
+
+
+class IntentMatcher:
+    """
+    Local intent matcher over per-tool trigger phrases.
+
+    Trigger phrases come from the tool manifests ("triggers": {"en": [...], "sv": [...]}) and are
+    compiled into a word-level Aho-Corasick automaton, so a message is scanned once regardless of
+    how many tools and phrases are registered.
+    """
+
+    def __init__(self, manifests):
+        """
+        Initialize the matcher and build the automaton.
+
+        Args:
+            manifests (dict): Tool manifests keyed by tool name (see ToolExecutor.manifests).
+        """
+        self.manifests = manifests
+
+        # Trie nodes: goto transitions, failure links and the phrases ending at each node
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+
+        for tool_name, manifest in manifests.items():
+            for language, phrases in manifest.get("triggers", {}).items():
+                for phrase in phrases:
+                    tokens = tokenize(phrase)
+                    if tokens:
+                        self._add_phrase(tokens, (tool_name, language, phrase, len(tokens)))
+
+        self._build_failure_links()
+
+        # Fast-path statistics
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+        self.total_ms = 0.0
+
+    def _add_phrase(self, tokens, payload):
+        node = 0
+        for token in tokens:
+            if token not in self._goto[node]:
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+                self._goto[node][token] = len(self._goto) - 1
+            node = self._goto[node][token]
+        self._output[node].append(payload)
+
+    def _build_failure_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for token, child in self._goto[node].items():
+                queue.append(child)
+
+                fallback = self._fail[node]
+                while fallback and token not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(token, 0)
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+
+    def find(self, text):
+        """
+        Find all trigger phrases in a text.
+
+        Args:
+            text (str): The text to scan.
+
+        Returns:
+            tuple: (tokens, matches) - The text tokens and a list of
+                   (tool_name, language, phrase, start, end) tuples.
+        """
+        tokens = tokenize(text)
+        matches = []
+
+        node = 0
+        for index, token in enumerate(tokens):
+            while node and token not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(token, 0)
+
+            for tool_name, language, phrase, length in self._output[node]:
+                matches.append((tool_name, language, phrase, index - length + 1, index + 1))
+
+        return tokens, matches
+
+    def match(self, text):
+        """
+        Find the most likely tool intent in a text.
+
+        The confidence is the share of the message's content words (ignoring fillers such as
+        "please" or "can you") that are covered by the tool's trigger phrases. Negated messages
+        never match.
+
+        Args:
+            text (str): The user message or transcript.
+
+        Returns:
+            IntentMatch: The best match, or None if no trigger phrase was found.
+        """
+        if not text:
+            return None
+
+        tokens, matches = self.find(text)
+        if not matches:
+            return None
+
+        if any(token in NEGATION_WORDS for token in tokens):
+            return IntentMatch(matches[0][0], matches[0][1], [], 0.0)
+
+        # Group the covered token positions by tool
+        coverage = {}
+        for tool_name, language, phrase, start, end in matches:
+            entry = coverage.setdefault(tool_name, {"positions": set(), "languages": [], "phrases": []})
+            entry["positions"].update(range(start, end))
+            entry["languages"].append(language)
+            entry["phrases"].append(phrase)
+
+        best = None
+        for tool_name, entry in coverage.items():
+            languages = entry["languages"]
+            language = max(set(languages), key=languages.count)
+            fillers = FILLER_WORDS.get(language, set())
+
+            content_positions = [i for i, token in enumerate(tokens) if token not in fillers or i in entry["positions"]]
+            covered = len([i for i in content_positions if i in entry["positions"]])
+            confidence = covered / len(content_positions) if content_positions else 0.0
+
+            if best is None or confidence > best.confidence:
+                best = IntentMatch(tool_name, language, entry["phrases"], confidence)
+
+        return best
+
+    def get_reply(self, intent, language=None, message=""):
+        """
+        Render the canned reply for a matched intent.
+
+        Args:
+            intent (IntentMatch): The matched intent.
+            language (str, optional): The requested response language. Defaults to None (use the
+                                      language of the matched trigger phrase).
+            message (str, optional): The user message, available to templates as {message}.
+
+        Returns:
+            str: The reply, or None if the tool has no canned reply.
+        """
+        replies = self.manifests.get(intent.tool_name, {}).get("replies", {})
+        template = replies.get(language) or replies.get(intent.language) or replies.get("en")
+        if not template:
+            return None
+
+        return template.format(tool=intent.tool_name, message=message)
+
+    def record(self, hit, elapsed_ms):
+        """
+        Record the outcome of a fast-path lookup.
+
+        Args:
+            hit (bool): Whether the fast path answered the request.
+            elapsed_ms (float): How long the lookup (and tool run, on a hit) took.
+
+        Returns:
+            float: The fast-path hit rate so far.
+        """
+        with self._lock:
+            self.lookups += 1
+            self.total_ms += elapsed_ms
+            if hit:
+                self.hits += 1
+            return self.hits / self.lookups
+
@@ -0,0 +1,176 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import uuid
+from contextvars import ContextVar
+
+# All application loggers live under this name, so third-party loggers keep their own settings
+ROOT_LOGGER = "robert"
+
+# Attributes every LogRecord has; anything else was passed with extra= and is logged as a field
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "request_id"}
+
+_request_id = ContextVar("request_id", default=None)
+_listener = None
+
+def get_logger(name):
+    """
+    Get an application logger.
+
+    Pass arguments separately ("Parsed %r", envelope) rather than pre-formatting the message, so
+    nothing is formatted for records that are filtered out, and the rest are formatted on the
+    writer thread.
+
+    Args:
+        name (str): The module name, usually __name__.
+
+    Returns:
+        logging.Logger: The logger.
+    """
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
+
+def set_request_id(request_id=None):
+    """
+    Set the correlation id attached to log records of the current request.
+
+    Args:
+        request_id (str, optional): An id supplied by the client. Defaults to None (generate one).
+
+    Returns:
+        str: The request id.
+    """
+    request_id = (request_id or "")[:64] or uuid.uuid4().hex
+    _request_id.set(request_id)
+    return request_id
+
+def get_request_id():
+    """Return the correlation id of the current request, or None outside of a request."""
+    return _request_id.get()
+
+def clear_request_id():
+    """Clear the correlation id once the request is done."""
+    _request_id.set(None)
+
+class RequestIdFilter(logging.Filter):
+    """Attaches the current request's correlation id to each record."""
+
+    def filter(self, record):
+        record.request_id = _request_id.get()
+        return True
+
+class DebugSampler(logging.Filter):
+    """Lets through only a fraction of DEBUG records; other levels always pass."""
+
+    def __init__(self, rate=1.0):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno > logging.DEBUG or self.rate >= 1.0 or random.random() < self.rate
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler that hands records to the writer thread unformatted.
+
+    The stock QueueHandler formats the message on the calling thread so records can be pickled;
+    the queue here never leaves the process, so formatting is left to the writer thread.
+    """
+
+    def prepare(self, record):
+        return record
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as one JSON object per line."""
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name[len(ROOT_LOGGER) + 1:] or record.name,
+            "message": record.getMessage()
+        }
+        if getattr(record, "request_id", None):
+            entry["request_id"] = record.request_id
+
+        # Structured fields passed with extra=
+        for key, value in record.__dict__.items():
+            if key not in RECORD_ATTRIBUTES and not key.startswith("_"):
+                entry[key] = value
+
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+
+        return json.dumps(entry, default=str)
+
+class TextFormatter(logging.Formatter):
+    """Human-readable formatter for local development."""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)-7s [%(request_id)s] %(name)s: %(message)s")
+
+    def format(self, record):
+        if not getattr(record, "request_id", None):
+            record.request_id = "-"
+        return super().format(record)
+
+def setup_logging(level=None, log_format=None, debug_sample_rate=None, stream=None):
+    """
+    Configure application logging: records go through a queue to a background writer thread, so
+    request threads never block on stdout.
+
+    The defaults come from the LOG_LEVEL (default INFO), LOG_FORMAT ("json" or "text", default
+    "json") and LOG_DEBUG_SAMPLE_RATE (fraction of DEBUG records kept, default 1.0) environment
+    variables.
+
+    Args:
+        level (str, optional): The minimum level. Defaults to None.
+        log_format (str, optional): "json" or "text". Defaults to None.
+        debug_sample_rate (float, optional): Fraction of DEBUG records to keep. Defaults to None.
+        stream (file, optional): Where to write. Defaults to None (stdout).
+
+    Returns:
+        logging.Logger: The application root logger.
+    """
+    global _listener
+
+    level = (level or os.getenv("LOG_LEVEL", "INFO")).upper()
+    log_format = (log_format or os.getenv("LOG_FORMAT", "json")).lower()
+    if debug_sample_rate is None:
+        try:
+            debug_sample_rate = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "1.0"))
+        except ValueError:
+            debug_sample_rate = 1.0
+
+    # Stop a previous listener so reconfiguring does not leave a second writer thread behind
+    _stop_listener()
+
+    writer = logging.StreamHandler(stream or sys.stdout)
+    writer.setFormatter(JsonFormatter() if log_format == "json" else TextFormatter())
+
+    log_queue = queue.SimpleQueue()
+    handler = LazyQueueHandler(log_queue)
+    handler.addFilter(DebugSampler(debug_sample_rate))
+    handler.addFilter(RequestIdFilter())
+
+    logger = logging.getLogger(ROOT_LOGGER)
+    logger.handlers = [handler]
+    logger.setLevel(level)
+    logger.propagate = False
+
+    _listener = logging.handlers.QueueListener(log_queue, writer)
+    _listener.start()
+
+    return logger
+
+@atexit.register
+def _stop_listener():
+    # Drains the queue, so the last records are written on exit
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
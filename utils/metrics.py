@@ -0,0 +1,340 @@
+import bisect
+import glob
+import json
+import os
+import threading
+import time
+import weakref
+
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Default latency buckets in seconds, from a fast local step to a slow upstream call
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Upload size buckets in bytes, from 10 kB to 25 MB
+SIZE_BUCKETS = (10_000, 50_000, 100_000, 500_000, 1_000_000, 2_500_000, 5_000_000, 10_000_000, 20_000_000, 25_000_000)
+
+class Metric:
+    """
+    Base class for metrics. Values live in per-thread shards owned by the registry, so recording
+    a value never takes a lock; shards are only summed when the metrics are collected.
+    """
+
+    kind = "untyped"
+
+    def __init__(self, registry, name, documentation, labelnames=()):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels):
+        return (self.name, tuple(str(labels.get(label, "")) for label in self.labelnames))
+
+class Counter(Metric):
+    """A monotonically increasing count."""
+
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        """
+        Increase the counter.
+
+        Args:
+            amount (float, optional): The amount to add. Defaults to 1.
+            **labels: The label values.
+        """
+        shard = self.registry.shard()
+        key = self._key(labels)
+        shard[key] = shard.get(key, 0) + amount
+
+class Gauge(Metric):
+    """
+    A value that goes up and down. Increments and decrements are sharded like counters, so the
+    current value is the sum of every thread's changes.
+    """
+
+    kind = "gauge"
+
+    def inc(self, amount=1, **labels):
+        """
+        Increase the gauge.
+
+        Args:
+            amount (float, optional): The amount to add. Defaults to 1.
+            **labels: The label values.
+        """
+        shard = self.registry.shard()
+        key = self._key(labels)
+        shard[key] = shard.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        """
+        Decrease the gauge.
+
+        Args:
+            amount (float, optional): The amount to subtract. Defaults to 1.
+            **labels: The label values.
+        """
+        self.inc(-amount, **labels)
+
+class Histogram(Metric):
+    """A distribution of observed values, counted in buckets."""
+
+    kind = "histogram"
+
+    def __init__(self, registry, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(registry, name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        """
+        Record an observation.
+
+        Args:
+            value (float): The observed value.
+            **labels: The label values.
+        """
+        shard = self.registry.shard()
+        key = self._key(labels)
+        entry = shard.get(key)
+        if entry is None:
+            # One count per bucket plus +Inf, then the sum of all observations
+            entry = shard[key] = [0] * (len(self.buckets) + 1) + [0.0]
+
+        entry[bisect.bisect_left(self.buckets, value)] += 1
+        entry[-1] += value
+
+class MetricsRegistry:
+    """
+    Registry of all metrics, with Prometheus text exposition.
+
+    When the METRICS_DIR environment variable is set, every process periodically writes its
+    values to a file in that directory, and collecting merges the files of all processes, so
+    /metrics reports the totals of every gunicorn worker no matter which one serves the scrape.
+    """
+
+    def __init__(self, multiprocess_dir=None, flush_interval=1.0):
+        """
+        Initialize the registry.
+
+        Args:
+            multiprocess_dir (str, optional): The directory shared by all worker processes.
+                                              Defaults to None (uses METRICS_DIR, or single-process mode).
+            flush_interval (float, optional): The minimum seconds between writes of this process's
+                                              values. Defaults to 1.0.
+        """
+        self.metrics = {}
+        self.multiprocess_dir = multiprocess_dir or os.getenv("METRICS_DIR")
+        self.flush_interval = flush_interval
+
+        self._local = threading.local()
+        # (weak reference to the owning thread, shard) for every thread that recorded a value
+        self._shards = []
+        # The summed values of threads that have exited
+        self._retired = {}
+        self._shards_lock = threading.Lock()
+        self._last_flush = 0.0
+
+    def shard(self):
+        """
+        Get the calling thread's value shard.
+
+        Returns:
+            dict: The shard, mapping (metric name, label values) to a value.
+        """
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._shards_lock:
+                # Pools and threaded servers start threads all the time; fold the shards of the finished ones
+                self._retire_shards()
+                self._shards.append((weakref.ref(threading.current_thread()), shard))
+        return shard
+
+    def _retire_shards(self):
+        """Merge the shards of exited threads into the retired totals. Called with the shards lock held."""
+        live = []
+        for thread_ref, shard in self._shards:
+            thread = thread_ref()
+            if thread is not None and thread.is_alive():
+                live.append((thread_ref, shard))
+                continue
+            # The thread is gone, so nothing writes to its shard any more
+            for key, value in shard.items():
+                self._retired[key] = _merge(self._retired.get(key), value)
+        self._shards = live
+
+    def counter(self, name, documentation, labelnames=()):
+        """Create and register a Counter."""
+        return self._register(Counter(self, name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        """Create and register a Gauge."""
+        return self._register(Gauge(self, name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        """Create and register a Histogram."""
+        return self._register(Histogram(self, name, documentation, labelnames, buckets))
+
+    def _register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def snapshot(self):
+        """
+        Sum the values of every thread in this process.
+
+        Returns:
+            dict: (metric name, label values) mapped to a value (or bucket list for histograms).
+        """
+        with self._shards_lock:
+            self._retire_shards()
+            shards = [shard for _, shard in self._shards]
+            values = {key: _merge(None, value) for key, value in self._retired.items()}
+
+        for shard in shards:
+            # dict.copy() runs without releasing the GIL, so it is safe against concurrent writers
+            for key, value in shard.copy().items():
+                values[key] = _merge(values.get(key), value)
+        return values
+
+    def maybe_flush(self):
+        """Write this process's values to the shared directory if the flush interval has passed."""
+        if self.multiprocess_dir and time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Write this process's values to the shared directory."""
+        if not self.multiprocess_dir:
+            return
+
+        self._last_flush = time.monotonic()
+        values = [[name, list(labels), value] for (name, labels), value in self.snapshot().items()]
+
+        try:
+            os.makedirs(self.multiprocess_dir, exist_ok=True)
+            path = os.path.join(self.multiprocess_dir, f"metrics-{os.getpid()}.json")
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(values, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.error("Error writing metrics file: %s", e)
+
+    def collect(self):
+        """
+        Get the values of every process.
+
+        Counters and histograms of exited workers are kept, since they are cumulative; gauges
+        only count live processes.
+
+        Returns:
+            dict: (metric name, label values) mapped to a value (or bucket list for histograms).
+        """
+        if not self.multiprocess_dir:
+            return self.snapshot()
+
+        self.flush()
+        values = {}
+        for path in glob.glob(os.path.join(self.multiprocess_dir, "metrics-*.json")):
+            try:
+                pid = int(os.path.basename(path)[len("metrics-"):-len(".json")])
+                with open(path, "r") as f:
+                    entries = json.load(f)
+            except (OSError, ValueError):
+                continue
+
+            alive = _pid_alive(pid)
+            for name, labels, value in entries:
+                metric = self.metrics.get(name)
+                if metric is None or (metric.kind == "gauge" and not alive):
+                    continue
+                key = (name, tuple(labels))
+                values[key] = _merge(values.get(key), value)
+        return values
+
+    def render(self):
+        """
+        Render all metrics in the Prometheus text exposition format.
+
+        Returns:
+            str: The exposition text.
+        """
+        values = self.collect()
+        lines = []
+
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+
+            series = sorted(((labels, value) for (name, labels), value in values.items() if name == metric.name),
+                            key=lambda item: item[0])
+            for labels, value in series:
+                label_pairs = list(zip(metric.labelnames, labels))
+                if metric.kind == "histogram":
+                    cumulative = 0
+                    for bound, count in zip(metric.buckets + (float("inf"),), value[:-1]):
+                        cumulative += count
+                        le = "+Inf" if bound == float("inf") else _format_number(bound)
+                        lines.append(f"{metric.name}_bucket{_format_labels(label_pairs + [('le', le)])} {cumulative}")
+                    lines.append(f"{metric.name}_sum{_format_labels(label_pairs)} {_format_number(value[-1])}")
+                    lines.append(f"{metric.name}_count{_format_labels(label_pairs)} {cumulative}")
+                else:
+                    lines.append(f"{metric.name}{_format_labels(label_pairs)} {_format_number(value)}")
+
+        return "\n".join(lines) + "\n"
+
+def _merge(current, value):
+    if current is None:
+        return list(value) if isinstance(value, list) else value
+    if isinstance(value, list):
+        return [a + b for a, b in zip(current, value)]
+    return current + value
+
+def _pid_alive(pid):
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(pairs):
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape_label(value)}"' for name, value in pairs) + "}"
+
+def _format_number(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+# The application's metrics
+registry = MetricsRegistry()
+
+REQUEST_LATENCY = registry.histogram(
+    "robert_request_latency_seconds", "Latency of requests by endpoint and status", ("endpoint", "status"))
+UPSTREAM_LATENCY = registry.histogram(
+    "robert_upstream_latency_seconds", "Latency of provider API calls", ("provider", "model", "operation", "status"))
+TRANSCRIBE_PATHS = registry.counter(
+    "robert_transcribe_path_total", "Transcribe requests answered by each path (direct, two_step, fast_path)", ("path",))
+DIRECT_FALLBACKS = registry.counter(
+    "robert_direct_fallback_total", "Direct audio-to-text attempts that fell back to the two-step process", ("provider", "model"))
+TRANSCRIPT_FIRST_DELTA = registry.histogram(
+    "robert_transcript_first_delta_seconds", "Time until a streamed transcription sent its first partial transcript",
+    ("provider",))
+TOOL_LATENCY = registry.histogram(
+    "robert_tool_execution_seconds", "Tool execution time", ("tool", "cached"))
+UPLOAD_BYTES = registry.histogram(
+    "robert_upload_bytes", "Size of uploaded audio", (), buckets=SIZE_BUCKETS)
+TOKENS = registry.counter(
+    "robert_tokens_total", "Tokens reported by the providers' usage fields", ("provider", "model", "type"))
@@ -0,0 +1,257 @@
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+class SamplingProfiler:
+    """
+    On-demand sampling profiler for request handling threads.
+
+    When armed, a background thread periodically captures the stacks of the threads that are
+    handling profiled requests and counts them as collapsed stacks. A tracemalloc snapshot taken
+    when profiling starts is compared to one taken when it stops. When not armed, the only cost per
+    request is reading the `active` attribute.
+    """
+
+    def __init__(self, interval=0.005, max_depth=64, memory_top=25):
+        """
+        Initialize the profiler.
+
+        Args:
+            interval (float, optional): Default seconds between samples. Defaults to 0.005.
+            max_depth (int, optional): Maximum number of frames kept per stack. Defaults to 64.
+            memory_top (int, optional): Number of allocation sites in the memory diff. Defaults to 25.
+        """
+        self.interval = interval
+        self.max_depth = max_depth
+        self.memory_top = memory_top
+        self.active = False
+        self.result = None
+
+        self._lock = threading.Lock()
+        self._threads = set()
+        self._stacks = {}
+        self._samples = 0
+        self._remaining = None
+        self._profiled = 0
+        self._deadline = None
+        self._started_at = None
+        self._snapshot = None
+        self._started_tracemalloc = False
+        self._interval = interval
+        self._sampler = None
+
+    def start(self, requests=None, seconds=None, interval=None, memory=True):
+        """
+        Start profiling the next requests.
+
+        Args:
+            requests (int, optional): Stop after this many requests have completed. Defaults to None.
+            seconds (float, optional): Stop after this many seconds. Defaults to None.
+            interval (float, optional): Seconds between samples. Defaults to None (the profiler's default).
+            memory (bool, optional): Whether to take a tracemalloc snapshot diff. Defaults to True.
+
+        Returns:
+            dict: The profiler status.
+        """
+        with self._lock:
+            if self.active:
+                return {"status": "error", "error": "Profiling is already running"}
+
+            self._threads = set()
+            self._stacks = {}
+            self._samples = 0
+            self._remaining = requests
+            self._profiled = 0
+            self._started_at = time.monotonic()
+            self._deadline = self._started_at + seconds if seconds else None
+            self._interval = interval or self.interval
+            self.result = None
+
+            if memory:
+                self._started_tracemalloc = not tracemalloc.is_tracing()
+                if self._started_tracemalloc:
+                    tracemalloc.start()
+                self._snapshot = tracemalloc.take_snapshot()
+            else:
+                self._snapshot = None
+
+            self.active = True
+            self._sampler = threading.Thread(target=self._run, name="profiler-sampler", daemon=True)
+            self._sampler.start()
+
+        logger.info("Profiling started (requests=%s, seconds=%s)", requests, seconds)
+        return self.status()
+
+    def begin_request(self):
+        """Profile the current request thread, if the request limit has not been reached."""
+        with self._lock:
+            if not self.active or self._remaining == 0:
+                return
+            if self._remaining is not None:
+                self._remaining -= 1
+            self._threads.add(threading.get_ident())
+
+    def end_request(self):
+        """Stop sampling the current request thread, and stop profiling after the last request."""
+        with self._lock:
+            ident = threading.get_ident()
+            if ident not in self._threads:
+                return
+            self._threads.discard(ident)
+            self._profiled += 1
+            done = self._remaining == 0 and not self._threads
+
+        if done:
+            self.stop()
+
+    def stop(self):
+        """
+        Stop profiling and build the result.
+
+        Returns:
+            dict: The result, or None if profiling was not running.
+        """
+        with self._lock:
+            if not self.active:
+                return None
+            self.active = False
+            self._threads = set()
+
+            memory = []
+            if self._snapshot is not None:
+                snapshot = tracemalloc.take_snapshot().filter_traces([
+                    tracemalloc.Filter(False, tracemalloc.__file__),
+                    tracemalloc.Filter(False, __file__),
+                ])
+                for stat in snapshot.compare_to(self._snapshot, "lineno")[:self.memory_top]:
+                    frame = stat.traceback[0]
+                    memory.append({
+                        "location": f"{frame.filename}:{frame.lineno}",
+                        "size_diff_kb": round(stat.size_diff / 1024, 1),
+                        "size_kb": round(stat.size / 1024, 1),
+                        "count_diff": stat.count_diff
+                    })
+                if self._started_tracemalloc:
+                    tracemalloc.stop()
+                self._snapshot = None
+
+            self.result = {
+                "status": "success",
+                "duration_s": round(time.monotonic() - self._started_at, 3),
+                "requests": self._profiled,
+                "samples": self._samples,
+                "interval": self._interval,
+                "stacks": dict(self._stacks),
+                "memory": memory
+            }
+
+        logger.info("Profiling stopped: %d samples over %d requests", self._samples, self._profiled)
+        return self.result
+
+    def status(self):
+        """
+        Get the profiler status.
+
+        Returns:
+            dict: Whether profiling is running and what has been collected so far.
+        """
+        if self.active:
+            return {
+                "status": "running",
+                "samples": self._samples,
+                "requests": self._profiled,
+                "remaining_requests": self._remaining,
+                "remaining_seconds": round(self._deadline - time.monotonic(), 1) if self._deadline else None
+            }
+        if self.result:
+            return {"status": "finished", "samples": self.result["samples"], "requests": self.result["requests"]}
+        return {"status": "idle"}
+
+    def _run(self):
+        own_ident = threading.get_ident()
+        while self.active:
+            if self._deadline and time.monotonic() >= self._deadline:
+                self.stop()
+                return
+
+            frames = sys._current_frames()
+            for ident in list(self._threads):
+                frame = frames.get(ident)
+                if frame is None or ident == own_ident:
+                    continue
+                stack = self._collapse(frame)
+                self._stacks[stack] = self._stacks.get(stack, 0) + 1
+                self._samples += 1
+
+            time.sleep(self._interval)
+
+    def _collapse(self, frame):
+        names = []
+        while frame is not None and len(names) < self.max_depth:
+            code = frame.f_code
+            names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        return ";".join(reversed(names))
+
+def to_collapsed(stacks):
+    """
+    Format stacks in the collapsed format used by flamegraph.pl and speedscope.
+
+    Args:
+        stacks (dict): Collapsed stacks ("root;...;leaf") mapped to sample counts.
+
+    Returns:
+        str: One "stack count" line per stack.
+    """
+    lines = sorted(stacks.items(), key=lambda item: item[1], reverse=True)
+    return "".join(f"{stack} {count}\n" for stack, count in lines)
+
+def to_speedscope(stacks, interval, name="Robert Chat"):
+    """
+    Format stacks as a speedscope (https://www.speedscope.app) sampled profile.
+
+    Args:
+        stacks (dict): Collapsed stacks ("root;...;leaf") mapped to sample counts.
+        interval (float): The sampling interval in seconds, used as the weight of a sample.
+        name (str, optional): The profile name. Defaults to "Robert Chat".
+
+    Returns:
+        str: The speedscope file contents.
+    """
+    frame_index = {}
+    frames = []
+    samples = []
+    weights = []
+
+    for stack, count in stacks.items():
+        sample = []
+        for frame_name in stack.split(";"):
+            if frame_name not in frame_index:
+                frame_index[frame_name] = len(frames)
+                frames.append({"name": frame_name})
+            sample.append(frame_index[frame_name])
+        samples.append(sample)
+        weights.append(count * interval * 1000)
+
+    return json.dumps({
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "shared": {"frames": frames},
+        "profiles": [{
+            "type": "sampled",
+            "name": name,
+            "unit": "milliseconds",
+            "startValue": 0,
+            "endValue": sum(weights),
+            "samples": samples,
+            "weights": weights
+        }],
+        "name": name,
+        "exporter": "robert-chat"
+    })
@@ -1,12 +1,41 @@
 from models.settings import load_settings
 
-def get_system_prompt(language=None, model_id=None):
+# Structured output schema for the native tool calling mode: the reply text only,
+# since tool calls arrive separately as typed function calls
+RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "response": {
+            "type": "string",
+            "description": "Your response to the user"
+        }
+    },
+    "required": ["response"],
+    "additionalProperties": False
+}
+
+# OpenAI response_format that enforces RESPONSE_SCHEMA
+STRUCTURED_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "robert_response",
+        "strict": True,
+        "schema": RESPONSE_SCHEMA
+    }
+}
+
+def get_system_prompt(language=None, model_id=None, tool_names=None, native_tools=False):
     """
     Generate a system prompt based on the language and model.
     
     Args:
         language (str, optional): The language to use for the prompt. Defaults to None (English).
         model_id (str, optional): The model ID to use. Defaults to None.
+        tool_names (list, optional): The tools to describe in the prompt; an empty list leaves the tool
+                                     section out. Defaults to None (all tools).
+        native_tools (bool, optional): Whether tools are passed through the provider's native function
+                                       calling. If so, the tool descriptions, usage instructions and JSON
+                                       format instructions are left out of the prompt. Defaults to False.
         
     Returns:
         str: The system prompt.
@@ -24,11 +53,16 @@ def get_system_prompt(language=None, model_id=None):
     tools = system_prompt.get("tools", {})
     tool_descriptions = ""
     
-    if tools:
+    # An empty tool selection leaves the tool section out
+    if native_tools and tool_names != []:
+        tool_descriptions += "\nUse the provided tools when the user asks for something a tool can do."
+    elif tools and tool_names != []:
         tool_descriptions += "\nYou have access to the following tools:\n\n"
         
         # Add tool descriptions
         for tool in tools.get("descriptions", []):
+            if tool_names is not None and tool["name"] not in tool_names:
+                continue
             tool_descriptions += f"[{tool['name']}] - {tool['description']}\n"
         
         # Add usage instructions
@@ -36,7 +70,7 @@ def get_system_prompt(language=None, model_id=None):
     
     # Get JSON format instructions
     json_format = system_prompt.get("json_format", {})
-    json_instruction = json_format.get("instructions", "")
+    json_instruction = json_format.get("instructions", "") if not native_tools else ""
     
     # Add language instruction if specified
     language_instruction = f"Please respond in {language}." if language else ""
@@ -0,0 +1,150 @@
+import re
+import json
+
+# Patterns are compiled once at import time, since every model response goes through them
+PREFIX_PATTERN = re.compile(r"^\s*here is my response in json format:\s*", re.IGNORECASE)
+FENCE_PATTERN = re.compile(r"```(?:json)?\s*(.*?)```", re.IGNORECASE | re.DOTALL)
+FIELD_PATTERNS = {
+    "transcription": re.compile(r'"transcription"\s*:\s*"((?:[^"\\]|\\.)*)"'),
+    "response": re.compile(r'"response"\s*:\s*"((?:[^"\\]|\\.)*)"'),
+    "tool_use": re.compile(r'"tool_use"\s*:\s*"((?:[^"\\]|\\.)*)"'),
+}
+# The "Transcription:" label has to start the text or a line, so prose like "here is the transcript: ..." is left alone
+LABEL_PATTERN = re.compile(r"^[ \t]*transcript(?:ion)?[ \t]*:\s*(.*?)(?:\s*\bresponse\s*:\s*(.*))?\Z",
+                           re.IGNORECASE | re.DOTALL | re.MULTILINE)
+TOOL_USE_PATTERN = re.compile(r"tool_use\s*:?\s*\[([^\]]+)\]([^\n\"]*)", re.IGNORECASE)
+DIRECTIVE_PATTERN = re.compile(r"\[([^\]]+)\]([^\n\"]*)")
+# Values models put in 'tool_use' to say that no tool is needed
+NO_TOOL = {"", "none", "n/a", "null", "no", "false"}
+
+class ResponseEnvelope:
+    """
+    The parsed form of a model response.
+
+    Attributes:
+        response (str): The reply to show the user.
+        transcription (str): The transcription, if the model included one, otherwise None.
+        tool_calls (list): The requested tools as (tool_name, args) tuples.
+        format (str): Which output shape was recognized ("json", "fenced", "wrapped", "embedded",
+                      "regex", "labels" or "text").
+    """
+
+    def __init__(self, response, transcription=None, tool_calls=None, format="text"):
+        self.response = response
+        self.transcription = transcription
+        self.tool_calls = tool_calls or []
+        self.format = format
+
+    def __repr__(self):
+        return (f"ResponseEnvelope(format={self.format!r}, response={self.response[:50]!r}, "
+                f"transcription={(self.transcription or '')[:50]!r}, tool_calls={self.tool_calls!r})")
+
+def _load_json_object(text):
+    try:
+        data = json.loads(text)
+    except (json.JSONDecodeError, TypeError):
+        return None
+    return data if isinstance(data, dict) else None
+
+def _unescape(value):
+    try:
+        return json.loads(f'"{value}"')
+    except json.JSONDecodeError:
+        return value
+
+def _add_tool_call(tool_calls, name, args):
+    name = name.strip().lower()
+    if name not in NO_TOOL:
+        tool_calls.append((name, args.strip()))
+
+def _parse_directive(directive, tool_calls):
+    """
+    Add the tools named in a 'tool_use' field value ("tool_use: [dance] args" or "[dance]").
+
+    Only bracketed names count: a bare word is as likely to be "none" or a label as a tool name.
+    """
+    directives = directive if isinstance(directive, list) else [directive]
+
+    for item in directives:
+        if not isinstance(item, str):
+            continue
+        for match in DIRECTIVE_PATTERN.finditer(item):
+            _add_tool_call(tool_calls, match.group(1), match.group(2))
+
+def parse_response(content):
+    """
+    Parse a model response into a ResponseEnvelope in a single pass.
+
+    Handles the output shapes models actually produce: plain JSON, JSON after a "Here is my
+    response in JSON format:" preamble, ```json code fences, the '"json {...}"' wrapper, JSON
+    embedded in prose, malformed JSON (field regexes), "Transcription: ... Response: ..." labels
+    and plain text with a 'tool_use: [tool_name]' directive.
+
+    Args:
+        content (str): The raw model response.
+
+    Returns:
+        ResponseEnvelope: The response text, transcription and tool calls.
+    """
+    text = PREFIX_PATTERN.sub("", (content or "").strip(), count=1)
+
+    data = None
+    format = None
+
+    fence_match = FENCE_PATTERN.search(text)
+    if fence_match:
+        data = _load_json_object(fence_match.group(1).strip())
+        format = "fenced"
+    elif text.startswith('"json {') and text.endswith('}"'):
+        data = _load_json_object(text[1:-1].strip()[4:].strip())
+        format = "wrapped"
+    elif text.startswith("{"):
+        data = _load_json_object(text)
+        format = "json"
+
+    # JSON embedded in surrounding prose
+    if data is None and format != "json":
+        start, end = text.find("{"), text.rfind("}")
+        if 0 <= start < end:
+            data = _load_json_object(text[start:end + 1])
+            format = "embedded"
+
+    tool_calls = []
+    transcription = None
+    response = None
+
+    if data is not None:
+        response = data.get("response")
+        transcription = data.get("transcription")
+        if "tool_use" in data:
+            _parse_directive(data["tool_use"], tool_calls)
+    else:
+        # Malformed JSON: pull the fields out individually
+        fields = {name: pattern.search(text) for name, pattern in FIELD_PATTERNS.items()}
+        if fields["response"]:
+            format = "regex"
+            response = _unescape(fields["response"].group(1))
+            if fields["transcription"]:
+                transcription = _unescape(fields["transcription"].group(1))
+            if fields["tool_use"]:
+                _parse_directive(_unescape(fields["tool_use"].group(1)), tool_calls)
+        else:
+            label_match = LABEL_PATTERN.search(text)
+            if label_match:
+                format = "labels"
+                transcription = label_match.group(1).strip()
+                response = (label_match.group(2) or label_match.group(1)).strip()
+            else:
+                format = "text"
+
+    if response is not None and not isinstance(response, str):
+        response = json.dumps(response)
+    if transcription is not None and not isinstance(transcription, str):
+        transcription = json.dumps(transcription)
+
+    # Fall back to a 'tool_use: [tool_name]' directive anywhere in the raw text
+    if not tool_calls:
+        for match in TOOL_USE_PATTERN.finditer(text):
+            _add_tool_call(tool_calls, match.group(1), match.group(2))
+
+    return ResponseEnvelope(response if response is not None else text, transcription, tool_calls, format)
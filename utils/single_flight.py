@@ -0,0 +1,105 @@
+import threading
+
+from utils.logger import get_logger
+from utils.metrics import registry
+
+logger = get_logger(__name__)
+
+COALESCED = registry.counter(
+    "robert_coalesced_requests_total", "Calls that shared the result of an identical in-flight call", ("group",))
+FLIGHTS = registry.counter(
+    "robert_single_flight_calls_total", "Calls that went upstream on behalf of themselves and any followers", ("group",))
+
+class _Flight:
+    """One in-flight call and, once it is done, its result."""
+
+    def __init__(self):
+        self.done = False
+        self.result = None
+        self.error = None
+        self.followers = 0
+        self.condition = threading.Condition()
+
+    def finish(self, result=None, error=None):
+        with self.condition:
+            self.done = True
+            self.result = result
+            self.error = error
+            self.condition.notify_all()
+
+    def wait(self):
+        with self.condition:
+            while not self.done:
+                self.condition.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent calls: the first caller for a key (the leader) does the work,
+    and callers that arrive while it runs wait for it and share its result instead of repeating it.
+
+    Results are not cached; once the call finishes, the next caller starts a new one.
+    """
+
+    def __init__(self, group="default", enabled=True):
+        """
+        Initialize the coalescer.
+
+        Args:
+            group (str, optional): The name reported in the metrics. Defaults to "default".
+            enabled (bool, optional): Whether calls are coalesced; if not, every caller runs its own
+                                      call. Defaults to True.
+        """
+        self.group = group
+        self.enabled = enabled
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def _join(self, key):
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight.followers += 1
+                return flight, False
+            flight = self._flights[key] = _Flight()
+            return flight, True
+
+    def _land(self, key, flight):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        FLIGHTS.inc(group=self.group)
+        if flight.followers:
+            logger.debug("Single flight %s served %d coalesced calls", self.group, flight.followers)
+
+    def do(self, key, fn):
+        """
+        Run fn, or wait for the identical call already running.
+
+        Args:
+            key (str): Identifies identical calls.
+            fn (callable): Does the call; takes no arguments.
+
+        Returns:
+            tuple: (result, shared) - fn's result, and whether it came from another caller's call.
+        """
+        if not self.enabled:
+            return fn(), False
+
+        flight, leader = self._join(key)
+        if not leader:
+            COALESCED.inc(group=self.group)
+            return flight.wait(), True
+
+        try:
+            result = fn()
+        except BaseException as e:
+            flight.finish(error=e)
+            raise
+        else:
+            flight.finish(result=result)
+            return result, False
+        finally:
+            self._land(key, flight)
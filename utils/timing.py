@@ -0,0 +1,91 @@
+import time
+from contextlib import contextmanager, nullcontext
+
+from flask import g, has_request_context
+
+class RequestTimer:
+    """
+    Collects the duration of each stage of a request for the Server-Timing header.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.spans = {}
+
+    @contextmanager
+    def span(self, name):
+        """
+        Time a block of code. Repeated spans with the same name are added together.
+
+        Args:
+            name (str): The stage name (a Server-Timing metric name, so no spaces).
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, (time.perf_counter() - start) * 1000)
+
+    def add(self, name, duration_ms):
+        """
+        Record a stage duration.
+
+        Args:
+            name (str): The stage name.
+            duration_ms (float): The duration in milliseconds.
+        """
+        self.spans[name] = self.spans.get(name, 0.0) + duration_ms
+
+    def total_ms(self):
+        """Return the time since the timer was created, in milliseconds."""
+        return (time.perf_counter() - self.start) * 1000
+
+    def as_dict(self):
+        """
+        Get the stage durations, including the total.
+
+        Returns:
+            dict: Stage names and durations in milliseconds.
+        """
+        timings = {name: round(duration, 2) for name, duration in self.spans.items()}
+        timings["total"] = round(self.total_ms(), 2)
+        return timings
+
+    def header(self, timings=None):
+        """
+        Format the stage durations as a Server-Timing header value.
+
+        Args:
+            timings (dict, optional): Durations from as_dict(), so the header and a JSON field
+                                      can report the same total. Defaults to None (take them now).
+
+        Returns:
+            str: The header value, e.g. "transcription;dur=812.4, response;dur=1530.2, total;dur=2401.9".
+        """
+        timings = timings or self.as_dict()
+        return ", ".join(f"{name};dur={duration:.1f}" for name, duration in timings.items())
+
+def span(name):
+    """
+    Time a stage of the current request, or do nothing outside of a request.
+
+    Args:
+        name (str): The stage name.
+
+    Returns:
+        A context manager.
+    """
+    timer = g.get("timer") if has_request_context() else None
+    return timer.span(name) if timer else nullcontext()
+
+def add_span(name, duration_ms):
+    """
+    Record a stage duration of the current request, or do nothing outside of a request.
+
+    Args:
+        name (str): The stage name.
+        duration_ms (float): The duration in milliseconds.
+    """
+    timer = g.get("timer") if has_request_context() else None
+    if timer:
+        timer.add(name, duration_ms)
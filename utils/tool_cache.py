@@ -0,0 +1,131 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+class ToolResultCache:
+    """
+    TTL/LRU cache for the output of pure or idempotent tools.
+
+    Entries are keyed on (tool name, normalized args, tool file hash), so editing
+    a tool file automatically invalidates everything cached for it.
+    """
+
+    def __init__(self, max_entries=256, ttl_seconds=300):
+        """
+        Initialize the cache.
+
+        Args:
+            max_entries (int, optional): The maximum number of cached results. Defaults to 256.
+            ttl_seconds (float, optional): How long a cached result stays valid. Defaults to 300.
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._file_hashes = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def normalize_args(args):
+        """
+        Normalize tool arguments so equivalent invocations share a cache entry.
+
+        Args:
+            args (str): The raw argument string from the tool_use directive.
+
+        Returns:
+            str: The arguments with collapsed whitespace.
+        """
+        return " ".join((args or "").split())
+
+    def file_hash(self, tool_path):
+        """
+        Get the SHA-256 hash of a tool file, re-hashing only when the file changes on disk.
+
+        Args:
+            tool_path (str): The path to the tool file.
+
+        Returns:
+            str: The hex digest of the file contents.
+        """
+        stat = os.stat(tool_path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+
+        cached = self._file_hashes.get(tool_path)
+        if cached and cached[0] == signature:
+            return cached[1]
+
+        with open(tool_path, 'rb') as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+
+        with self._lock:
+            previous = self._file_hashes.get(tool_path)
+            self._file_hashes[tool_path] = (signature, digest)
+
+            # The tool changed on disk, so drop everything cached for its old version
+            if previous and previous[1] != digest:
+                stale = [key for key in self._entries if key[2] == previous[1]]
+                for key in stale:
+                    del self._entries[key]
+                logger.info("Tool file changed, invalidated %d cached results: %s", len(stale), tool_path)
+
+        return digest
+
+    def _key(self, tool_name, args, tool_path):
+        return (tool_name, self.normalize_args(args), self.file_hash(tool_path))
+
+    def get(self, tool_name, args, tool_path):
+        """
+        Look up a cached tool result.
+
+        Args:
+            tool_name (str): The name of the tool.
+            args (str): The tool arguments.
+            tool_path (str): The path to the tool file.
+
+        Returns:
+            str: The cached output, or None if there is no valid entry.
+        """
+        key = self._key(tool_name, args, tool_path)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            expires_at, output = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return output
+
+    def put(self, tool_name, args, tool_path, output):
+        """
+        Store a tool result, evicting the least recently used entry when full.
+
+        Args:
+            tool_name (str): The name of the tool.
+            args (str): The tool arguments.
+            tool_path (str): The path to the tool file.
+            output (str): The tool output to cache.
+        """
+        key = self._key(tool_name, args, tool_path)
+
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, output)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Remove all cached results."""
+        with self._lock:
+            self._entries.clear()
@@ -1,20 +1,34 @@
 import os
-import re
+import json
 import subprocess
 import sys
+import time
+
+from utils.tool_cache import ToolResultCache
+from utils.response_parser import parse_response
+from utils.metrics import TOOL_LATENCY
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
 
 class ToolExecutor:
     """
     Class for executing tools based on tool_use directives in AI responses.
     """
     
-    def __init__(self, tools_dir=None):
+    def __init__(self, tools_dir=None, cache=None, claims=None, cancellation=None):
         """
         Initialize the ToolExecutor.
         
         Args:
             tools_dir (str, optional): The directory containing the tools. 
                                       Defaults to None (uses the 'tools' directory in the project).
+            cache (ToolResultCache, optional): The cache for pure/idempotent tool results.
+                                               Defaults to None (creates a new cache).
+            claims (optional): Decides whether a tool may run, so it runs once per Idempotency-Key
+                               (see services.idempotency.IdempotencyStore). Defaults to None (always run).
+            cancellation (optional): Tells whether the current request was cancelled, so its remaining
+                                     tools are skipped (see services.cancellation.skip()). Defaults to None.
         """
         if tools_dir is None:
             # Get the project root directory (parent of the utils directory)
@@ -26,6 +40,18 @@ class ToolExecutor:
         
         # Dictionary of available tools and their file paths
         self.available_tools = self._discover_tools()
+        
+        # Tool manifests (name, description, purity flags, ...) keyed by tool name
+        self.manifests = self._load_manifests()
+        
+        # Cache for the results of tools whose manifest marks them pure or idempotent
+        self.cache = cache or ToolResultCache()
+        
+        # Run-once claims for requests with an Idempotency-Key
+        self.claims = claims
+        
+        # Skips the tools of cancelled requests
+        self.cancellation = cancellation
     
     def _discover_tools(self):
         """
@@ -37,18 +63,55 @@ class ToolExecutor:
         tools = {}
         
         if not os.path.exists(self.tools_dir):
-            print(f"Tools directory not found: {self.tools_dir}")
+            logger.warning("Tools directory not found: %s", self.tools_dir)
             return tools
         
         for filename in os.listdir(self.tools_dir):
-            if filename.endswith('.py'):
+            if filename.endswith('.py') and not filename.startswith('_'):
                 tool_name = filename[:-3]  # Remove the .py extension
                 tool_path = os.path.join(self.tools_dir, filename)
                 tools[tool_name] = tool_path
         
-        print(f"Discovered tools: {', '.join(tools.keys())}")
+        logger.info("Discovered tools: %s", ", ".join(tools))
         return tools
     
+    def _load_manifests(self):
+        """
+        Load the JSON manifest that sits next to each tool (e.g. tools/dance.json).
+        
+        Returns:
+            dict: A dictionary of tool names and their manifests.
+        """
+        manifests = {}
+        
+        for tool_name, tool_path in self.available_tools.items():
+            manifest_path = os.path.splitext(tool_path)[0] + '.json'
+            if not os.path.exists(manifest_path):
+                manifests[tool_name] = {"name": tool_name}
+                continue
+            
+            try:
+                with open(manifest_path, 'r') as f:
+                    manifests[tool_name] = json.load(f)
+            except Exception as e:
+                logger.error("Error loading manifest for tool %s: %s", tool_name, e)
+                manifests[tool_name] = {"name": tool_name}
+        
+        return manifests
+    
+    def is_cacheable(self, tool_name):
+        """
+        Check whether a tool's results can be cached.
+        
+        Args:
+            tool_name (str): The name of the tool.
+            
+        Returns:
+            bool: True if the tool's manifest marks it pure or idempotent.
+        """
+        manifest = self.manifests.get(tool_name, {})
+        return bool(manifest.get("pure") or manifest.get("idempotent"))
+    
     def extract_tool_use(self, response):
         """
         Extract tool_use directives from an AI response.
@@ -59,126 +122,175 @@ class ToolExecutor:
         Returns:
             list: A list of (tool_name, args) tuples.
         """
-        tools = []
+        tools = parse_response(response).tool_calls
+        logger.debug("Extracted tools: %s", tools)
+        return tools
+    
+    def execute_tools(self, response):
+        """
+        Execute tools based on tool_use directives in an AI response.
         
-        print(f"Extracting tool_use from response: {response[:100]}...")
-        
-        # First, try to extract from JSON
-        try:
-            import json
-            json_response = json.loads(response)
-            print(f"Successfully parsed JSON: {json_response.keys()}")
-            if 'tool_use' in json_response:
-                tool_use = json_response['tool_use']
-                print(f"Found tool_use in JSON: {tool_use}")
-                self._extract_tool_from_directive(tool_use, tools)
-            else:
-                print(f"No tool_use field in JSON")
-        except (json.JSONDecodeError, TypeError, KeyError) as e:
-            print(f"Error parsing JSON: {str(e)}")
-        
-        # If no tools found in JSON, try regex
-        if not tools:
-            print("Trying regex extraction")
-            # Look for "tool_use: [tool_name]" pattern with more flexible matching
-            pattern = r'tool_use\s*:?\s*\[([^\]]+)\]'  # Matches tool_use: [dance] or tool_use [dance]
+        Args:
+            response (str): The AI response to extract tool_use directives from.
             
-            matches = list(re.finditer(pattern, response, re.IGNORECASE))
-            print(f"Found {len(matches)} regex matches")
+        Returns:
+            dict: A dictionary with tool results and a formatted message for the user.
+        """
+        logger.debug("Executing tools for response: %.100s...", response)
+        
+        return self.run_tools(self.extract_tool_use(response))
+    
+    def execute_tool_calls(self, tool_calls):
+        """
+        Execute tools from native function calls.
+        
+        Args:
+            tool_calls (list): Tool calls as {"name": str, "arguments": dict}.
             
-            for match in matches:
-                tool_name = match.group(1).lower()
-                # Extract arguments if any (everything after the tool name until the end of the line)
-                args_match = re.search(rf'\[{re.escape(match.group(1))}\](.*?)($|\n)', response[match.end():])
-                args = args_match.group(1).strip() if args_match else ""
-                tools.append((tool_name, args))
-                print(f"Extracted tool from regex: {tool_name} with args: {args}")
+        Returns:
+            dict: A dictionary with tool results and a formatted message for the user.
+        """
+        tools = []
+        for tool_call in tool_calls:
+            # Tools take their arguments on the command line, in schema order
+            arguments = tool_call.get("arguments") or {}
+            args = " ".join(str(value) for value in arguments.values() if value not in (None, ""))
+            tools.append((tool_call["name"].lower(), args))
+            logger.debug("Tool call: %s with arguments: %s", tool_call["name"], arguments)
         
-        return tools
+        return self.run_tools(tools)
     
-    def _extract_tool_from_directive(self, tool_use, tools):
+    def get_tool_declarations(self, tool_names=None):
         """
-        Extract tool name and arguments from a tool_use directive.
+        Get declarations of the available tools for native function calling.
         
         Args:
-            tool_use (str): The tool_use directive.
-            tools (list): The list to append (tool_name, args) tuples to.
-        """
-        # Extract tool name from [tool_name]
-        match = re.search(r'\[([^\]]+)\]', tool_use)
-        if match:
-            tool_name = match.group(1).lower()
-            # Extract arguments if any
-            args = tool_use.replace(f'[{match.group(1)}]', '').strip()
-            tools.append((tool_name, args))
-            print(f"Extracted tool: {tool_name} with args: {args}")
-        else:
-            print(f"No tool name match in tool_use: {tool_use}")
+            tool_names (list, optional): The tools to declare. Defaults to None (all tools).
+            
+        Returns:
+            list: Tool declarations as {"name", "description", "parameters"}.
+        """
+        declarations = []
+        for tool_name in self.available_tools:
+            if tool_names is not None and tool_name not in tool_names:
+                continue
+            
+            manifest = self.manifests.get(tool_name, {})
+            declarations.append({
+                "name": tool_name,
+                "description": manifest.get("description", ""),
+                "parameters": manifest.get("parameters") or {"type": "object", "properties": {}}
+            })
         
-        print(f"Extracted tools: {tools}")
-        return tools
+        return declarations
     
-    def execute_tools(self, response):
+    def run_tools(self, tools):
         """
-        Execute tools based on tool_use directives in an AI response.
+        Execute a list of tools.
         
         Args:
-            response (str): The AI response to extract tool_use directives from.
+            tools (list): A list of (tool_name, args) tuples.
             
         Returns:
             dict: A dictionary with tool results and a formatted message for the user.
         """
-        print(f"\n\n==== EXECUTING TOOLS ====")
-        print(f"Response: {response[:100]}...")
-        
         results = []
-        tools = self.extract_tool_use(response)
         formatted_results = []
+        cache_hits = []
         
         # Prevent duplicate tool executions by using a set to track executed tools
         executed_tools = set()
         
-        print(f"Found {len(tools)} tools to execute")
+        logger.debug("Found %d tools to execute", len(tools))
         
         for tool_name, args in tools:
             # Skip if this tool has already been executed
             if tool_name in executed_tools:
-                print(f"Skipping duplicate execution of tool: {tool_name}")
+                logger.debug("Skipping duplicate execution of tool: %s", tool_name)
                 continue
                 
             # Add to executed tools set
             executed_tools.add(tool_name)
             if tool_name in self.available_tools:
                 tool_path = self.available_tools[tool_name]
+                cacheable = self.is_cacheable(tool_name)
+                
+                # Serve pure/idempotent tools from the cache when possible
+                if cacheable:
+                    try:
+                        cached_output = self.cache.get(tool_name, args, tool_path)
+                    except OSError as e:
+                        logger.error("Error reading tool cache for %s: %s", tool_name, e)
+                        cached_output = None
+                    
+                    if cached_output is not None:
+                        TOOL_LATENCY.observe(0, tool=tool_name, cached="true")
+                        logger.info("Tool %s served from cache: %s", tool_name, cached_output)
+                        formatted_results.append(f"✅ Tool [{tool_name}] executed successfully: {cached_output}")
+                        results.append((tool_name, cached_output))
+                        cache_hits.append(tool_name)
+                        continue
+                
+                # Nobody is waiting for the tools of a cancelled request
+                if self.cancellation is not None and self.cancellation.skip("tool"):
+                    logger.info("Skipping tool %s, the request was cancelled", tool_name)
+                    continue
+                
+                # A retry of an idempotent request gets the output of the tool's earlier run
+                if self.claims is not None:
+                    outcome, previous_output = self.claims.claim_tool(tool_name)
+                    if outcome == "done":
+                        formatted_results.append(f"✅ Tool [{tool_name}] executed successfully: {previous_output}")
+                        results.append((tool_name, previous_output))
+                        continue
+                    if outcome == "failed":
+                        formatted_results.append(f"❌ Tool [{tool_name}] failed: {previous_output}")
+                        results.append((tool_name, previous_output))
+                        continue
+                    if outcome == "running":
+                        logger.info("Tool %s is still running for an earlier attempt of this request", tool_name)
+                        formatted_results.append(f"❌ Tool [{tool_name}] not run: an earlier attempt is still running it")
+                        results.append((tool_name, "Already running"))
+                        continue
+                
                 try:
                     # Execute the tool
                     cmd = [sys.executable, tool_path]
                     if args:
                         cmd.extend(args.split())
                     
-                    print(f"Executing tool: {tool_name} with args: {args}")
-                    print(f"Command: {' '.join(cmd)}")
+                    logger.debug("Executing tool: %s with command: %s", tool_name, cmd)
+                    start = time.perf_counter()
                     process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
                     stdout, stderr = process.communicate()
+                    TOOL_LATENCY.observe(time.perf_counter() - start, tool=tool_name, cached="false")
                     
-                    if process.returncode == 0:
+                    succeeded = process.returncode == 0
+                    if succeeded:
                         output = stdout.strip()
-                        print(f"Tool {tool_name} executed successfully: {output}")
+                        logger.info("Tool %s executed successfully: %s", tool_name, output)
                         formatted_results.append(f"✅ Tool [{tool_name}] executed successfully: {output}")
+                        
+                        if cacheable:
+                            self.cache.put(tool_name, args, tool_path, output)
                     else:
                         output = f"Error: {stderr.strip()}"
-                        print(f"Tool {tool_name} failed: {output}")
+                        logger.warning("Tool %s failed: %s", tool_name, output)
                         formatted_results.append(f"❌ Tool [{tool_name}] failed: {output}")
                     
+                    if self.claims is not None:
+                        self.claims.complete_tool(tool_name, output, ok=succeeded)
                     results.append((tool_name, output))
                 except Exception as e:
                     error = f"Error executing tool {tool_name}: {str(e)}"
-                    print(error)
+                    logger.exception("Error executing tool %s", tool_name)
+                    if self.claims is not None:
+                        self.claims.complete_tool(tool_name, error, ok=False)
                     results.append((tool_name, error))
                     formatted_results.append(f"❌ Tool [{tool_name}] error: {str(e)}")
             else:
                 error = f"Tool not found: {tool_name}"
-                print(error)
+                logger.warning("Tool not found: %s", tool_name)
                 results.append((tool_name, error))
                 formatted_results.append(f"❌ Tool [{tool_name}] not found")
         
@@ -186,14 +298,14 @@ class ToolExecutor:
         user_message = ""
         if formatted_results:
             user_message = "\n\n" + "\n".join(formatted_results)
-            print(f"Formatted message for user: {user_message}")
+            logger.debug("Formatted message for user: %s", user_message)
         else:
-            print("No tools executed, no message for user")
+            logger.debug("No tools executed, no message for user")
         
         result = {
             "results": results,
-            "message": user_message
+            "message": user_message,
+            "cache_hits": cache_hits
         }
         
-        print(f"==== TOOL EXECUTION COMPLETE ====\n\n")
         return result
\ No newline at end of file
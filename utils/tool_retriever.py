@@ -0,0 +1,131 @@
+import math
+from collections import Counter
+
+from utils.intent_matcher import tokenize
+
+def estimate_tokens(text):
+    """
+    Roughly estimate the number of prompt tokens in a text (about 4 characters per token).
+
+    Args:
+        text (str): The text to estimate.
+
+    Returns:
+        int: The estimated token count.
+    """
+    return (len(text) + 3) // 4
+
+class ToolRetriever:
+    """
+    In-memory BM25 index that ranks tools against a user message, so only the most
+    relevant tool descriptions need to go into the system prompt.
+    """
+
+    def __init__(self, descriptions, manifests=None, k1=1.5, b=0.75):
+        """
+        Initialize the retriever and build the index.
+
+        Args:
+            descriptions (list): Tool descriptions from the settings ({"name": ..., "description": ...}).
+            manifests (dict, optional): Tool manifests keyed by tool name. Their "examples" and
+                                        "triggers" are indexed as well. Defaults to None.
+            k1 (float, optional): BM25 term frequency saturation. Defaults to 1.5.
+            b (float, optional): BM25 length normalization. Defaults to 0.75.
+        """
+        manifests = manifests or {}
+        self.k1 = k1
+        self.b = b
+
+        self.names = []
+        self.prompt_tokens = {}
+        self._term_frequencies = []
+        self._lengths = []
+        document_frequencies = Counter()
+
+        for tool in descriptions:
+            name = tool["name"]
+            manifest = manifests.get(name, {})
+
+            text = [name, tool.get("description", ""), manifest.get("description", "")]
+            text.extend(manifest.get("examples", []))
+            for phrases in manifest.get("triggers", {}).values():
+                text.extend(phrases)
+
+            tokens = tokenize(" ".join(text))
+            term_frequencies = Counter(tokens)
+
+            self.names.append(name)
+            self.prompt_tokens[name] = estimate_tokens(f"[{name}] - {tool.get('description', '')}\n")
+            self._term_frequencies.append(term_frequencies)
+            self._lengths.append(len(tokens))
+            document_frequencies.update(term_frequencies.keys())
+
+        count = len(self.names)
+        self._average_length = (sum(self._lengths) / count) if count else 0.0
+        self._idf = {
+            term: math.log(1 + (count - frequency + 0.5) / (frequency + 0.5))
+            for term, frequency in document_frequencies.items()
+        }
+
+    def rank(self, query):
+        """
+        Score every tool against a query.
+
+        Args:
+            query (str): The user message or transcript.
+
+        Returns:
+            list: (tool_name, score) tuples, best first.
+        """
+        query_terms = set(tokenize(query or ""))
+        scores = []
+
+        for index, name in enumerate(self.names):
+            term_frequencies = self._term_frequencies[index]
+            length_norm = 1 - self.b + self.b * (self._lengths[index] / self._average_length if self._average_length else 0)
+
+            score = 0.0
+            for term in query_terms:
+                frequency = term_frequencies.get(term)
+                if frequency:
+                    score += self._idf[term] * frequency * (self.k1 + 1) / (frequency + self.k1 * length_norm)
+            scores.append((name, score))
+
+        scores.sort(key=lambda item: item[1], reverse=True)
+        return scores
+
+    def select(self, query, top_k=5):
+        """
+        Select the tools to include in the system prompt.
+
+        Only the top-k tools that match the query are kept. If the query is empty or no tool
+        matches it at all, every tool is included so the model never loses access to a tool
+        because of a retrieval miss.
+
+        Args:
+            query (str): The user message or transcript.
+            top_k (int, optional): The maximum number of tools to include. Defaults to 5.
+
+        Returns:
+            tuple: (tool_names, info) - The selected tool names and a dictionary with
+                   "selected", "total", "fallback" and "prompt_tokens_saved".
+        """
+        total = len(self.names)
+        selected = list(self.names)
+        fallback = False
+
+        if query and total > top_k:
+            ranked = [name for name, score in self.rank(query)[:top_k] if score > 0]
+            if ranked:
+                selected = ranked
+            else:
+                fallback = True
+
+        saved = sum(tokens for name, tokens in self.prompt_tokens.items() if name not in selected)
+        info = {
+            "selected": len(selected),
+            "total": total,
+            "fallback": fallback,
+            "prompt_tokens_saved": saved
+        }
+        return selected, info